@@ -2,31 +2,87 @@ import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from app.replicas import RoutingSession
 
-db = SQLAlchemy()
+# 会话按请求路由：只读路由的查询可发往只读副本（见 app/replicas.py）
+# 会话按应用上下文划分，gevent worker 中每个协程处理的请求各自使用独立的会话（见 app/serving.py）
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def create_app(config=None):
+    from app.database import (
+        database_uri, replica_uris, engine_options, sqlite_pragmas, apply_sqlite_pragmas,
+        DEFAULT_SQLITE_PROFILE
+    )
+    from app.replicas import init_replicas
+    from app.response_cache import init_response_cache
+    from app.serving import cooperative, patch_database_drivers
+    from app.uploads import DEFAULT_MAX_UPLOAD_SIZE, DEFAULT_THUMBNAIL_SIZE, MULTIPART_OVERHEAD, LimitedRequest
+    from app.bulk import DEFAULT_MAX_IMPORT_SIZE
+    from app.events import default_stream_timeout
+
+    # gevent worker 中需在创建第一个数据库连接前让驱动支持协程切换
+    if cooperative():
+        patch_database_drivers()
 
-def create_app():
     app = Flask(__name__)
+    app.request_class = LimitedRequest
     
-    # 配置
+    # 配置，数据库连接串和连接池参数来自环境变量（见 app/database.py）
     app.config['SECRET_KEY'] = 'gas-system-secret-key-2024'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///gas_system.db'
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+    app.config['SQLALCHEMY_REPLICA_URIS'] = replica_uris()
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # SQLite 连接参数组 production/default，SQLITE_PRAGMAS 可覆盖单项设置
+    app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', DEFAULT_SQLITE_PROFILE)
+    # 统计接口读取增量维护的汇总表（见 app/rollups.py）
+    app.config['STATS_ROLLUPS'] = os.environ.get('STATS_ROLLUPS', '0') == '1'
+    # 进程内身份缓存的有效期（秒），0 表示只在单个请求内缓存（见 app/auth.py）
+    app.config['AUTH_CACHE_TTL'] = float(os.environ.get('AUTH_CACHE_TTL', '0'))
+    # 统计接口的服务端缓存：有效期（秒，0 表示关闭）与共享缓存地址（见 app/response_cache.py）
+    app.config['RESPONSE_CACHE_TTL'] = float(os.environ.get('RESPONSE_CACHE_TTL', '5'))
+    app.config['RESPONSE_CACHE_URL'] = os.environ.get('RESPONSE_CACHE_URL', '')
     app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
+    # 单张照片大小上限（字节）与缩略图长边像素（见 app/uploads.py）
+    app.config['MAX_UPLOAD_SIZE'] = int(os.environ.get('MAX_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE))
+    app.config['THUMBNAIL_SIZE'] = int(os.environ.get('THUMBNAIL_SIZE', DEFAULT_THUMBNAIL_SIZE))
+    # 钢瓶批量导入的请求体上限（字节）
+    app.config['MAX_IMPORT_SIZE'] = int(os.environ.get('MAX_IMPORT_SIZE', DEFAULT_MAX_IMPORT_SIZE))
+    # 设置后 /uploads 交由 nginx 的 internal location 发送文件（X-Accel-Redirect）
+    app.config['UPLOADS_ACCEL_REDIRECT'] = os.environ.get('UPLOADS_ACCEL_REDIRECT', '')
+    # 事件推送单次连接的最长时间（秒），sync worker 下默认短于 WORKER_TIMEOUT（见 app/events.py）
+    app.config['EVENT_STREAM_TIMEOUT'] = float(os.environ.get('EVENT_STREAM_TIMEOUT', default_stream_timeout()))
+    if config:
+        app.config.update(config)
+    # 其余请求的请求体上限：照片上限加 multipart 余量，werkzeug 读取请求体时即按此中止（见 app/uploads.py）
+    if app.config['MAX_CONTENT_LENGTH'] is None:
+        app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_UPLOAD_SIZE'] + MULTIPART_OVERHEAD
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
     
     # 初始化扩展
     db.init_app(app)
     CORS(app, supports_credentials=True)
+    pragmas = sqlite_pragmas(app.config['SQLITE_PROFILE'], app.config.get('SQLITE_PRAGMAS'))
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine, pragmas)
+    init_replicas(app, pragmas)
+    init_response_cache(app)
     
     # 注册蓝图
     from app.auth import auth_bp
     from app.api import api_bp
+    from app.uploads import uploads_bp
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(api_bp, url_prefix='/api')
+    app.register_blueprint(uploads_bp)
     
-    # 创建数据库表
-    with app.app_context():
-        db.create_all()
+    # 创建数据库表，并为已有数据库补建缺失的索引（SCHEMA_AUTO_UPGRADE=False 时跳过，见 python -m app.migrations）
+    from app.migrations import upgrade_schema
+    from app.search import ensure_search_index
+    if app.config.get('SCHEMA_AUTO_UPGRADE', True):
+        with app.app_context():
+            upgrade_schema()
+            # 订单地址、备注的全文索引，返回实际使用的检索方式
+            app.extensions['order_search'] = ensure_search_index(db.engine)
     
     return app
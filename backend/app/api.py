@@ -1,14 +1,42 @@
-import os
+import csv
 import uuid
 from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify, session, current_app
-from sqlalchemy import func, text
+from flask import Blueprint, Response, request, jsonify, session, current_app, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from sqlalchemy.orm import selectinload
 from app import db
 from app.models import (
-    User, Cylinder, Order, SafetyRecord, Announcement, Rating,
+    User, Cylinder, Order, SafetyRecord, Announcement, Rating, OrderCylinder, Job,
     UserRole, CylinderStatus, OrderStatus, HazardLevel
 )
-from app.auth import login_required, role_required, get_current_user
+from app.auth import (
+    login_required, role_required, get_current_user, get_current_identity, invalidate_user
+)
+from app.pagination import paginate, nullable_key
+from app.replicas import replica_read
+from app.http_cache import conditional
+from app.response_cache import cached
+from app.events import emit_order_event, emit_cylinder_event, stream_events
+from app.stats import dashboard_stats, order_trend, delivery_ranking
+from app.rollups import (
+    record_order_created, record_order_assigned,
+    record_order_completed, record_order_cancelled
+)
+from app.inventory import (
+    reserve_cylinders, available_stock, status_counts, reconcile_inventory,
+    InsufficientStockError, ReservationConflictError
+)
+from app.jobs import enqueue, queue_stats
+from app.search import search_filter
+from app.dispatch import dispatch_orders
+from app.routing import plan_route, publish_route
+from app.forecast import restock_plan
+from app.geo import (
+    suggest_couriers, update_courier_location, clear_courier_location, valid_coordinates,
+    DEFAULT_SUGGEST_COUNT, MAX_SUGGEST_COUNT
+)
+from app.uploads import store_photo, UploadError
+from app.bulk import iter_csv_rows, iter_ndjson_rows, import_cylinders, iter_export
 from app.validators import (
     validate_required_fields, validate_cylinder_specs, validate_phone,
     validate_date_format, validate_date_range, validate_user_role,
@@ -18,6 +46,12 @@ from app.validators import (
 
 api_bp = Blueprint('api', __name__)
 
+@api_bp.errorhandler(RequestEntityTooLarge)
+def request_entity_too_large(e):
+    """请求体超过上限（werkzeug 读取请求体时抛出，见 app/uploads.py）"""
+    limit = request.max_content_length
+    return jsonify({'error': f'请求体大小超过上限 {limit // (1024 * 1024)}MB'}), 413
+
 # ==================== 健康检查 ====================
 
 @api_bp.route('/health', methods=['GET'])
@@ -55,8 +89,7 @@ def get_users():
     query = User.query
     if role:
         query = query.filter_by(role=role)
-    users = query.order_by(User.created_at.desc()).all()
-    return jsonify([u.to_dict() for u in users])
+    return paginate(query, [User.created_at, User.id])
 
 @api_bp.route('/users', methods=['POST'])
 @login_required
@@ -102,7 +135,10 @@ def update_user(id):
     user.station_id = data.get('station_id', user.station_id)
     if data.get('password'):
         user.set_password(data['password'])
+    if user.role != 'delivery':
+        clear_courier_location(user.id)
     db.session.commit()
+    invalidate_user(user.id)
     return jsonify(user.to_dict())
 
 @api_bp.route('/users/<int:id>', methods=['DELETE'])
@@ -110,13 +146,16 @@ def update_user(id):
 @role_required(['admin'])
 def delete_user(id):
     user = User.query.get_or_404(id)
+    clear_courier_location(user.id)
     db.session.delete(user)
     db.session.commit()
+    invalidate_user(id)
     return jsonify({'message': '删除成功'})
 
 # ==================== 钢瓶管理 ====================
 
 @api_bp.route('/cylinders', methods=['GET'])
+@replica_read
 @login_required
 def get_cylinders():
     status = request.args.get('status')
@@ -126,8 +165,7 @@ def get_cylinders():
         query = query.filter_by(status=status)
     if specs:
         query = query.filter_by(specs=specs)
-    cylinders = query.order_by(Cylinder.created_at.desc()).all()
-    return jsonify([c.to_dict() for c in cylinders])
+    return paginate(query, [Cylinder.created_at, Cylinder.id])
 
 @api_bp.route('/cylinders', methods=['POST'])
 @login_required
@@ -169,12 +207,69 @@ def create_cylinder():
         db.session.rollback()
         return jsonify({'error': f'创建钢瓶失败: {str(e)}'}), 500
 
+@api_bp.route('/cylinders/bulk', methods=['POST'])
+@login_required
+@role_required(['admin', 'station'])
+def bulk_import_cylinders():
+    # 支持 multipart 文件上传，也支持直接以请求体上传
+    if 'file' in request.files:
+        upload = request.files['file']
+        stream, mimetype, filename = upload.stream, upload.mimetype or '', upload.filename or ''
+    else:
+        stream, mimetype, filename = request.stream, request.mimetype or '', ''
+    
+    fmt = request.args.get('format')
+    if not fmt:
+        if 'ndjson' in mimetype or filename.endswith(('.ndjson', '.jsonl')):
+            fmt = 'ndjson'
+        elif 'csv' in mimetype or filename.endswith('.csv'):
+            fmt = 'csv'
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': '仅支持 CSV 或 NDJSON 格式'}), 400
+    
+    rows = iter_csv_rows(stream) if fmt == 'csv' else iter_ndjson_rows(stream)
+    try:
+        report = import_cylinders(rows)
+        db.session.commit()
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        return jsonify({'error': f'文件解析失败: {str(e)}'}), 400
+    except RequestEntityTooLarge:
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'批量导入失败: {str(e)}'}), 500
+    return jsonify(report)
+
+@api_bp.route('/cylinders/export', methods=['GET'])
+@replica_read
+@login_required
+@role_required(['admin', 'station'])
+def export_cylinders():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': '仅支持 CSV 或 NDJSON 格式'}), 400
+    
+    query = Cylinder.query
+    for field in ('status', 'specs', 'station_id'):
+        if request.args.get(field):
+            query = query.filter_by(**{field: request.args[field]})
+    
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(iter_export(query, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=cylinders.{fmt}'}
+    )
+
 @api_bp.route('/cylinders/<int:id>', methods=['PUT'])
 @login_required
 @role_required(['admin', 'station'])
 def update_cylinder(id):
     cylinder = Cylinder.query.get_or_404(id)
     data = request.get_json()
+    previous_status = cylinder.status
     cylinder.specs = data.get('specs', cylinder.specs)
     cylinder.status = data.get('status', cylinder.status)
     cylinder.manufacturer = data.get('manufacturer', cylinder.manufacturer)
@@ -182,6 +277,7 @@ def update_cylinder(id):
         cylinder.manufacture_date = datetime.strptime(data['manufacture_date'], '%Y-%m-%d').date()
     if data.get('expiry_date'):
         cylinder.expiry_date = datetime.strptime(data['expiry_date'], '%Y-%m-%d').date()
+    emit_cylinder_event(cylinder, previous_status)
     db.session.commit()
     return jsonify(cylinder.to_dict())
 
@@ -203,7 +299,9 @@ def update_cylinder_status(id):
     if new_status not in valid_transitions.get(cylinder.status, []):
         return jsonify({'error': f'不允许从 {cylinder.status} 转换到 {new_status}'}), 400
     
+    previous_status = cylinder.status
     cylinder.status = new_status
+    emit_cylinder_event(cylinder, previous_status)
     db.session.commit()
     return jsonify(cylinder.to_dict())
 
@@ -222,37 +320,73 @@ def delete_cylinder(id):
     return jsonify({'message': '删除成功'})
 
 @api_bp.route('/cylinders/stats', methods=['GET'])
+@replica_read
 @login_required
+@conditional(['cylinders', 'inventory_counters'])
+@cached(['cylinders', 'inventory_counters'])
 def get_cylinder_stats():
-    stats = db.session.query(
-        Cylinder.status,
-        func.count(Cylinder.id)
-    ).group_by(Cylinder.status).all()
-    
-    result = {s.value: 0 for s in CylinderStatus}
-    for status, count in stats:
-        result[status] = count
+    station_id = request.args.get('station_id', type=int)
+    counts = status_counts(station_id)
+    result = {s.value: counts.get(s.value, 0) for s in CylinderStatus}
     
-    # 即将过期的钢瓶
-    expiring_soon = Cylinder.query.filter(
+    # 即将过期的钢瓶（expiry_date 索引范围查询）
+    query = Cylinder.query.filter(
         Cylinder.expiry_date <= datetime.now().date() + timedelta(days=30),
         Cylinder.expiry_date >= datetime.now().date()
-    ).count()
+    )
+    if station_id is not None:
+        query = query.filter_by(station_id=station_id)
     
-    result['expiring_soon'] = expiring_soon
+    result['expiring_soon'] = query.count()
     result['total'] = sum(result.get(s.value, 0) for s in CylinderStatus)
     
     return jsonify(result)
 
+@api_bp.route('/cylinders/stats/reconcile', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def reconcile_cylinder_stats():
+    # ?background=1 时加入任务队列，由 worker 执行
+    if request.args.get('background') == '1':
+        item = enqueue('inventory.reconcile')
+        db.session.commit()
+        return jsonify({'job_id': item.id}), 202
+    drifts = reconcile_inventory()
+    return jsonify({'drifts': drifts})
+
 # ==================== 订单管理 ====================
 
+# 订单列表允许的排序键（sort=键 升序，sort=-键 降序），均以 id 作为次级排序保证游标唯一
+ORDER_SORT_KEYS = {
+    'created_at': [Order.created_at, Order.id],
+    'total_amount': [nullable_key(Order.total_amount, 0), Order.id],
+    'order_no': [Order.order_no, Order.id],
+}
+
 @api_bp.route('/orders', methods=['GET'])
+@replica_read
 @login_required
 def get_orders():
-    user = get_current_user()
-    status = request.args.get('status')
-    
-    query = Order.query
+    user = get_current_identity()
+    args = request.args
+    
+    sort = args.get('sort', '-created_at')
+    keys = ORDER_SORT_KEYS.get(sort.lstrip('-'))
+    if keys is None:
+        return jsonify({'error': f'sort 只支持 {", ".join(ORDER_SORT_KEYS)}，前加 - 表示降序'}), 400
+    
+    start_date, end_date = args.get('start_date'), args.get('end_date')
+    if not validate_date_format(start_date) or not validate_date_format(end_date):
+        return jsonify({'error': '日期格式必须是 YYYY-MM-DD'}), 400
+    delivery_id = args.get('delivery_id')
+    if delivery_id is not None and not delivery_id.isdigit():
+        return jsonify({'error': 'delivery_id 必须是整数'}), 400
+    
+    # 批量预加载下单用户和配送员，避免序列化时逐条查询
+    query = Order.query.options(
+        selectinload(Order.user),
+        selectinload(Order.delivery)
+    )
     
     # 按角色过滤
     if user.role == 'user':
@@ -260,17 +394,33 @@ def get_orders():
     elif user.role == 'delivery':
         query = query.filter_by(delivery_id=user.id)
     
-    if status:
-        query = query.filter_by(status=status)
-    
-    orders = query.order_by(Order.created_at.desc()).all()
-    return jsonify([o.to_dict() for o in orders])
+    for field in ('status', 'specs', 'contact_phone'):
+        if args.get(field):
+            query = query.filter(getattr(Order, field) == args[field])
+    if delivery_id is not None:
+        query = query.filter(Order.delivery_id == int(delivery_id))
+    # 日期均按下单时间，结束日期包含当天
+    if start_date:
+        query = query.filter(Order.created_at >= datetime.strptime(start_date, '%Y-%m-%d'))
+    if end_date:
+        query = query.filter(Order.created_at < datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1))
+    # 订单号前缀用范围条件，可直接使用唯一索引
+    order_no = args.get('order_no')
+    if order_no:
+        query = query.filter(Order.order_no >= order_no, Order.order_no < order_no + '\uffff')
+    # 地址、备注全文检索（见 app/search.py）
+    if args.get('q'):
+        condition = search_filter(args['q'], current_app.extensions.get('order_search', 'like'))
+        if condition is not None:
+            query = query.filter(condition)
+    
+    return paginate(query, keys, descending=sort.startswith('-'))
 
 @api_bp.route('/orders/<int:id>', methods=['GET'])
 @login_required
 def get_order(id):
     order = Order.query.get_or_404(id)
-    user = get_current_user()
+    user = get_current_identity()
     
     # 权限检查
     if user.role == 'user' and order.user_id != user.id:
@@ -297,8 +447,13 @@ def create_order():
     if not validate_positive_integer(quantity):
         return jsonify({'error': '订购数量必须是正整数'}), 400
     
-    # 检查库存
-    available = Cylinder.query.filter_by(specs=specs, status='in_stock').count()
+    # 供货站点，默认为下单用户所属站点
+    station_id = data.get('station_id', user.station_id)
+    if station_id is not None and not validate_positive_integer(station_id):
+        return jsonify({'error': 'station_id 必须是正整数'}), 400
+    
+    # 检查库存（读取计数表，出库时再从供货站点原子认领）
+    available = available_stock(specs, station_id)
     if available < quantity:
         return jsonify({'error': f'{specs} 规格库存不足，当前可用: {available}'}), 400
     
@@ -307,6 +462,11 @@ def create_order():
     if contact_phone and not validate_phone(contact_phone):
         return jsonify({'error': '联系电话格式不正确'}), 400
     
+    # 配送地址坐标（可选，用于推荐就近配送员）
+    latitude, longitude = data.get('latitude'), data.get('longitude')
+    if (latitude is not None or longitude is not None) and not valid_coordinates(latitude, longitude):
+        return jsonify({'error': '坐标必须同时提供有效的 latitude(-90~90) 和 longitude(-180~180)'}), 400
+    
     # 价格配置
     prices = {'5kg': 50, '15kg': 120, '50kg': 350}
     unit_price = prices.get(specs, 120)
@@ -315,6 +475,7 @@ def create_order():
         order = Order(
             order_no=f'ORD{datetime.now().strftime("%Y%m%d%H%M%S")}{str(uuid.uuid4())[:4].upper()}',
             user_id=user.id,
+            station_id=station_id,
             specs=specs,
             quantity=quantity,
             unit_price=unit_price,
@@ -322,16 +483,48 @@ def create_order():
             address=data['address'],
             contact_name=data.get('contact_name') or user.real_name,
             contact_phone=contact_phone,
-            remark=data.get('remark')
+            remark=data.get('remark'),
+            latitude=latitude,
+            longitude=longitude
         )
         
         db.session.add(order)
+        db.session.flush()
+        record_order_created(order)
+        emit_order_event('order.created', order)
         db.session.commit()
         return jsonify(order.to_dict()), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'创建订单失败: {str(e)}'}), 500
 
+@api_bp.route('/orders/dispatch', methods=['POST'])
+@login_required
+@role_required(['admin', 'station'])
+def batch_dispatch_orders():
+    """按距离、负载、载重和库存批量分配待处理订单；站点只能调度本站配送员"""
+    identity = get_current_identity()
+    data = request.get_json(silent=True) or {}
+    
+    station_id = data.get('station_id')
+    if identity.role == 'station':
+        if identity.station_id is None:
+            return jsonify({'error': '当前账号未绑定站点'}), 400
+        station_id = identity.station_id
+    if station_id is not None and not validate_positive_integer(station_id):
+        return jsonify({'error': 'station_id 必须是正整数'}), 400
+    limit = data.get('limit')
+    if limit is not None and not validate_positive_integer(limit):
+        return jsonify({'error': 'limit 必须是正整数'}), 400
+    
+    dry_run = bool(data.get('dry_run'))
+    result = dispatch_orders(
+        int(station_id) if station_id is not None else None,
+        limit=int(limit) if limit is not None else None,
+        dry_run=dry_run
+    )
+    return jsonify({'station_id': station_id, 'dry_run': dry_run, **result})
+
 @api_bp.route('/orders/<int:id>/assign', methods=['PUT'])
 @login_required
 @role_required(['admin', 'station'])
@@ -350,10 +543,75 @@ def assign_order(id):
     order.delivery_id = delivery_id
     order.status = 'assigned'
     order.assigned_at = datetime.utcnow()
+    record_order_assigned(order)
+    emit_order_event('order.assigned', order)
     
     db.session.commit()
     return jsonify(order.to_dict())
 
+@api_bp.route('/orders/<int:id>/suggest-couriers', methods=['GET'])
+@login_required
+@role_required(['admin', 'station'])
+def suggest_order_couriers(id):
+    """按距离和未完成订单数推荐就近的配送员"""
+    order = Order.query.get_or_404(id)
+    if order.latitude is None or order.longitude is None:
+        return jsonify({'error': '订单没有配送地址坐标'}), 400
+    
+    k = request.args.get('k', DEFAULT_SUGGEST_COUNT, type=int)
+    if not 1 <= k <= MAX_SUGGEST_COUNT:
+        return jsonify({'error': f'k 必须在 1 到 {MAX_SUGGEST_COUNT} 之间'}), 400
+    
+    return jsonify({
+        'order_id': order.id,
+        'couriers': suggest_couriers(order.latitude, order.longitude, k)
+    })
+
+@api_bp.route('/couriers/<int:id>/route', methods=['GET'])
+@login_required
+def get_courier_route(id):
+    """配送员未完成订单的建议访问顺序与预计到达时间；配送员只能查看自己的路线"""
+    identity = get_current_identity()
+    if identity.role == 'delivery':
+        if identity.id != id:
+            return jsonify({'error': '无权访问'}), 403
+    elif identity.role not in ('admin', 'station'):
+        return jsonify({'error': '无权访问'}), 403
+    
+    courier = User.query.filter_by(id=id, role='delivery').first()
+    if not courier:
+        return jsonify({'error': '配送员不存在'}), 404
+    return jsonify(plan_route(id))
+
+@api_bp.route('/couriers/location', methods=['PUT'])
+@login_required
+@role_required(['delivery'])
+def report_courier_location():
+    """配送员上报当前位置"""
+    user = get_current_identity()
+    data = request.get_json() or {}
+    latitude, longitude = data.get('latitude'), data.get('longitude')
+    if not valid_coordinates(latitude, longitude):
+        return jsonify({'error': '坐标必须同时提供有效的 latitude(-90~90) 和 longitude(-180~180)'}), 400
+    
+    location = update_courier_location(user.id, latitude, longitude)
+    db.session.commit()
+    return jsonify(location.to_dict())
+
+@api_bp.route('/orders/<int:id>/cylinders', methods=['GET'])
+@login_required
+def get_order_cylinders(id):
+    order = Order.query.get_or_404(id)
+    user = get_current_identity()
+    
+    if user.role == 'user' and order.user_id != user.id:
+        return jsonify({'error': '无权访问'}), 403
+    elif user.role == 'delivery' and order.delivery_id != user.id:
+        return jsonify({'error': '无权访问'}), 403
+    
+    items = OrderCylinder.query.filter_by(order_id=id).order_by(OrderCylinder.id).all()
+    return jsonify([i.to_dict() for i in items])
+
 @api_bp.route('/orders/<int:id>/status', methods=['PUT'])
 @login_required
 def update_order_status(id):
@@ -373,27 +631,63 @@ def update_order_status(id):
     if new_status not in valid_transitions.get(order.status, []):
         return jsonify({'error': f'不允许从 {order.status} 转换到 {new_status}'}), 400
     
+    previous_status = order.status
     order.status = new_status
     if new_status == 'completed':
         order.completed_at = datetime.utcnow()
-        # 更新钢瓶状态
-        cylinders = Cylinder.query.filter_by(
-            specs=order.specs, 
-            status='in_stock'
-        ).limit(order.quantity).all()
-        for c in cylinders:
-            c.status = 'in_use'
+        # 原子认领在库钢瓶并记录出库明细
+        try:
+            cylinders = reserve_cylinders(order)
+        except InsufficientStockError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        except ReservationConflictError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 409
+        record_order_completed(order)
+        for cylinder in cylinders:
+            emit_cylinder_event(cylinder, 'in_stock', order_id=order.id)
+    elif new_status == 'cancelled':
+        record_order_cancelled(order)
+    emit_order_event('order.status_changed', order, previous_status=previous_status)
+    if new_status == 'delivering' and order.delivery_id:
+        # 出发配送时按剩余订单重新规划路线并推送给配送员
+        publish_route(order.delivery_id)
     
     db.session.commit()
     return jsonify(order.to_dict())
 
+# ==================== 实时事件 ====================
+
+@api_bp.route('/events/stream', methods=['GET'])
+@login_required
+def stream_order_events():
+    """SSE 推送订单、钢瓶状态变更，按角色过滤，支持 Last-Event-ID 断点续传"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_event_id is not None:
+        if not last_event_id.isdigit():
+            return jsonify({'error': 'Last-Event-ID 必须是非负整数'}), 400
+        last_event_id = int(last_event_id)
+
+    # 身份在开始推送前确定，推送过程中不再访问请求上下文中的会话
+    identity = get_current_identity()
+    return Response(
+        stream_with_context(stream_events(identity, last_event_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # ==================== 安全管理 ====================
 
 @api_bp.route('/safety/records', methods=['GET'])
+@replica_read
 @login_required
 def get_safety_records():
-    user = get_current_user()
-    query = SafetyRecord.query
+    user = get_current_identity()
+    query = SafetyRecord.query.options(
+        selectinload(SafetyRecord.order),
+        selectinload(SafetyRecord.inspector)
+    )
     
     if user.role == 'delivery':
         query = query.filter_by(inspector_id=user.id)
@@ -402,13 +696,12 @@ def get_safety_records():
     if hazard_level:
         query = query.filter_by(hazard_level=hazard_level)
     
-    records = query.order_by(SafetyRecord.created_at.desc()).all()
-    return jsonify([r.to_dict() for r in records])
+    return paginate(query, [SafetyRecord.created_at, SafetyRecord.id])
 
 @api_bp.route('/safety/records', methods=['POST'])
 @login_required
 def create_safety_record():
-    user = get_current_user()
+    user = get_current_identity()
     data = request.get_json()
     
     record = SafetyRecord(
@@ -428,27 +721,24 @@ def create_safety_record():
 @api_bp.route('/safety/upload', methods=['POST'])
 @login_required
 def upload_safety_photo():
-    if 'file' not in request.files:
-        return jsonify({'error': '没有上传文件'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': '没有选择文件'}), 400
+    # 请求体超过 MAX_CONTENT_LENGTH 时 werkzeug 在读取或解析表单时即以 413 中止（含无 Content-Length 的分块请求）
+    # 请求体直接是图片时边读边写，不经过表单解析
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        stream = request.stream
+    else:
+        if 'file' not in request.files:
+            return jsonify({'error': '没有上传文件'}), 400
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'error': '没有选择文件'}), 400
+        stream = file.stream
     
-    # 生成文件名
-    ext = file.filename.rsplit('.', 1)[-1] if '.' in file.filename else 'jpg'
-    filename = f'{datetime.now().strftime("%Y%m%d%H%M%S")}_{uuid.uuid4().hex[:8]}.{ext}'
-    
-    # 保存文件
-    upload_folder = current_app.config['UPLOAD_FOLDER']
-    os.makedirs(upload_folder, exist_ok=True)
-    filepath = os.path.join(upload_folder, filename)
-    file.save(filepath)
-    
-    return jsonify({
-        'filename': filename,
-        'url': f'/uploads/{filename}'
-    })
+    try:
+        result = store_photo(stream)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    db.session.commit()
+    return jsonify(result)
 
 @api_bp.route('/safety/records/<int:id>', methods=['PUT'])
 @login_required
@@ -467,111 +757,94 @@ def update_safety_record(id):
 
 # ==================== 统计分析 ====================
 
+# 统计面板轮询频繁，允许浏览器复用 10 秒内的结果
+STATS_CACHE_CONTROL = 'private, max-age=10'
+
 @api_bp.route('/stats/dashboard', methods=['GET'])
+@replica_read
 @login_required
+@conditional(['orders', 'cylinders', 'users'], cache_control=STATS_CACHE_CONTROL)
+@cached(['orders', 'cylinders', 'users'])
 def get_dashboard_stats():
-    # 订单统计
-    total_orders = Order.query.count()
-    pending_orders = Order.query.filter_by(status='pending').count()
-    completed_orders = Order.query.filter_by(status='completed').count()
-    
-    # 钢瓶统计
-    total_cylinders = Cylinder.query.count()
-    in_stock = Cylinder.query.filter_by(status='in_stock').count()
-    
-    # 用户统计
-    total_users = User.query.filter_by(role='user').count()
-    total_delivery = User.query.filter_by(role='delivery').count()
-    
-    # 今日订单
-    today = datetime.now().date()
-    today_orders = Order.query.filter(
-        func.date(Order.created_at) == today
-    ).count()
-    
-    # 今日收入
-    today_revenue = db.session.query(func.sum(Order.total_amount)).filter(
-        func.date(Order.completed_at) == today,
-        Order.status == 'completed'
-    ).scalar() or 0
-    
-    return jsonify({
-        'total_orders': total_orders,
-        'pending_orders': pending_orders,
-        'completed_orders': completed_orders,
-        'total_cylinders': total_cylinders,
-        'in_stock': in_stock,
-        'total_users': total_users,
-        'total_delivery': total_delivery,
-        'today_orders': today_orders,
-        'today_revenue': float(today_revenue)
-    })
+    return jsonify(dashboard_stats())
 
 @api_bp.route('/stats/orders/trend', methods=['GET'])
+@replica_read
 @login_required
+@conditional(['orders'], cache_control=STATS_CACHE_CONTROL)
+@cached(['orders'])
 def get_order_trend():
     days = int(request.args.get('days', 7))
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=days-1)
-    
-    # 查询每日订单数
-    results = db.session.query(
-        func.date(Order.created_at).label('date'),
-        func.count(Order.id).label('count')
-    ).filter(
-        func.date(Order.created_at) >= start_date,
-        func.date(Order.created_at) <= end_date
-    ).group_by(func.date(Order.created_at)).all()
-    
-    # 填充缺失的日期
-    date_counts = {str(r.date): r.count for r in results}
-    trend = []
-    for i in range(days):
-        date = start_date + timedelta(days=i)
-        trend.append({
-            'date': str(date),
-            'count': date_counts.get(str(date), 0)
-        })
-    
-    return jsonify(trend)
+    return jsonify(order_trend(days))
 
 @api_bp.route('/stats/delivery/ranking', methods=['GET'])
+@replica_read
 @login_required
+@conditional(['orders', 'users'], cache_control=STATS_CACHE_CONTROL)
+@cached(['orders', 'users'])
 def get_delivery_ranking():
-    results = db.session.query(
-        User.id,
-        User.username,
-        User.real_name,
-        func.count(Order.id).label('order_count')
-    ).join(
-        Order, Order.delivery_id == User.id
-    ).filter(
-        Order.status == 'completed'
-    ).group_by(User.id).order_by(func.count(Order.id).desc()).limit(10).all()
-    
-    return jsonify([{
-        'id': r.id,
-        'username': r.username,
-        'real_name': r.real_name,
-        'order_count': r.order_count
-    } for r in results])
+    return jsonify(delivery_ranking())
+
+@api_bp.route('/stats/forecast', methods=['GET'])
+@replica_read
+@login_required
+@role_required(['admin', 'station'])
+def get_demand_forecast():
+    """各站点、规格的需求预测与补货建议；站点只能查看本站"""
+    identity = get_current_identity()
+    station_id = request.args.get('station_id', type=int)
+    if identity.role == 'station':
+        station_id = identity.station_id or 0
+    specs = request.args.get('specs')
+    if specs and not validate_cylinder_specs(specs):
+        return jsonify({'error': '钢瓶规格必须是 5kg, 15kg 或 50kg'}), 400
+    return jsonify({'station_id': station_id, **restock_plan(station_id, specs)})
+
+@api_bp.route('/stats/cache', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def get_cache_stats():
+    cache = current_app.extensions.get('response_cache')
+    return jsonify(cache.snapshot() if cache else {})
+
+# ==================== 后台任务 ====================
+
+@api_bp.route('/jobs', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def get_jobs():
+    query = Job.query
+    status = request.args.get('status')
+    if status:
+        query = query.filter_by(status=status)
+    name = request.args.get('name')
+    if name:
+        query = query.filter_by(name=name)
+    return paginate(query, [Job.created_at, Job.id])
+
+@api_bp.route('/jobs/stats', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def get_job_stats():
+    return jsonify(queue_stats())
 
 # ==================== 公告管理 ====================
 
 @api_bp.route('/announcements', methods=['GET'])
 @login_required
+@conditional(['announcements', 'users'])
 def get_announcements():
-    announcements = Announcement.query.order_by(
-        Announcement.is_top.desc(),
-        Announcement.created_at.desc()
-    ).all()
-    return jsonify([a.to_dict() for a in announcements])
+    # 置顶公告优先，置顶标记作为排序键的第一列（可为空，按 False 计）
+    return paginate(
+        Announcement.query.options(selectinload(Announcement.author)),
+        [nullable_key(Announcement.is_top, False), Announcement.created_at, Announcement.id]
+    )
 
 @api_bp.route('/announcements', methods=['POST'])
 @login_required
 @role_required(['admin'])
 def create_announcement():
-    user = get_current_user()
+    user = get_current_identity()
     data = request.get_json()
     
     announcement = Announcement(
@@ -613,7 +886,7 @@ def update_announcement(id):
 @api_bp.route('/ratings', methods=['POST'])
 @login_required
 def create_rating():
-    user = get_current_user()
+    user = get_current_identity()
     data = request.get_json()
     
     order_id = data.get('order_id')
@@ -649,8 +922,7 @@ def get_ratings():
     if order_id:
         query = query.filter_by(order_id=order_id)
     
-    ratings = query.order_by(Rating.created_at.desc()).all()
-    return jsonify([r.to_dict() for r in ratings])
+    return paginate(query, [Rating.created_at, Rating.id])
 
 @api_bp.route('/orders/<int:id>/rating', methods=['GET'])
 @login_required
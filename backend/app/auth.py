@@ -1,10 +1,103 @@
+import threading
+import time
+from collections import namedtuple
 from functools import wraps
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, g, current_app
 from app import db
 from app.models import User
 
 auth_bp = Blueprint('auth', __name__)
 
+# 鉴权只需要的用户身份信息，可脱离数据库会话缓存
+Identity = namedtuple('Identity', ['id', 'role', 'station_id'])
+
+
+class IdentityCache:
+    """进程内的短 TTL 身份缓存，用户被修改或删除时由接口主动失效"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, identity = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            return identity
+
+    def put(self, identity, ttl):
+        with self._lock:
+            self._entries[identity.id] = (time.monotonic() + ttl, identity)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+def identity_cache():
+    """当前应用的身份缓存，未开启 AUTH_CACHE_TTL 时返回 None"""
+    if current_app.config.get('AUTH_CACHE_TTL', 0) <= 0:
+        return None
+    return current_app.extensions.setdefault('auth_identity_cache', IdentityCache())
+
+
+def invalidate_user(user_id):
+    """用户角色、站点变更或被删除后清除其缓存的身份"""
+    cache = identity_cache()
+    if cache is not None:
+        cache.invalidate(user_id)
+    if getattr(g, 'current_identity', None) is not None and g.current_identity.id == user_id:
+        g.pop('current_identity')
+        g.pop('current_user', None)
+
+
+@auth_bp.before_app_request
+def reset_request_identity():
+    """请求缓存放在 g 上；应用上下文可能跨请求复用（如测试），每个请求开始时清空"""
+    g.pop('current_identity', None)
+    g.pop('current_user', None)
+
+
+def get_current_user():
+    """当前登录用户，每个请求最多查询一次"""
+    if 'user_id' not in session:
+        return None
+    if 'current_user' not in g:
+        user = db.session.get(User, session['user_id'])
+        g.current_user = user
+        if user is not None:
+            _remember(Identity(user.id, user.role, user.station_id))
+    return g.current_user
+
+
+def get_current_identity():
+    """当前登录用户的身份，优先读取请求缓存和进程缓存，都未命中时才查询用户表"""
+    if 'user_id' not in session:
+        return None
+    identity = g.get('current_identity')
+    if identity is not None:
+        return identity
+    cache = identity_cache()
+    identity = cache.get(session['user_id']) if cache is not None else None
+    if identity is not None:
+        g.current_identity = identity
+        return identity
+    get_current_user()
+    return g.get('current_identity')
+
+
+def _remember(identity):
+    g.current_identity = identity
+    cache = identity_cache()
+    if cache is not None:
+        cache.put(identity, current_app.config['AUTH_CACHE_TTL'])
+
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -19,18 +112,13 @@ def role_required(roles):
         def decorated_function(*args, **kwargs):
             if 'user_id' not in session:
                 return jsonify({'error': '请先登录'}), 401
-            user = User.query.get(session['user_id'])
-            if not user or user.role not in roles:
+            identity = get_current_identity()
+            if not identity or identity.role not in roles:
                 return jsonify({'error': '权限不足'}), 403
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
-def get_current_user():
-    if 'user_id' in session:
-        return User.query.get(session['user_id'])
-    return None
-
 # ==================== 认证接口 ====================
 
 @auth_bp.route('/login', methods=['POST'])
@@ -71,7 +159,7 @@ def logout():
 @auth_bp.route('/me', methods=['GET'])
 @login_required
 def get_current_user_info():
-    user = User.query.get(session['user_id'])
+    user = get_current_user()
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     return jsonify(user.to_dict())
@@ -0,0 +1,191 @@
+"""
+钢瓶批量导入导出模块
+导入：逐行读取 CSV / NDJSON 上传内容，按块校验后用 executemany 批量插入，
+整个导入在一个事务内完成，返回逐行错误报告
+导出：按块从数据库读取并逐行编码输出，内存占用与库存规模无关
+"""
+import csv
+import io
+import json
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import insert
+from app import db
+from app.models import Cylinder
+from app.inventory import apply_deltas, counter_key
+from app.streaming import chunked
+from app.validators import (
+    validate_cylinder_specs, validate_cylinder_status,
+    validate_date_format, validate_date_range
+)
+
+
+BULK_CHUNK_SIZE = 500
+DEFAULT_MAX_IMPORT_SIZE = 200 * 1024 * 1024   # 导入文件的请求体上限
+
+EXPORT_FIELDS = [
+    'id', 'serial_code', 'specs', 'status', 'manufacturer',
+    'manufacture_date', 'expiry_date', 'last_check_date', 'station_id', 'created_at'
+]
+
+
+# ==================== 解析 ====================
+
+def iter_csv_rows(stream):
+    """逐行解析 CSV，产出 (行号, 字段字典)"""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield reader.line_num, {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+
+
+def iter_ndjson_rows(stream):
+    """逐行解析 NDJSON，空行跳过，无法解析的行以 None 产出"""
+    for line_no, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8-sig'), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_no, row if isinstance(row, dict) else None
+
+
+# ==================== 导入 ====================
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def validate_row(row):
+    """校验单行并转换为插入参数，返回 (参数, 错误信息)"""
+    if row is None:
+        return None, '无法解析的行'
+    missing = [field for field in ('serial_code', 'specs') if not row.get(field)]
+    if missing:
+        return None, f'缺少必填字段: {", ".join(missing)}'
+    if not validate_cylinder_specs(row['specs']):
+        return None, '钢瓶规格必须是 5kg, 15kg 或 50kg'
+    status = row.get('status') or 'in_stock'
+    if not validate_cylinder_status(status):
+        return None, '无效的钢瓶状态'
+    for field, label in (('manufacture_date', '生产日期'), ('expiry_date', '有效期'), ('last_check_date', '检验日期')):
+        if row.get(field) and not validate_date_format(row[field]):
+            return None, f'{label}格式不正确，应为 YYYY-MM-DD'
+    if row.get('manufacture_date') and row.get('expiry_date'):
+        if not validate_date_range(row['manufacture_date'], row['expiry_date']):
+            return None, '有效期必须晚于生产日期'
+    station_id = row.get('station_id')
+    if station_id in ('', None):
+        station_id = None
+    else:
+        try:
+            station_id = int(station_id)
+        except (ValueError, TypeError):
+            return None, '站点ID必须是整数'
+
+    return {
+        'serial_code': str(row['serial_code']),
+        'specs': row['specs'],
+        'status': status,
+        'manufacturer': row.get('manufacturer') or None,
+        'manufacture_date': _parse_date(row.get('manufacture_date')),
+        'expiry_date': _parse_date(row.get('expiry_date')),
+        'last_check_date': _parse_date(row.get('last_check_date')),
+        'station_id': station_id
+    }, None
+
+
+def _flush_chunk(chunk, seen, errors):
+    """插入一个块：剔除与数据库重复的编号后 executemany，返回插入行数"""
+    serials = [params['serial_code'] for _, params in chunk]
+    existing = {
+        serial for (serial,) in db.session.query(Cylinder.serial_code).filter(
+            Cylinder.serial_code.in_(serials)
+        )
+    }
+    rows = []
+    for line_no, params in chunk:
+        if params['serial_code'] in existing:
+            errors.append({'line': line_no, 'serial_code': params['serial_code'], 'error': '钢瓶编号已存在'})
+            seen.discard(params['serial_code'])
+        else:
+            rows.append(params)
+    if not rows:
+        return 0
+
+    now = datetime.utcnow()
+    for params in rows:
+        params['created_at'] = now
+        params['updated_at'] = now
+    db.session.execute(insert(Cylinder.__table__), rows)
+
+    # executemany 不触发 mapper 事件，显式更新库存计数
+    deltas = Counter(counter_key(r['station_id'], r['specs'], r['status']) for r in rows)
+    apply_deltas(db.session.connection(), deltas)
+    return len(rows)
+
+
+def import_cylinders(rows, chunk_size=BULK_CHUNK_SIZE):
+    """
+    批量导入钢瓶，rows 为 (行号, 字段字典) 的迭代器
+
+    有效行在同一事务内分块插入，无效行记录到错误报告；调用方负责提交
+    """
+    inserted = 0
+    errors = []
+    seen = set()
+    chunk = []
+    for line_no, row in rows:
+        params, error = validate_row(row)
+        if error is None and params['serial_code'] in seen:
+            error = '文件内钢瓶编号重复'
+        if error:
+            errors.append({
+                'line': line_no,
+                'serial_code': row.get('serial_code') if isinstance(row, dict) else None,
+                'error': error
+            })
+            continue
+        seen.add(params['serial_code'])
+        chunk.append((line_no, params))
+        if len(chunk) >= chunk_size:
+            inserted += _flush_chunk(chunk, seen, errors)
+            chunk = []
+    if chunk:
+        inserted += _flush_chunk(chunk, seen, errors)
+
+    errors.sort(key=lambda e: e['line'])
+    return {'inserted': inserted, 'failed': len(errors), 'errors': errors}
+
+
+# ==================== 导出 ====================
+
+def _export_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def iter_export(query, fmt, chunk_size=BULK_CHUNK_SIZE):
+    """按块读取钢瓶并编码为 CSV 或 NDJSON，每块输出一次"""
+    columns = [getattr(Cylinder, field) for field in EXPORT_FIELDS]
+    rows = query.with_entities(*columns).order_by(Cylinder.id).execution_options(yield_per=chunk_size)
+
+    if fmt == 'csv':
+        lines = _iter_csv_lines(rows)
+    else:
+        lines = (
+            json.dumps({f: _export_value(v) for f, v in zip(EXPORT_FIELDS, row)}, ensure_ascii=False) + '\n'
+            for row in rows
+        )
+    return chunked(lines, chunk_size)
+
+
+def _iter_csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield '\ufeff' + buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(['' if v is None else _export_value(v) for v in row])
+        yield buffer.getvalue()
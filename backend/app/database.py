@@ -0,0 +1,105 @@
+"""
+数据库配置与方言兼容工具
+连接串和连接池参数从环境变量读取，默认仍使用 SQLite；
+切换到 PostgreSQL/MySQL 时启用连接池的大小、溢出、预检和回收设置。
+SQLite 在每个新连接上应用 SQLITE_PROFILE 对应的 PRAGMA 参数组。
+按日期分组等依赖方言的 SQL 通过本模块的构造统一生成
+"""
+import os
+from sqlalchemy import Date, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+
+DEFAULT_DATABASE_URI = 'sqlite:///gas_system.db'
+
+# 连接池默认值：两个 gunicorn worker 各自持有一个连接池
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 20
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 1800
+
+
+def database_uri(environ=os.environ):
+    """读取 DATABASE_URL，兼容 postgres:// 旧写法"""
+    uri = environ.get('DATABASE_URL') or DEFAULT_DATABASE_URI
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def replica_uris(environ=os.environ):
+    """读取 DATABASE_REPLICA_URLS（逗号分隔）中的只读副本连接串"""
+    uris = [uri.strip() for uri in environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri.strip()]
+    return ['postgresql://' + uri[len('postgres://'):] if uri.startswith('postgres://') else uri for uri in uris]
+
+
+def engine_options(uri, environ=os.environ):
+    """按数据库类型生成 SQLALCHEMY_ENGINE_OPTIONS"""
+    if make_url(uri).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': int(environ.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW)),
+        'pool_timeout': int(environ.get('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', DEFAULT_POOL_RECYCLE)),
+        'pool_pre_ping': True,
+    }
+
+
+# SQLite PRAGMA 参数组，按 SQLITE_PROFILE 选择
+# production: WAL 模式下读写互不阻塞，写锁冲突时等待而不是立即报 database is locked；
+# synchronous=NORMAL 在 WAL 下只在检查点时 fsync，断电最多丢失最近提交但不会损坏数据库
+SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        'busy_timeout': 5000,
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+
+DEFAULT_SQLITE_PROFILE = 'production'
+
+
+def sqlite_pragmas(profile, overrides=None):
+    """返回参数组的 PRAGMA 设置，overrides 中的同名项优先"""
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f'未知的 SQLite 参数组: {profile}')
+    return {**SQLITE_PROFILES[profile], **(overrides or {})}
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """在 SQLite 引擎的每个新连接上执行 PRAGMA"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+class day_of(FunctionElement):
+    """取日期时间列的日期部分，SQLite 用 date()，其他数据库用 CAST(... AS DATE)"""
+    type = Date()
+    name = 'day_of'
+    inherit_cache = True
+
+
+@compiles(day_of)
+def _compile_day_of(element, compiler, **kw):
+    return 'CAST(%s AS DATE)' % compiler.process(element.clauses, **kw)
+
+
+@compiles(day_of, 'sqlite')
+def _compile_day_of_sqlite(element, compiler, **kw):
+    return 'date(%s)' % compiler.process(element.clauses, **kw)
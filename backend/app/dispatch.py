@@ -0,0 +1,288 @@
+"""
+批量自动派单模块
+早高峰时一次性把待处理订单分配给站点内在岗的配送员:
+
+1. 读取 pending 订单（按下单时间，最多 DISPATCH_BATCH_LIMIT 条）、站点配送员的位置与未完成订单，
+   以及各规格的可用库存（在库数量减去已分配未完成订单的数量）；指定站点时只读取供货站点为该站的订单和库存
+2. 计算订单 × 配送员的距离矩阵，超过 DISPATCH_MAX_DISTANCE_KM 的组合不参与分配
+3. 贪心求解：每次取代价最低的 (订单, 配送员) 组合，代价为
+       距离(km) + 配送员当前负载 × DISPATCH_LOAD_PENALTY_KM
+   每个配送员的候选订单按距离预先排序，堆中只放各配送员当前最近可接订单的代价（堆大小为配送员数），
+   接单后负载加一、指针后移，1000 单 × 50 人的求解在百毫秒以内
+4. 约束: 每人未完成订单不超过 DISPATCH_COURIER_CAPACITY，随车钢瓶总重不超过 DISPATCH_COURIER_MAX_KG，
+   各规格分配数量不超过可用库存
+5. 在一个事务内以带条件的 UPDATE（status 仍为 pending）写入分配结果，
+   期间被人工分配或取消的订单跳过，配送员汇总按人一次累加
+"""
+import heapq
+import math
+from collections import Counter, defaultdict, namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, case, func, or_, update
+from sqlalchemy.orm.attributes import set_committed_value
+from app import db
+from app.models import Order, User, CourierLocation, CourierStat
+from app.geo import DEFAULT_LOAD_PENALTY_KM, DEFAULT_LOCATION_TTL, EARTH_RADIUS_KM
+from app.inventory import available_stock
+from app.rollups import bump
+from app.events import emit
+
+
+DEFAULT_BATCH_LIMIT = 2000
+DEFAULT_MAX_DISTANCE_KM = 20
+DEFAULT_COURIER_CAPACITY = 8      # 每人同时持有的未完成订单上限
+DEFAULT_COURIER_MAX_KG = 400      # 每人随车钢瓶总重上限
+UPDATE_CHUNK = 500                # 单条 UPDATE 的 IN 列表长度，低于旧版 SQLite 的变量数上限
+
+SPECS_KG = {'5kg': 5, '15kg': 15, '50kg': 50}
+OPEN_STATUSES = ('assigned', 'delivering')
+
+DispatchOrder = namedtuple('DispatchOrder', ['id', 'latitude', 'longitude', 'specs', 'quantity'])
+DispatchCourier = namedtuple('DispatchCourier', ['id', 'latitude', 'longitude', 'open_count', 'open_kg'])
+
+# 未分配原因
+NO_COORDINATES = 'no_coordinates'
+OVER_WEIGHT = 'over_weight'
+OUT_OF_STOCK = 'out_of_stock'
+NO_COURIER = 'no_courier_in_range'
+COURIERS_FULL = 'couriers_full'
+
+
+def order_kg(specs, quantity):
+    return SPECS_KG.get(specs, 0) * (quantity or 1)
+
+
+def distance_matrix(orders, couriers):
+    """订单 × 配送员的球面距离（km），按行返回列表；坐标预先转为弧度与余弦，内层只做一次 asin"""
+    c_lat = [math.radians(c.latitude) for c in couriers]
+    c_lng = [math.radians(c.longitude) for c in couriers]
+    c_cos = [math.cos(lat) for lat in c_lat]
+    columns = list(zip(c_lat, c_lng, c_cos))
+    sin, asin, sqrt = math.sin, math.asin, math.sqrt
+    diameter = 2 * EARTH_RADIUS_KM
+    rows = []
+    for order in orders:
+        lat, lng = math.radians(order.latitude), math.radians(order.longitude)
+        cos_lat = math.cos(lat)
+        rows.append([
+            diameter * asin(sqrt(sin((clat - lat) / 2) ** 2 + cos_lat * ccos * sin((clng - lng) / 2) ** 2))
+            for clat, clng, ccos in columns
+        ])
+    return rows
+
+
+def plan_dispatch(orders, couriers, stock, penalty=DEFAULT_LOAD_PENALTY_KM, max_distance=DEFAULT_MAX_DISTANCE_KM,
+                  capacity=DEFAULT_COURIER_CAPACITY, max_kg=DEFAULT_COURIER_MAX_KG):
+    """
+    计算分配方案（不访问数据库）
+
+    orders 为 DispatchOrder 列表，couriers 为 DispatchCourier 列表，stock 为 {规格: 可用数量}；
+    返回 (assignments, unassigned)：assignments 为 [(订单id, 配送员id, 距离km)]，unassigned 为 {订单id: 原因}
+    """
+    unassigned = {}
+    routable = []
+    for order in orders:
+        if order.latitude is None or order.longitude is None:
+            unassigned[order.id] = NO_COORDINATES
+        elif order_kg(order.specs, order.quantity) > max_kg:
+            unassigned[order.id] = OVER_WEIGHT
+        else:
+            routable.append(order)
+
+    loads = [c.open_count for c in couriers]
+    kgs = [c.open_kg for c in couriers]
+    weights = [order_kg(o.specs, o.quantity) for o in routable]
+    remaining = dict(stock)
+
+    # 每个配送员按距离排好的候选订单 [(距离, 订单序号)]，以及下一个待考察的位置
+    candidates = [[] for _ in couriers]
+    in_range = set()
+    for i, row in enumerate(distance_matrix(routable, couriers)):
+        for j, distance in enumerate(row):
+            if distance <= max_distance:
+                candidates[j].append((distance, i))
+                in_range.add(i)
+    for column in candidates:
+        column.sort()
+    cursor = [0] * len(couriers)
+
+    def next_cost(j):
+        """配送员 j 最近的可接订单的代价；订单状态只会从可接变为不可接，跳过的候选不必回头"""
+        column = candidates[j]
+        while cursor[j] < len(column):
+            distance, i = column[cursor[j]]
+            order = routable[i]
+            if i in assigned or i in dropped or kgs[j] + weights[i] > max_kg:
+                cursor[j] += 1
+            elif remaining.get(order.specs, 0) < (order.quantity or 1):
+                unassigned[order.id] = OUT_OF_STOCK
+                dropped.add(i)
+                cursor[j] += 1
+            else:
+                return distance + loads[j] * penalty
+        return None
+
+    # 全局代价最低的组合 = 各配送员"最近可接订单 + 当前负载"中的最小者，堆中每人一项
+    assigned, dropped = {}, set()
+    heap = []
+    for j in range(len(couriers)):
+        cost = next_cost(j) if loads[j] < capacity else None
+        if cost is not None:
+            heap.append((cost, j))
+    heapq.heapify(heap)
+
+    while heap:
+        cost, j = heapq.heappop(heap)
+        current = next_cost(j)
+        if current is None:
+            continue
+        if current != cost:
+            # 该配送员的最近订单已被他人接走，按新的候选重新排队
+            heapq.heappush(heap, (current, j))
+            continue
+        distance, i = candidates[j][cursor[j]]
+        assigned[i] = (j, distance)
+        loads[j] += 1
+        kgs[j] += weights[i]
+        remaining[routable[i].specs] -= routable[i].quantity or 1
+        cursor[j] += 1
+        if loads[j] < capacity:
+            current = next_cost(j)
+            if current is not None:
+                heapq.heappush(heap, (current, j))
+
+    assignments = []
+    for i, order in enumerate(routable):
+        if i in assigned:
+            j, distance = assigned[i]
+            assignments.append((order.id, couriers[j].id, distance))
+        elif order.id not in unassigned:
+            unassigned[order.id] = COURIERS_FULL if i in in_range else NO_COURIER
+    return assignments, unassigned
+
+
+def load_candidates(station_id=None, limit=None):
+    """读取待分配订单、在岗配送员和各规格可用库存"""
+    config = current_app.config
+    limit = limit or config.get('DISPATCH_BATCH_LIMIT', DEFAULT_BATCH_LIMIT)
+    cutoff = datetime.utcnow() - timedelta(seconds=config.get('COURIER_LOCATION_TTL', DEFAULT_LOCATION_TTL))
+
+    order_query = Order.query.filter(Order.status == 'pending')
+    if station_id is not None:
+        order_query = order_query.filter(Order.station_id == station_id)
+    orders = order_query.order_by(Order.created_at, Order.id).limit(limit).all()
+
+    courier_query = db.session.query(
+        User.id, CourierLocation.latitude, CourierLocation.longitude, func.coalesce(CourierStat.open_count, 0)
+    ).join(
+        CourierLocation, CourierLocation.delivery_id == User.id
+    ).outerjoin(
+        CourierStat, CourierStat.delivery_id == User.id
+    ).filter(
+        User.role == 'delivery',
+        CourierLocation.updated_at >= cutoff
+    )
+    if station_id is not None:
+        courier_query = courier_query.filter(User.station_id == station_id)
+    rows = courier_query.order_by(User.id).all()
+
+    # 已分配未完成的订单：占用本站配送员的载重，出库时消耗供货站点的库存
+    open_query = db.session.query(
+        Order.delivery_id, Order.station_id, Order.specs, func.sum(func.coalesce(Order.quantity, 1))
+    ).filter(Order.status.in_(OPEN_STATUSES))
+    if station_id is not None:
+        open_query = open_query.outerjoin(User, User.id == Order.delivery_id).filter(
+            or_(User.station_id == station_id, Order.station_id == station_id))
+    open_kg, reserved = Counter(), Counter()
+    for delivery_id, order_station, specs, quantity in open_query.group_by(
+            Order.delivery_id, Order.station_id, Order.specs):
+        open_kg[delivery_id] += order_kg(specs, quantity)
+        if station_id is None or order_station == station_id:
+            reserved[specs] += quantity
+
+    couriers = [DispatchCourier(id, lat, lng, open_count, open_kg[id]) for id, lat, lng, open_count in rows]
+    stock = {specs: max(available_stock(specs, station_id) - reserved[specs], 0) for specs in SPECS_KG}
+    return orders, couriers, stock
+
+
+def apply_assignments(orders_by_id, assignments):
+    """在当前事务内写入分配结果，返回实际分配成功的 [(订单, 距离km)]"""
+    # MySQL 的 DATETIME 默认不保存微秒，取整秒以便按分配时间回查
+    now = datetime.utcnow().replace(microsecond=0)
+    applied = []
+    for start in range(0, len(assignments), UPDATE_CHUNK):
+        chunk = assignments[start:start + UPDATE_CHUNK]
+        courier_of = {order_id: delivery_id for order_id, delivery_id, _ in chunk}
+        count = db.session.execute(update(Order).where(
+            Order.id.in_(courier_of),
+            Order.status == 'pending'
+        ).values(
+            delivery_id=case(courier_of, value=Order.id),
+            status='assigned',
+            assigned_at=now
+        ).execution_options(synchronize_session=False)).rowcount
+        if count == len(chunk):
+            updated = courier_of
+        else:
+            # 条件 UPDATE 跳过了期间已被人工处理的订单，取回本次实际写入的行
+            updated = dict(db.session.query(Order.id, Order.delivery_id).filter(
+                Order.id.in_(courier_of),
+                and_(Order.status == 'assigned', Order.assigned_at == now)
+            ).all())
+        for order_id, delivery_id, distance in chunk:
+            if updated.get(order_id) == delivery_id:
+                order = orders_by_id[order_id]
+                set_committed_value(order, 'delivery_id', delivery_id)
+                set_committed_value(order, 'status', 'assigned')
+                set_committed_value(order, 'assigned_at', now)
+                applied.append((order, distance))
+
+    per_courier = Counter(order.delivery_id for order, _ in applied)
+    for delivery_id, count in sorted(per_courier.items()):
+        bump(CourierStat, {'delivery_id': delivery_id}, assigned_count=count, open_count=count)
+    # 订单已有 id，不必像 emit_order_event 那样逐条 flush，事件在提交时批量写入
+    for order, _ in applied:
+        emit('order.assigned', {'order': order.to_dict(), 'dispatch': 'auto'},
+             user_id=order.user_id, delivery_id=order.delivery_id)
+    return applied
+
+
+def dispatch_orders(station_id=None, limit=None, dry_run=False):
+    """
+    批量分配待处理订单，dry_run 时只返回方案不写入
+
+    返回 {'assigned': [...], 'unassigned': [...], 'couriers': {配送员id: 本次分配数}, 'total_distance_km': 总距离}
+    """
+    config = current_app.config
+    orders, couriers, stock = load_candidates(station_id, limit)
+    assignments, unassigned = plan_dispatch(
+        [DispatchOrder(o.id, o.latitude, o.longitude, o.specs, o.quantity) for o in orders],
+        couriers,
+        stock,
+        penalty=config.get('DISPATCH_LOAD_PENALTY_KM', DEFAULT_LOAD_PENALTY_KM),
+        max_distance=config.get('DISPATCH_MAX_DISTANCE_KM', DEFAULT_MAX_DISTANCE_KM),
+        capacity=config.get('DISPATCH_COURIER_CAPACITY', DEFAULT_COURIER_CAPACITY),
+        max_kg=config.get('DISPATCH_COURIER_MAX_KG', DEFAULT_COURIER_MAX_KG)
+    )
+
+    if dry_run:
+        applied = assignments
+    else:
+        orders_by_id = {o.id: o for o in orders}
+        applied = [(order.id, order.delivery_id, distance)
+                   for order, distance in apply_assignments(orders_by_id, assignments)]
+        skipped = {order_id for order_id, _, _ in assignments} - {order_id for order_id, _, _ in applied}
+        unassigned.update({order_id: 'already_handled' for order_id in skipped})
+        db.session.commit()
+
+    per_courier = defaultdict(int)
+    for _, delivery_id, _ in applied:
+        per_courier[delivery_id] += 1
+    return {
+        'assigned': [{'order_id': order_id, 'delivery_id': delivery_id, 'distance_km': round(distance, 3)}
+                     for order_id, delivery_id, distance in applied],
+        'unassigned': [{'order_id': order_id, 'reason': reason} for order_id, reason in sorted(unassigned.items())],
+        'couriers': dict(per_courier),
+        'total_distance_km': round(sum(distance for _, _, distance in applied), 3)
+    }
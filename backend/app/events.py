@@ -0,0 +1,173 @@
+"""
+实时事件推送模块
+订单、钢瓶的写接口调用 emit_* 在同一事务内写入 events 表；
+GET /api/events/stream 以 Server-Sent Events 推送调用者可见的事件：
+管理员、站点看到全部事件，普通用户只看到自己的订单，配送员只看到分配给自己的订单（与订单列表一致）。
+
+事件 id 单调递增，客户端断线重连时带上 Last-Event-ID 即可从断点续传。
+本进程提交的事件立即唤醒等待中的连接，其他 worker 写入的事件按 EVENT_POLL_INTERVAL 轮询发现。
+
+单次连接的最长时间见 default_stream_timeout()：sync worker 处理请求期间不向 gunicorn master 报活，
+连接超过 WORKER_TIMEOUT 会被当作卡死而杀掉 worker，因此 sync 模式下只保持短连接，到期后客户端自动重连续传。
+
+过期事件由后台任务 events.prune 清理，执行后自动排定 EVENT_PRUNE_INTERVAL 秒后的下一次，worker 启动时排上第一次
+手动清理: python -m app.events
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, func
+from app import db
+from app.jobs import job, schedule
+from app.models import Event
+from app.serving import cooperative
+
+
+DEFAULT_POLL_INTERVAL = 1        # 秒，无新事件时重新查询的间隔
+DEFAULT_HEARTBEAT_INTERVAL = 15  # 秒，空闲连接发送心跳注释的间隔
+DEFAULT_STREAM_TIMEOUT = 300     # 秒，gevent worker 下单次连接的最长时间，到期后客户端按 retry 自动重连
+DEFAULT_WORKER_TIMEOUT = 30      # 与 gunicorn.conf.py 中 WORKER_TIMEOUT 的默认值一致
+SYNC_STREAM_MARGIN = 10          # 秒，sync worker 下连接在 WORKER_TIMEOUT 之前结束的余量
+DEFAULT_RETENTION_HOURS = 24
+DEFAULT_PRUNE_INTERVAL = 3600   # 秒，定时清理过期事件的间隔
+RETRY_MS = 2000
+BATCH_SIZE = 100
+
+STAFF_ROLES = ('admin', 'station')
+
+# 本进程提交新事件时唤醒等待中的推送连接
+_new_events = threading.Condition()
+
+
+def emit(type, payload, user_id=None, delivery_id=None):
+    """在当前事务内记录事件，提交后才对订阅者可见"""
+    db.session.add(Event(
+        type=type,
+        user_id=user_id,
+        delivery_id=delivery_id,
+        payload=json.dumps(payload, ensure_ascii=False)
+    ))
+    db.session.info['events_emitted'] = True
+
+
+def emit_order_event(type, order, **extra):
+    """订单事件，下单用户与当前配送员可见"""
+    db.session.flush()
+    emit(type, {'order': order.to_dict(), **extra}, user_id=order.user_id, delivery_id=order.delivery_id)
+
+
+def emit_cylinder_event(cylinder, previous_status, **extra):
+    """钢瓶状态变更事件，仅管理员、站点可见"""
+    if cylinder.status == previous_status:
+        return
+    emit('cylinder.status_changed', {
+        'cylinder': cylinder.to_dict(),
+        'previous_status': previous_status,
+        **extra
+    })
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_streams(session):
+    if session.info.pop('events_emitted', False):
+        with _new_events:
+            _new_events.notify_all()
+
+
+def default_stream_timeout(environ=os.environ):
+    """
+    单次连接的默认最长时间（秒）
+
+    gevent worker 下为 DEFAULT_STREAM_TIMEOUT；sync worker 下须短于 gunicorn 的 WORKER_TIMEOUT，
+    取 WORKER_TIMEOUT − SYNC_STREAM_MARGIN（超时设置很小时取一半）。WORKER_TIMEOUT=0 表示不限时
+    """
+    worker_timeout = int(environ.get('WORKER_TIMEOUT', DEFAULT_WORKER_TIMEOUT))
+    if cooperative() or worker_timeout <= 0:
+        return DEFAULT_STREAM_TIMEOUT
+    return min(max(worker_timeout - SYNC_STREAM_MARGIN, worker_timeout / 2), DEFAULT_STREAM_TIMEOUT)
+
+
+def visible_events(identity):
+    """按角色过滤的事件查询"""
+    query = Event.query
+    if identity.role == 'user':
+        query = query.filter(Event.user_id == identity.id)
+    elif identity.role == 'delivery':
+        query = query.filter(Event.delivery_id == identity.id)
+    elif identity.role not in STAFF_ROLES:
+        query = query.filter(Event.id.is_(None))
+    return query
+
+
+def latest_event_id():
+    return db.session.query(func.max(Event.id)).scalar() or 0
+
+
+def format_event(row):
+    return f'id: {row.id}\nevent: {row.type}\ndata: {row.payload}\n\n'
+
+
+def stream_events(identity, last_event_id):
+    """
+    逐条产出 SSE 文本，直到连接达到最长时间
+
+    每次查询后关闭会话，等待期间不占用数据库连接
+    """
+    config = current_app.config
+    poll_interval = config.get('EVENT_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+    heartbeat_interval = config.get('EVENT_HEARTBEAT_INTERVAL', DEFAULT_HEARTBEAT_INTERVAL)
+    deadline = time.monotonic() + config.get('EVENT_STREAM_TIMEOUT', DEFAULT_STREAM_TIMEOUT)
+
+    if last_event_id is None:
+        last_event_id = latest_event_id()
+        db.session.close()
+    # 先下发当前位置：连接期间没有新事件时，客户端重连也会带上 Last-Event-ID，不会漏掉重连间隙的事件
+    yield f'retry: {RETRY_MS}\nid: {last_event_id}\n\n'
+    last_sent = time.monotonic()
+
+    while time.monotonic() < deadline:
+        rows = visible_events(identity).filter(Event.id > last_event_id).order_by(Event.id).limit(BATCH_SIZE).all()
+        db.session.close()
+        for row in rows:
+            last_event_id = row.id
+            yield format_event(row)
+        if rows:
+            last_sent = time.monotonic()
+            if len(rows) == BATCH_SIZE:
+                continue
+
+        if time.monotonic() - last_sent >= heartbeat_interval:
+            yield ': heartbeat\n\n'
+            last_sent = time.monotonic()
+        with _new_events:
+            _new_events.wait(min(poll_interval, max(deadline - time.monotonic(), 0)))
+
+
+def schedule_prune():
+    """排定下一次定时清理（已有待执行的清理任务时不重复加入）"""
+    interval = current_app.config.get('EVENT_PRUNE_INTERVAL', DEFAULT_PRUNE_INTERVAL)
+    return schedule('events.prune', delay=interval)
+
+
+@job('events.prune')
+def prune_events(retention_hours=None):
+    """删除超过保留时长的事件并排定下一次清理，返回删除条数"""
+    if retention_hours is None:
+        retention_hours = current_app.config.get('EVENT_RETENTION_HOURS', DEFAULT_RETENTION_HOURS)
+    cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+    deleted = Event.query.filter(Event.created_at < cutoff).delete(synchronize_session=False)
+    schedule_prune()
+    db.session.commit()
+    return deleted
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        deleted = prune_events()
+        print(f"✓ 已清理 {deleted} 条过期事件")
@@ -0,0 +1,235 @@
+"""
+需求预测模块
+按 (站点, 规格) 预测未来每天的钢瓶需求量，并结合当前在库数量给出补货建议。
+
+- 需求量: 订单按下单日期、配送员所属站点（未分配为 0）、规格汇总的钢瓶数，不含已取消订单，
+  保存在 demand_daily_stats。每晚的 forecast.refresh 任务只重算最近 FORECAST_REFRESH_OVERLAP_DAYS 天
+  （期间订单可能被分配到站点或取消），更早的日期不再扫描订单表
+- 模型: 季节性朴素法（上周同日）、简单指数平滑、带周季节项的指数平滑，参数取若干候选值；
+  用最后 FORECAST_BACKTEST_DAYS 天回测，选平均绝对误差最小的模型后以全部历史重新拟合
+- 补货建议 = ceil(未来 FORECAST_LEAD_DAYS 天预测需求 + 安全库存 − 在库数量)，
+  安全库存 = FORECAST_SERVICE_Z × 1.25 × 回测误差 × sqrt(天数)（1.25 × MAE 近似误差标准差）
+
+任务执行后自动排定次日 FORECAST_REFRESH_HOUR 点的下一次刷新。手动刷新: python worker.py --enqueue forecast.refresh
+"""
+import json
+import math
+from datetime import date, datetime, time, timedelta
+from flask import current_app
+from sqlalchemy import func
+from app import db
+from app.database import day_of
+from app.jobs import job, enqueue
+from app.models import Order, User, Job, DemandDailyStat, DemandForecast
+from app.inventory import available_stock
+
+
+SEASON = 7                          # 周季节
+DEFAULT_HISTORY_DAYS = 56           # 拟合使用的历史天数
+DEFAULT_HORIZON_DAYS = 14           # 预测天数
+DEFAULT_BACKTEST_DAYS = 14
+DEFAULT_REFRESH_OVERLAP_DAYS = 7
+DEFAULT_LEAD_DAYS = 3               # 补货在途天数
+DEFAULT_SERVICE_Z = 1.65            # 约 95% 不缺货
+DEFAULT_REFRESH_HOUR = 2
+MAE_TO_SIGMA = 1.25
+
+SMOOTHING_ALPHAS = (0.1, 0.3, 0.5, 0.8)
+SEASONAL_ALPHAS = (0.1, 0.3, 0.5)
+SEASONAL_GAMMAS = (0.05, 0.2, 0.4)
+
+
+# ==================== 模型 ====================
+
+def seasonal_naive(history, horizon):
+    """每天的预测取上一周同一天；历史不足一周时取最后一天"""
+    if len(history) < SEASON:
+        return [history[-1]] * horizon
+    last_week = history[-SEASON:]
+    return [last_week[h % SEASON] for h in range(horizon)]
+
+
+def simple_smoothing(history, horizon, alpha):
+    level = history[0]
+    for value in history[1:]:
+        level = alpha * value + (1 - alpha) * level
+    return [level] * horizon
+
+
+def seasonal_smoothing(history, horizon, alpha, gamma):
+    """加性周季节项的指数平滑（无趋势项），至少需要两周历史"""
+    level = sum(history[:SEASON]) / SEASON
+    season = [value - level for value in history[:SEASON]]
+    for t in range(SEASON, len(history)):
+        s = season[t % SEASON]
+        new_level = alpha * (history[t] - s) + (1 - alpha) * level
+        season[t % SEASON] = gamma * (history[t] - new_level) + (1 - gamma) * s
+        level = new_level
+    n = len(history)
+    return [level + season[(n + h) % SEASON] for h in range(horizon)]
+
+
+def candidate_models(length):
+    """历史长度允许的候选模型 [(名称, 预测函数)]"""
+    models = [('seasonal_naive', seasonal_naive)]
+    models += [(f'ses(alpha={a})', lambda y, h, a=a: simple_smoothing(y, h, a)) for a in SMOOTHING_ALPHAS]
+    if length >= 2 * SEASON:
+        models += [
+            (f'seasonal_ses(alpha={a},gamma={g})', lambda y, h, a=a, g=g: seasonal_smoothing(y, h, a, g))
+            for a in SEASONAL_ALPHAS for g in SEASONAL_GAMMAS
+        ]
+    return models
+
+
+def fit_series(history, horizon, backtest=DEFAULT_BACKTEST_DAYS):
+    """
+    回测选模型并预测，返回 (模型名, 预测值列表, 回测 MAE)
+
+    历史太短无法留出回测期时只用季节性朴素法，MAE 取历史的平均绝对偏差
+    """
+    if len(history) < backtest + SEASON:
+        mean = sum(history) / len(history)
+        mae = sum(abs(value - mean) for value in history) / len(history)
+        return 'seasonal_naive', [max(v, 0.0) for v in seasonal_naive(history, horizon)], mae
+
+    train, actual = history[:-backtest], history[-backtest:]
+    best = None
+    for name, predict in candidate_models(len(train)):
+        predicted = predict(train, backtest)
+        mae = sum(abs(p - a) for p, a in zip(predicted, actual)) / backtest
+        if best is None or mae < best[2] - 1e-9:
+            best = (name, predict, mae)
+    name, predict, mae = best
+    return name, [max(v, 0.0) for v in predict(history, horizon)], mae
+
+
+# ==================== 每晚刷新 ====================
+
+def refresh_demand(through, full=False):
+    """重算截至 through（含）的日需求汇总，返回重算的起始日期"""
+    overlap = current_app.config.get('FORECAST_REFRESH_OVERLAP_DAYS', DEFAULT_REFRESH_OVERLAP_DAYS)
+    last = db.session.query(func.max(DemandDailyStat.stat_date)).scalar()
+    if full or last is None:
+        first = db.session.query(func.min(Order.created_at)).scalar()
+        since = first.date() if first else through
+    else:
+        since = min(last + timedelta(days=1), through) - timedelta(days=overlap)
+
+    DemandDailyStat.query.filter(DemandDailyStat.stat_date >= since).delete(synchronize_session=False)
+    created_day = day_of(Order.created_at)
+    station = func.coalesce(User.station_id, 0)
+    rows = db.session.query(
+        created_day, station, Order.specs, func.sum(func.coalesce(Order.quantity, 1)), func.count(Order.id)
+    ).outerjoin(
+        User, User.id == Order.delivery_id
+    ).filter(
+        Order.created_at >= datetime.combine(since, time.min),
+        Order.created_at < datetime.combine(through + timedelta(days=1), time.min),
+        Order.status != 'cancelled'
+    ).group_by(created_day, station, Order.specs)
+    for day, station_id, specs, quantity, count in rows:
+        db.session.add(DemandDailyStat(
+            stat_date=date.fromisoformat(str(day)), station_id=station_id, specs=specs,
+            quantity=int(quantity or 0), order_count=count
+        ))
+    db.session.flush()
+    return since
+
+
+def load_histories(through, days):
+    """读取 through 之前 days 天的日需求，返回 {(站点, 规格): 每天的数量}，去掉开头无订单的天数"""
+    start = through - timedelta(days=days - 1)
+    series = {}
+    for row in DemandDailyStat.query.filter(
+        DemandDailyStat.stat_date >= start,
+        DemandDailyStat.stat_date <= through
+    ):
+        values = series.setdefault((row.station_id, row.specs), [0.0] * days)
+        values[(row.stat_date - start).days] = float(row.quantity)
+    for key, values in series.items():
+        first = next((k for k, value in enumerate(values) if value), 0)
+        series[key] = values[first:]
+    return series
+
+
+def schedule_next_refresh():
+    """排定下一次刷新（已有待执行的刷新任务时不重复加入）"""
+    if Job.query.filter_by(name='forecast.refresh', status='pending').first():
+        return None
+    hour = current_app.config.get('FORECAST_REFRESH_HOUR', DEFAULT_REFRESH_HOUR)
+    now = datetime.now()
+    next_run = datetime.combine(now.date(), time(hour))
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return enqueue('forecast.refresh', delay=(next_run - now).total_seconds())
+
+
+@job('forecast.refresh')
+def refresh_forecasts(full=False, through=None):
+    """增量更新日需求并重新拟合全部 (站点, 规格) 的预测，返回拟合的序列数"""
+    config = current_app.config
+    through = date.fromisoformat(through) if through else datetime.utcnow().date() - timedelta(days=1)
+    horizon = config.get('FORECAST_HORIZON_DAYS', DEFAULT_HORIZON_DAYS)
+    backtest = config.get('FORECAST_BACKTEST_DAYS', DEFAULT_BACKTEST_DAYS)
+
+    refresh_demand(through, full)
+    histories = load_histories(through, config.get('FORECAST_HISTORY_DAYS', DEFAULT_HISTORY_DAYS))
+
+    DemandForecast.query.delete()
+    fitted_at = datetime.utcnow()
+    for (station_id, specs), history in sorted(histories.items()):
+        model, values, mae = fit_series(history, horizon, backtest)
+        db.session.add(DemandForecast(
+            station_id=station_id, specs=specs, model=model,
+            start_date=through + timedelta(days=1),
+            values=json.dumps([round(v, 2) for v in values]),
+            mae=round(mae, 3), history_days=len(history), fitted_at=fitted_at
+        ))
+    schedule_next_refresh()
+    db.session.commit()
+    return len(histories)
+
+
+# ==================== 查询 ====================
+
+def restock_plan(station_id=None, specs=None, today=None):
+    """读取最近一次预测，给出未来 FORECAST_LEAD_DAYS 天的需求与补货建议，按建议补货量降序"""
+    config = current_app.config
+    lead = config.get('FORECAST_LEAD_DAYS', DEFAULT_LEAD_DAYS)
+    z = config.get('FORECAST_SERVICE_Z', DEFAULT_SERVICE_Z)
+    today = today or datetime.utcnow().date()
+
+    query = DemandForecast.query
+    if station_id is not None:
+        query = query.filter(DemandForecast.station_id == station_id)
+    if specs:
+        query = query.filter(DemandForecast.specs == specs)
+
+    items = []
+    for row in query.all():
+        values = json.loads(row.values)
+        # 预测生成后未及时刷新时，从今天对应的位置开始取
+        offset = max((today - row.start_date).days, 0)
+        upcoming = values[offset:offset + lead]
+        demand = sum(upcoming)
+        safety = z * MAE_TO_SIGMA * row.mae * math.sqrt(lead)
+        in_stock = available_stock(row.specs, row.station_id)
+        items.append({
+            'station_id': row.station_id,
+            'specs': row.specs,
+            'model': row.model,
+            'mae': row.mae,
+            'history_days': row.history_days,
+            'forecast': [
+                {'date': (row.start_date + timedelta(days=k)).isoformat(), 'quantity': value}
+                for k, value in enumerate(values) if k >= offset
+            ],
+            'lead_demand': round(demand, 2),
+            'safety_stock': round(safety, 2),
+            'in_stock': in_stock,
+            'suggested_restock': max(math.ceil(demand + safety - in_stock - 1e-9), 0),
+            'stale': len(upcoming) < lead,
+            'fitted_at': row.fitted_at.isoformat()
+        })
+    items.sort(key=lambda item: (-item['suggested_restock'], item['station_id'], item['specs']))
+    return {'lead_days': lead, 'items': items}
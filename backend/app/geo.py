@@ -0,0 +1,166 @@
+"""
+就近派单模块
+配送员上报的位置按 geohash 编码保存在 courier_locations 表，geohash 前缀相同的点位于同一网格，
+查询订单附近的配送员只需对中心网格及周围 8 格做索引范围扫描，不计算全表距离。
+
+推荐时从细网格开始逐级放大，直到前 k 名的得分都不超过网格保证覆盖的半径，得分为
+    距离(km) + 未完成订单数 × DISPATCH_LOAD_PENALTY_KM
+取得分最低的 k 个；超过 COURIER_LOCATION_TTL 秒未上报位置的配送员视为不在岗
+"""
+import math
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, bindparam, func, or_, select
+from app import db
+from app.models import User, CourierLocation, CourierStat
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9                 # 保存精度，网格约 5m
+SEARCH_PRECISIONS = (6, 5, 4, 3)      # 检索时由细到粗的网格，约 1.2km、4.9km、39km、156km
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+DEFAULT_LOAD_PENALTY_KM = 2           # 每个未完成订单折算的距离
+DEFAULT_LOCATION_TTL = 1800           # 秒
+DEFAULT_SUGGEST_COUNT = 5
+MAX_SUGGEST_COUNT = 50
+
+
+def valid_coordinates(latitude, longitude):
+    return (isinstance(latitude, (int, float)) and isinstance(longitude, (int, float))
+            and not isinstance(latitude, bool) and not isinstance(longitude, bool)
+            and -90 <= latitude <= 90 and -180 <= longitude <= 180)
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """标准 geohash 编码：经纬度交替二分，每 5 位映射为一个 base32 字符"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """给定精度的网格大小 (纬度跨度, 经度跨度)，单位为度"""
+    lng_bits = (precision * 5 + 1) // 2
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def neighbor_cells(latitude, longitude, precision):
+    """点所在网格及周围 8 格的 geohash 前缀"""
+    dlat, dlng = cell_size(precision)
+    cells = set()
+    for i in (-1, 0, 1):
+        for j in (-1, 0, 1):
+            lat = min(max(latitude + i * dlat, -90.0), 90.0)
+            lng = (longitude + j * dlng + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(lat, lng, precision))
+    return sorted(cells)
+
+
+def covered_radius_km(latitude, precision):
+    """3x3 网格保证覆盖的半径：中心点到外圈边界的最短距离不小于一个网格"""
+    dlat, dlng = cell_size(precision)
+    return min(dlat * KM_PER_DEGREE, dlng * KM_PER_DEGREE * math.cos(math.radians(latitude)))
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlmb = phi2 - phi1, math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def update_courier_location(delivery_id, latitude, longitude):
+    """保存配送员位置（每人一行），由调用方提交"""
+    location = db.session.get(CourierLocation, delivery_id)
+    if location is None:
+        location = CourierLocation(delivery_id=delivery_id)
+        db.session.add(location)
+    location.latitude = latitude
+    location.longitude = longitude
+    location.geohash = encode_geohash(latitude, longitude)
+    location.updated_at = datetime.utcnow()
+    return location
+
+
+def clear_courier_location(user_id):
+    """用户不再是配送员或被删除时清除其位置，由调用方提交"""
+    CourierLocation.query.filter_by(delivery_id=user_id).delete(synchronize_session=False)
+
+
+# 附近网格查询只构造一次，每次执行绑定 9 个网格前缀（靠近两极时网格不足 9 个，用重复前缀补齐）
+NEIGHBOR_COUNT = 9
+_CANDIDATES = select(
+    CourierLocation.delivery_id, User.username, User.real_name,
+    CourierLocation.latitude, CourierLocation.longitude, CourierLocation.updated_at,
+    func.coalesce(CourierStat.open_count, 0)
+).join(
+    User, User.id == CourierLocation.delivery_id
+).outerjoin(
+    CourierStat, CourierStat.delivery_id == CourierLocation.delivery_id
+).where(
+    or_(*[
+        and_(CourierLocation.geohash >= bindparam(f'low{i}'), CourierLocation.geohash < bindparam(f'high{i}'))
+        for i in range(NEIGHBOR_COUNT)
+    ]),
+    CourierLocation.updated_at >= bindparam('cutoff')
+)
+
+
+def _candidates(cells, cutoff):
+    """
+    geohash 前缀落在 cells 中、位置未过期的配送员及其未完成订单数（只取所需列，不构造 ORM 对象）
+
+    courier_locations 只保存配送员的位置（角色变更时清除），这里不再按 users.role 过滤，
+    避免查询计划改为从 role 索引扫描全部配送员
+    """
+    cells = (cells * NEIGHBOR_COUNT)[:NEIGHBOR_COUNT]
+    params = {'cutoff': cutoff}
+    for i, cell in enumerate(cells):
+        params[f'low{i}'], params[f'high{i}'] = cell, cell + '~'
+    return db.session.execute(_CANDIDATES, params).all()
+
+
+def suggest_couriers(latitude, longitude, k=DEFAULT_SUGGEST_COUNT):
+    """返回订单坐标附近按 距离 + 负载 排序的前 k 个配送员"""
+    config = current_app.config
+    penalty = config.get('DISPATCH_LOAD_PENALTY_KM', DEFAULT_LOAD_PENALTY_KM)
+    cutoff = datetime.utcnow() - timedelta(seconds=config.get('COURIER_LOCATION_TTL', DEFAULT_LOCATION_TTL))
+
+    scored = []
+    for precision in SEARCH_PRECISIONS:
+        radius = covered_radius_km(latitude, precision)
+        scored = []
+        for row in _candidates(neighbor_cells(latitude, longitude, precision), cutoff):
+            distance = haversine_km(latitude, longitude, row[3], row[4])
+            scored.append((distance + row[6] * penalty, distance, row))
+        scored.sort(key=lambda item: (item[0], item[1], item[2][0]))
+        # 网格外的配送员距离超过 radius，得分也必然超过 radius，前 k 名已确定
+        if len(scored) >= k and scored[k - 1][0] <= radius:
+            break
+
+    return [{
+        'delivery_id': delivery_id,
+        'username': username,
+        'real_name': real_name,
+        'distance_km': round(distance, 3),
+        'open_count': open_count,
+        'score': round(score, 3),
+        'location_updated_at': updated_at.isoformat()
+    } for score, distance, (delivery_id, username, real_name, _, _, updated_at, open_count) in scored[:k]]
@@ -0,0 +1,123 @@
+"""
+HTTP 条件请求模块
+table_versions 为每张表维护版本号和最后修改时间：ORM flush 以及经会话执行的批量
+INSERT/UPDATE/DELETE 在同一事务内累加所涉及表的版本。版本存放在数据库中，所有 worker 看到的一致，
+服务端响应缓存也以它作为缓存键的一部分（见 app/response_cache.py）。
+
+@conditional(tables) 装饰的 GET 路由先读取相关表的版本生成 ETag / Last-Modified，
+与请求的 If-None-Match / If-Modified-Since 一致时直接返回 304，不执行视图中的查询和序列化
+"""
+import hashlib
+from datetime import date, datetime, timezone
+from functools import wraps
+from flask import g, make_response, request
+from sqlalchemy import event, inspect, insert, select, update
+from app import db
+from app.models import TableVersion
+
+
+# 版本表、副本心跳、事件表、任务队列和配送员位置的写入不影响任何带缓存接口的响应
+UNTRACKED_TABLES = {'table_versions', 'replica_heartbeat', 'events', 'jobs', 'courier_locations'}
+
+DEFAULT_CACHE_CONTROL = 'private, no-cache'
+
+
+def bump_versions(connection, names):
+    """在当前事务内把给定表的版本号 +1"""
+    table = TableVersion.__table__
+    now = datetime.utcnow()
+    for name in sorted(set(names) - UNTRACKED_TABLES):
+        result = connection.execute(update(table).where(table.c.name == name).values(
+            version=table.c.version + 1, updated_at=now
+        ))
+        if not result.rowcount:
+            connection.execute(insert(table).values(name=name, version=1, updated_at=now))
+
+
+def ensure_version_rows(connection):
+    """为尚无版本行的表补建版本行，返回补建的表名列表"""
+    table = TableVersion.__table__
+    existing = set(connection.execute(select(table.c.name)).scalars())
+    missing = sorted(set(db.metadata.tables) - existing - UNTRACKED_TABLES)
+    if missing:
+        now = datetime.utcnow()
+        connection.execute(insert(table), [{'name': name, 'version': 0, 'updated_at': now} for name in missing])
+    return missing
+
+
+@event.listens_for(db.session, 'after_flush')
+def _flushed(session, flush_context):
+    modified = [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    names = {
+        table.name
+        for obj in [*session.new, *session.deleted, *modified]
+        for table in inspect(obj).mapper.tables
+    }
+    if names:
+        _record_writes(session, session.connection(), names)
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _bulk_statement(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    statement = orm_execute_state.statement
+    connection = orm_execute_state.session.connection(bind_arguments={'clause': statement})
+    _record_writes(orm_execute_state.session, connection, [statement.table.name])
+
+
+def _record_writes(session, connection, names):
+    bump_versions(connection, names)
+
+
+def table_versions(names):
+    """读取给定表的 {表名: (版本号, 最后修改时间)}"""
+    table = TableVersion.__table__
+    rows = db.session.execute(
+        select(table.c.name, table.c.version, table.c.updated_at).where(table.c.name.in_(names))
+    )
+    return {name: (version, updated_at) for name, version, updated_at in rows}
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional(tables, cache_control=DEFAULT_CACHE_CONTROL):
+    """
+    为 GET 路由启用条件请求
+
+    ETag 由路径、查询参数、当天日期（"今日"类统计跨天会变化）和各表版本号计算，
+    Last-Modified 取各表最后修改时间的最大值
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # 同一请求中的 @cached 复用这组版本计算缓存键
+            versions = g.table_versions = table_versions(tables)
+            parts = [request.path, *sorted(f'{k}={v}' for k, v in request.args.items(multi=True)),
+                     date.today().isoformat()]
+            parts += [f'{name}:{versions.get(name, (0, None))[0]}' for name in tables]
+            etag = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+            stamps = [updated_at for _, updated_at in versions.values() if updated_at]
+            last_modified = max(stamps).replace(microsecond=0, tzinfo=timezone.utc) if stamps else None
+
+            if _not_modified(etag, last_modified):
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = cache_control
+            response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,250 @@
+"""
+钢瓶库存模块
+1. 库存计数：inventory_counters 按 (站点, 规格, 状态) 记录钢瓶数量。ORM 对钢瓶的
+   增删改通过 mapper 事件在同一事务内更新计数；绕过 ORM 的批量语句需调用 apply_deltas
+2. 出库认领：订单完成时用一条带条件的批量 UPDATE 认领在库钢瓶，
+   只有仍为 in_stock 的行会被改写，多个 worker 并发时同一钢瓶不会被重复出库
+3. 对账：reconcile_inventory 对比实际数量修正计数漂移；作为 inventory.reconcile 任务执行后
+   自动排定 INVENTORY_RECONCILE_INTERVAL 秒后的下一次，worker 启动时排上第一次
+
+对账: python -m app.inventory
+"""
+from collections import Counter
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, func, inspect, insert, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db
+from app.jobs import job, schedule
+from app.models import Cylinder, OrderCylinder, InventoryCounter
+
+
+# 认领数量不足时（被其他事务抢走）重新选取候选钢瓶的次数
+MAX_CLAIM_ATTEMPTS = 5
+DEFAULT_RECONCILE_INTERVAL = 3600   # 秒，定时对账的间隔
+
+
+# ==================== 库存计数 ====================
+
+COUNTER_FIELDS = ('station_id', 'specs', 'status')
+
+
+def counter_key(station_id, specs, status):
+    return (station_id or 0, specs, status)
+
+
+def apply_deltas(connection, deltas):
+    """将 {(station_id, specs, status): 增量} 累加到计数表"""
+    table = InventoryCounter.__table__
+    dialect = connection.dialect.name
+    for (station_id, specs, status), delta in deltas.items():
+        if not delta or status is None:
+            continue
+        values = {'station_id': station_id or 0, 'specs': specs, 'status': status, 'count': delta}
+        increment = {'count': table.c.count + delta}
+        if dialect in ('sqlite', 'postgresql'):
+            upsert = sqlite_insert if dialect == 'sqlite' else pg_insert
+            connection.execute(upsert(table).values(**values).on_conflict_do_update(
+                index_elements=[table.c.station_id, table.c.specs, table.c.status],
+                set_=increment
+            ))
+        elif dialect in ('mysql', 'mariadb'):
+            connection.execute(mysql_insert(table).values(**values).on_duplicate_key_update(**increment))
+        else:
+            result = connection.execute(update(table).where(
+                table.c.station_id == values['station_id'],
+                table.c.specs == specs,
+                table.c.status == status
+            ).values(**increment))
+            if not result.rowcount:
+                connection.execute(insert(table).values(**values))
+
+
+def _previous(state, name):
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, name)
+
+
+@event.listens_for(Cylinder, 'after_insert')
+def _cylinder_inserted(mapper, connection, target):
+    apply_deltas(connection, {counter_key(target.station_id, target.specs, target.status): 1})
+
+
+@event.listens_for(Cylinder, 'after_update')
+def _cylinder_updated(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in COUNTER_FIELDS):
+        return
+    old = counter_key(*[_previous(state, name) for name in COUNTER_FIELDS])
+    new = counter_key(target.station_id, target.specs, target.status)
+    if old != new:
+        apply_deltas(connection, {old: -1, new: 1})
+
+
+@event.listens_for(Cylinder, 'after_delete')
+def _cylinder_deleted(mapper, connection, target):
+    state = inspect(target)
+    old = counter_key(*[_previous(state, name) for name in COUNTER_FIELDS])
+    apply_deltas(connection, {old: -1})
+
+
+def available_stock(specs, station_id=None):
+    """指定规格的在库数量（读取计数表）"""
+    query = db.session.query(func.sum(InventoryCounter.count)).filter(
+        InventoryCounter.specs == specs,
+        InventoryCounter.status == 'in_stock'
+    )
+    if station_id is not None:
+        query = query.filter(InventoryCounter.station_id == station_id)
+    return query.scalar() or 0
+
+
+def status_counts(station_id=None):
+    """各状态钢瓶数量（读取计数表）"""
+    query = db.session.query(
+        InventoryCounter.status,
+        func.sum(InventoryCounter.count)
+    )
+    if station_id is not None:
+        query = query.filter(InventoryCounter.station_id == station_id)
+    return {status: count or 0 for status, count in query.group_by(InventoryCounter.status)}
+
+
+def schedule_reconcile():
+    """排定下一次定时对账（已有待执行的对账任务时不重复加入）"""
+    interval = current_app.config.get('INVENTORY_RECONCILE_INTERVAL', DEFAULT_RECONCILE_INTERVAL)
+    return schedule('inventory.reconcile', delay=interval)
+
+
+@job('inventory.reconcile')
+def reconcile_inventory():
+    """对比钢瓶表的实际数量修正计数表并排定下一次对账，返回发现的漂移列表"""
+    actual = {
+        counter_key(station_id, specs, status): count
+        for station_id, specs, status, count in db.session.query(
+            Cylinder.station_id, Cylinder.specs, Cylinder.status, func.count(Cylinder.id)
+        ).group_by(Cylinder.station_id, Cylinder.specs, Cylinder.status)
+    }
+    recorded = {
+        (c.station_id, c.specs, c.status): c.count
+        for c in InventoryCounter.query.all()
+    }
+
+    drifts = []
+    for key in sorted(set(actual) | set(recorded), key=str):
+        expected, counted = actual.get(key, 0), recorded.get(key, 0)
+        if expected != counted:
+            drifts.append({
+                'station_id': key[0], 'specs': key[1], 'status': key[2],
+                'counted': counted, 'actual': expected
+            })
+    if drifts:
+        apply_deltas(db.session.connection(), {
+            (d['station_id'], d['specs'], d['status']): d['actual'] - d['counted'] for d in drifts
+        })
+        InventoryCounter.query.filter(InventoryCounter.count == 0).delete()
+    schedule_reconcile()
+    db.session.commit()
+    return drifts
+
+
+# ==================== 出库认领 ====================
+
+class InsufficientStockError(Exception):
+    """在库钢瓶不足"""
+
+    def __init__(self, specs, available):
+        super().__init__(f'{specs} 规格库存不足，当前可用: {available}')
+        self.specs = specs
+        self.available = available
+
+
+class ReservationConflictError(Exception):
+    """多次重试后仍未能认领足够的钢瓶"""
+
+
+def _supports_row_locks():
+    return db.session.get_bind().dialect.name in ('postgresql', 'mysql', 'mariadb')
+
+
+def _candidate_ids(specs, count, station_id=None):
+    """选取候选在库钢瓶；支持行锁的数据库跳过已被其他事务锁定的行"""
+    query = db.session.query(Cylinder.id).filter(
+        Cylinder.specs == specs,
+        Cylinder.status == 'in_stock'
+    )
+    if station_id is not None:
+        query = query.filter(Cylinder.station_id == station_id)
+    query = query.order_by(Cylinder.id).limit(count)
+    if _supports_row_locks():
+        query = query.with_for_update(skip_locked=True)
+    return [row[0] for row in query]
+
+
+def _claim(ids, status):
+    """条件 UPDATE 认领钢瓶，返回实际认领到的 id"""
+    statement = update(Cylinder.__table__).where(
+        Cylinder.__table__.c.id.in_(ids),
+        Cylinder.__table__.c.status == 'in_stock'
+    ).values(status=status, updated_at=datetime.utcnow())
+
+    dialect = db.session.get_bind().dialect
+    if dialect.update_returning:
+        return [row[0] for row in db.session.execute(statement.returning(Cylinder.__table__.c.id))]
+    result = db.session.execute(statement)
+    if result.rowcount == len(ids):
+        return ids
+    # 无 RETURNING 的数据库只能从已锁定的行中确认
+    return [row[0] for row in db.session.query(Cylinder.id).filter(
+        Cylinder.id.in_(ids), Cylinder.status == status
+    )]
+
+
+def reserve_cylinders(order, status='in_use'):
+    """
+    为订单认领 order.quantity 个同规格在库钢瓶并记录出库明细，订单指定了供货站点时只认领该站的钢瓶
+
+    在调用方的事务内执行，库存不足时抛出 InsufficientStockError，调用方应回滚
+    """
+    claimed = []
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        needed = order.quantity - len(claimed)
+        ids = _candidate_ids(order.specs, needed, order.station_id)
+        if len(ids) < needed:
+            raise InsufficientStockError(order.specs, len(claimed) + len(ids))
+        claimed.extend(_claim(ids, status))
+        if len(claimed) == order.quantity:
+            break
+    else:
+        raise ReservationConflictError('钢瓶出库冲突，请重试')
+
+    cylinders = Cylinder.query.filter(Cylinder.id.in_(claimed)).populate_existing().all()
+    # 批量 UPDATE 不触发 mapper 事件，需显式更新计数
+    deltas = Counter()
+    for cylinder in cylinders:
+        deltas[counter_key(cylinder.station_id, cylinder.specs, 'in_stock')] -= 1
+        deltas[counter_key(cylinder.station_id, cylinder.specs, status)] += 1
+    apply_deltas(db.session.connection(), deltas)
+
+    for cylinder in cylinders:
+        db.session.add(OrderCylinder(
+            order_id=order.id,
+            cylinder_id=cylinder.id,
+            serial_code=cylinder.serial_code
+        ))
+    return cylinders
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        drifts = reconcile_inventory()
+        for d in drifts:
+            print(f"  站点 {d['station_id']} {d['specs']} {d['status']}: {d['counted']} -> {d['actual']}")
+        print(f"✓ 库存对账完成，修正 {len(drifts)} 项")
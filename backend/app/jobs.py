@@ -0,0 +1,189 @@
+"""
+后台任务队列
+任务保存在数据库 jobs 表中。接口调用 enqueue() 在当前事务内写入任务，随请求一起提交后立即返回；
+worker 进程（python worker.py）按到期时间领取并执行，失败后按指数退避重试，
+超过最大次数标记为 failed。
+
+领取使用带条件的 UPDATE（status 仍为 pending 才改写），多个 worker 并发时同一任务只会被执行一次；
+执行超过 JOB_TIMEOUT 仍未结束的任务（如 worker 被杀掉）会重新回到队列。
+任务处理函数用 @job('名称') 注册，应当幂等
+"""
+import json
+import os
+import socket
+import time
+import traceback
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, update
+from app import db
+from app.models import Job
+
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE = 5          # 秒，第 n 次失败后等待 RETRY_BASE * 2^(n-1)
+DEFAULT_RETRY_MAX = 3600        # 秒，单次重试等待的上限
+DEFAULT_TIMEOUT = 600           # 秒，running 超过该时长视为 worker 已退出
+DEFAULT_POLL_INTERVAL = 1       # 秒，队列为空时 worker 的轮询间隔
+REQUEUE_INTERVAL = 60           # 秒，worker 检查超时任务的间隔
+
+JOB_STATUSES = ('pending', 'running', 'done', 'failed')
+
+# 任务名 -> 处理函数
+HANDLERS = {}
+
+
+class UnknownJobError(Exception):
+    """任务名没有注册处理函数"""
+    pass
+
+
+def job(name):
+    """注册任务处理函数，处理函数以任务参数为关键字参数调用"""
+    def decorator(f):
+        HANDLERS[name] = f
+        return f
+    return decorator
+
+
+def enqueue(name, delay=0, max_attempts=DEFAULT_MAX_ATTEMPTS, **payload):
+    """在当前事务内加入任务，由调用方提交；返回 Job"""
+    if name not in HANDLERS:
+        raise UnknownJobError(name)
+    item = Job(
+        name=name,
+        payload=json.dumps(payload, ensure_ascii=False),
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay)
+    )
+    db.session.add(item)
+    return item
+
+
+def schedule(name, delay=0, **payload):
+    """加入任务，已有同名待执行任务时不重复加入；周期任务执行后用它排定下一次，返回新任务或 None"""
+    if Job.query.filter_by(name=name, status='pending').first():
+        return None
+    return enqueue(name, delay=delay, **payload)
+
+
+def retry_delay(attempts):
+    """第 attempts 次失败后的等待秒数"""
+    config = current_app.config
+    base = config.get('JOB_RETRY_BASE', DEFAULT_RETRY_BASE)
+    return min(base * 2 ** (attempts - 1), config.get('JOB_RETRY_MAX', DEFAULT_RETRY_MAX))
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def requeue_stale():
+    """把超时未结束的 running 任务放回队列，返回条数"""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('JOB_TIMEOUT', DEFAULT_TIMEOUT))
+    count = db.session.execute(update(Job).where(
+        Job.status == 'running',
+        Job.locked_at < cutoff
+    ).values(status='pending', locked_by=None, locked_at=None)).rowcount
+    db.session.commit()
+    return count
+
+
+def claim(worker):
+    """领取一个到期的任务并标记为 running，队列为空时返回 None"""
+    while True:
+        now = datetime.utcnow()
+        candidate = db.session.query(Job.id).filter(
+            Job.status == 'pending',
+            Job.run_at <= now
+        ).order_by(Job.run_at, Job.id).limit(1).scalar()
+        if candidate is None:
+            db.session.commit()
+            return None
+        claimed = db.session.execute(update(Job).where(
+            Job.id == candidate,
+            Job.status == 'pending'
+        ).values(
+            status='running', locked_by=worker, locked_at=now, attempts=Job.attempts + 1
+        )).rowcount
+        db.session.commit()
+        # 被其他 worker 抢先领取时重新选取
+        if claimed:
+            return db.session.get(Job, candidate)
+
+
+def execute(item):
+    """执行已领取的任务并记录结果，返回是否成功"""
+    job_id, name, payload = item.id, item.name, json.loads(item.payload)
+    try:
+        handler = HANDLERS.get(name)
+        if handler is None:
+            raise UnknownJobError(name)
+        handler(**payload)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc(limit=5)
+        item = db.session.get(Job, job_id)
+        item.last_error = error
+        item.locked_by = item.locked_at = None
+        if item.attempts >= item.max_attempts or name not in HANDLERS:
+            item.status = 'failed'
+            item.finished_at = datetime.utcnow()
+        else:
+            item.status = 'pending'
+            item.run_at = datetime.utcnow() + timedelta(seconds=retry_delay(item.attempts))
+        db.session.commit()
+        return False
+
+    item = db.session.get(Job, job_id)
+    item.status = 'done'
+    item.finished_at = datetime.utcnow()
+    item.locked_by = item.locked_at = None
+    db.session.commit()
+    return True
+
+
+def run_pending(worker=None, limit=None):
+    """执行当前全部到期任务（最多 limit 个），返回 (成功数, 失败数)"""
+    worker = worker or worker_name()
+    done = failed = 0
+    while limit is None or done + failed < limit:
+        item = claim(worker)
+        if item is None:
+            break
+        if execute(item):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+def run_worker(poll_interval=None, stop=None):
+    """worker 主循环：处理到期任务，队列为空时休眠；stop() 返回 True 时退出"""
+    poll_interval = poll_interval or current_app.config.get('JOB_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+    worker = worker_name()
+    last_requeue = 0.0
+    while not (stop and stop()):
+        if time.monotonic() - last_requeue >= REQUEUE_INTERVAL:
+            requeue_stale()
+            last_requeue = time.monotonic()
+        done, failed = run_pending(worker)
+        db.session.remove()
+        if not done and not failed:
+            time.sleep(poll_interval)
+
+
+def queue_stats():
+    """各状态的任务数、按任务名统计的待执行数和最早到期任务的等待秒数"""
+    counts = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+    pending_by_name = dict(db.session.query(Job.name, func.count(Job.id)).filter(
+        Job.status == 'pending'
+    ).group_by(Job.name).all())
+    oldest = db.session.query(func.min(Job.run_at)).filter(Job.status == 'pending').scalar()
+    now = datetime.utcnow()
+    return {
+        **{status: counts.get(status, 0) for status in JOB_STATUSES},
+        'pending_by_name': pending_by_name,
+        'oldest_pending_seconds': max((now - oldest).total_seconds(), 0) if oldest and oldest <= now else 0
+    }
@@ -0,0 +1,110 @@
+"""
+数据库结构升级工具
+db.create_all() 只会创建缺失的表，不会给已存在的表补列或补建索引；
+本模块对比模型定义与现有数据库，补齐缺失的可空列和索引，回填新建的统计汇总表，
+并为每张表补建 table_versions 版本行，便于旧的 gas_system.db 平滑升级
+
+create_app() 启动时会自动执行；也可单独运行: python -m app.migrations
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from app import db
+
+
+def add_missing_columns(engine):
+    """为已存在的表补加模型中新增的可空列，返回 表名.列名 列表"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            # 非空列需要默认值才能补加，这类变更需要手工迁移
+            if column.name in existing or not column.nullable:
+                continue
+            ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            with engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+            added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def index_names(engine, inspector, table_name):
+    """表上已有的索引名；SQLite 的反射会跳过表达式索引，直接查询 sqlite_master"""
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as connection:
+            return set(connection.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"),
+                {'table': table_name}
+            ).scalars())
+    return {ix['name'] for ix in inspector.get_indexes(table_name)}
+
+
+def create_missing_indexes(engine):
+    """补建模型中声明但数据库中缺失的索引，返回新建的索引名列表"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = index_names(engine, inspector, table.name)
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name not in existing:
+                index.create(engine)
+                created.append(index.name)
+    return created
+
+
+def backfill_derived_tables(created_tables, existing_tables):
+    """为新建的汇总/计数表从源表回填数据，返回回填的表名列表"""
+    from app.rollups import rebuild_rollups
+    from app.inventory import reconcile_inventory
+    from app.forecast import refresh_forecasts
+
+    # (派生表, 源表, 回填函数)
+    backfills = [
+        (('order_daily_stats', 'courier_stats'), 'orders', rebuild_rollups),
+        (('inventory_counters',), 'cylinders', reconcile_inventory),
+        (('demand_daily_stats', 'demand_forecasts'), 'orders', lambda: refresh_forecasts(full=True)),
+    ]
+    filled = []
+    for tables, source, rebuild in backfills:
+        new_tables = [name for name in tables if name in created_tables]
+        if new_tables and source in existing_tables:
+            rebuild()
+            filled.extend(new_tables)
+    return filled
+
+
+def upgrade_schema(engine=None):
+    """执行全部结构升级步骤，返回本次执行的变更列表"""
+    engine = engine or db.engine
+    existing_tables = set(inspect(engine).get_table_names())
+    db.metadata.create_all(engine)
+    created_tables = set(db.metadata.tables) - existing_tables
+    changes = [f'创建表 {name}' for name in sorted(created_tables)]
+    changes.extend(f'补加列 {name}' for name in add_missing_columns(engine))
+    changes.extend(f'创建索引 {name}' for name in create_missing_indexes(engine))
+    changes.extend(f'回填 {name}' for name in backfill_derived_tables(created_tables, existing_tables))
+
+    from app.http_cache import ensure_version_rows
+    with engine.begin() as connection:
+        ensure_version_rows(connection)
+    return changes
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from app.search import ensure_search_index
+
+    # 关闭启动时的自动升级，才能统计本次实际执行的变更
+    app = create_app({'SCHEMA_AUTO_UPGRADE': False})
+    with app.app_context():
+        changes = upgrade_schema()
+        ensure_search_index(db.engine)
+        for name in changes:
+            print(f"✓ {name}")
+        print(f"✓ 数据库结构升级完成，共 {len(changes)} 项变更")
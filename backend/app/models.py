@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from enum import Enum
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -34,6 +35,11 @@ class HazardLevel(str, Enum):
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # 按角色筛选用户列表、统计用户数
+        db.Index('ix_users_role_created_at', 'role', 'created_at'),
+        db.Index('ix_users_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -65,6 +71,12 @@ class User(db.Model):
 
 class Cylinder(db.Model):
     __tablename__ = 'cylinders'
+    __table_args__ = (
+        # 库存检查/出库按 (status, specs) 等值过滤，状态统计按 status 分组
+        db.Index('ix_cylinders_status_specs', 'status', 'specs'),
+        db.Index('ix_cylinders_expiry_date', 'expiry_date'),
+        db.Index('ix_cylinders_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     serial_code = db.Column(db.String(50), unique=True, nullable=False)
@@ -96,11 +108,28 @@ class Cylinder(db.Model):
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # 订单列表按角色过滤后按 (created_at, id) 倒序分页
+        db.Index('ix_orders_created_at', 'created_at', 'id'),
+        db.Index('ix_orders_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_orders_delivery_id_created_at', 'delivery_id', 'created_at'),
+        db.Index('ix_orders_status_created_at', 'status', 'created_at'),
+        # 今日收入、配送排名只统计已完成订单
+        db.Index('ix_orders_status_completed_at', 'status', 'completed_at'),
+        db.Index('ix_orders_status_delivery_id', 'status', 'delivery_id'),
+        # 站点批量派单按下单时间读取本站待处理订单
+        db.Index('ix_orders_station_id_status_created_at', 'station_id', 'status', 'created_at'),
+        # 订单列表的电话筛选与金额排序
+        db.Index('ix_orders_contact_phone_created_at', 'contact_phone', 'created_at'),
+        # 金额可为空，按 coalesce(total_amount, 0) 排序分页（见 app/pagination.py 的 nullable_key）
+        db.Index('ix_orders_total_amount_sort', db.func.coalesce(db.column('total_amount'), db.literal_column('0')), 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     order_no = db.Column(db.String(50), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     delivery_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    station_id = db.Column(db.Integer)  # 供货站点，完成时只从该站出库；为空时不限站点
     status = db.Column(db.String(20), default=OrderStatus.PENDING.value)
     specs = db.Column(db.String(20), nullable=False)
     quantity = db.Column(db.Integer, default=1)
@@ -113,6 +142,8 @@ class Order(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     assigned_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
+    latitude = db.Column(db.Float)    # 配送地址坐标（WGS84），用于推荐就近配送员
+    longitude = db.Column(db.Float)
     
     # 关联
     user = db.relationship('User', foreign_keys=[user_id], backref='orders')
@@ -126,6 +157,7 @@ class Order(db.Model):
             'user_name': self.user.username if self.user else None,
             'delivery_id': self.delivery_id,
             'delivery_name': self.delivery.username if self.delivery else None,
+            'station_id': self.station_id,
             'status': self.status,
             'specs': self.specs,
             'quantity': self.quantity,
@@ -137,13 +169,43 @@ class Order(db.Model):
             'remark': self.remark,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'assigned_at': self.assigned_at.isoformat() if self.assigned_at else None,
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'latitude': self.latitude,
+            'longitude': self.longitude
+        }
+
+class OrderCylinder(db.Model):
+    """订单完成时出库的钢瓶明细"""
+    __tablename__ = 'order_cylinders'
+    __table_args__ = (
+        db.Index('ix_order_cylinders_order_id', 'order_id'),
+        db.Index('ix_order_cylinders_cylinder_id', 'cylinder_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    cylinder_id = db.Column(db.Integer, db.ForeignKey('cylinders.id'), nullable=False)
+    serial_code = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'cylinder_id': self.cylinder_id,
+            'serial_code': self.serial_code,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 # ==================== 安全记录模型 ====================
 
 class SafetyRecord(db.Model):
     __tablename__ = 'safety_records'
+    __table_args__ = (
+        db.Index('ix_safety_records_created_at', 'created_at'),
+        db.Index('ix_safety_records_inspector_id_created_at', 'inspector_id', 'created_at'),
+        db.Index('ix_safety_records_hazard_level_created_at', 'hazard_level', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'))
@@ -161,6 +223,8 @@ class SafetyRecord(db.Model):
     inspector = db.relationship('User', backref='inspections')
     
     def to_dict(self):
+        from app.uploads import thumbnail_url
+        
         return {
             'id': self.id,
             'order_id': self.order_id,
@@ -171,8 +235,12 @@ class SafetyRecord(db.Model):
             'hazard_level': self.hazard_level,
             'hazard_description': self.hazard_description,
             'photos': self.photos.split(',') if self.photos else [],
+            'photo_thumbnails': [thumbnail_url(url) for url in self.photos.split(',')] if self.photos else [],
             'rectify_status': self.rectify_status,
             'rectify_photos': self.rectify_photos.split(',') if self.rectify_photos else [],
+            'rectify_photo_thumbnails': (
+                [thumbnail_url(url) for url in self.rectify_photos.split(',')] if self.rectify_photos else []
+            ),
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
@@ -180,6 +248,11 @@ class SafetyRecord(db.Model):
 
 class Announcement(db.Model):
     __tablename__ = 'announcements'
+    __table_args__ = (
+        # 与公告列表的排序键 coalesce(is_top, False), created_at, id 一致
+        db.Index('ix_announcements_top_sort', db.func.coalesce(db.column('is_top'), db.literal_column('False')),
+                 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -205,6 +278,10 @@ class Announcement(db.Model):
 
 class Rating(db.Model):
     __tablename__ = 'ratings'
+    __table_args__ = (
+        db.Index('ix_ratings_order_id', 'order_id'),
+        db.Index('ix_ratings_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
@@ -225,3 +302,180 @@ class Rating(db.Model):
             'comment': self.comment,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+# ==================== 统计汇总模型 ====================
+
+class OrderDailyStat(db.Model):
+    """按自然日汇总的订单计数，随下单/完成订单在同一事务内累加"""
+    __tablename__ = 'order_daily_stats'
+    
+    stat_date = db.Column(db.Date, primary_key=True)
+    order_count = db.Column(db.Integer, default=0, nullable=False)      # 当日下单数
+    completed_count = db.Column(db.Integer, default=0, nullable=False)  # 当日完成数
+    revenue = db.Column(db.Float, default=0, nullable=False)            # 当日完成订单收入
+    
+    def to_dict(self):
+        return {
+            'date': self.stat_date.isoformat(),
+            'order_count': self.order_count,
+            'completed_count': self.completed_count,
+            'revenue': self.revenue
+        }
+
+class CourierStat(db.Model):
+    """配送员累计计数，随订单分配/完成/取消在同一事务内累加"""
+    __tablename__ = 'courier_stats'
+    
+    delivery_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    assigned_count = db.Column(db.Integer, default=0, nullable=False)   # 累计分配数
+    completed_count = db.Column(db.Integer, default=0, nullable=False)  # 累计完成数
+    open_count = db.Column(db.Integer, default=0, nullable=False)       # 当前未完成数
+    
+    delivery = db.relationship('User')
+    
+    def to_dict(self):
+        return {
+            'delivery_id': self.delivery_id,
+            'assigned_count': self.assigned_count,
+            'completed_count': self.completed_count,
+            'open_count': self.open_count
+        }
+
+class InventoryCounter(db.Model):
+    """按 (站点, 规格, 状态) 维护的钢瓶数量，未分配站点的钢瓶记在 station_id=0 下"""
+    __tablename__ = 'inventory_counters'
+    
+    station_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    specs = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, default=0, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'station_id': self.station_id,
+            'specs': self.specs,
+            'status': self.status,
+            'count': self.count
+        }
+
+class ReplicaHeartbeat(db.Model):
+    """主库定期写入的心跳时间，只读副本上读到的值用于估算复制延迟"""
+    __tablename__ = 'replica_heartbeat'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+class TableVersion(db.Model):
+    """每张表的写入版本号与最后修改时间，用于条件 GET 的 ETag / Last-Modified"""
+    __tablename__ = 'table_versions'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+class Event(db.Model):
+    """订单/钢瓶状态变更事件，供实时推送与断线续传（见 app/events.py）"""
+    __tablename__ = 'events'
+    __table_args__ = (
+        # 普通用户、配送员只订阅与自己相关的事件
+        db.Index('ix_events_user_id_id', 'user_id', 'id'),
+        db.Index('ix_events_delivery_id_id', 'delivery_id', 'id'),
+        db.Index('ix_events_created_at', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(40), nullable=False)
+    user_id = db.Column(db.Integer)       # 可见该事件的下单用户
+    delivery_id = db.Column(db.Integer)   # 可见该事件的配送员
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Job(db.Model):
+    """后台任务队列，由 worker.py 进程领取执行（见 app/jobs.py）"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # worker 按到期时间领取待执行任务
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    payload = db.Column(db.Text, nullable=False)             # JSON 格式的参数
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, running, done, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(80))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'payload': json.loads(self.payload),
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.isoformat() if self.run_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class CourierLocation(db.Model):
+    """配送员最近上报的位置，按 geohash 前缀检索附近的配送员（见 app/geo.py）"""
+    __tablename__ = 'courier_locations'
+    __table_args__ = (
+        db.Index('ix_courier_locations_geohash', 'geohash'),
+    )
+    
+    delivery_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    geohash = db.Column(db.String(12), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    delivery = db.relationship('User')
+    
+    def to_dict(self):
+        return {
+            'delivery_id': self.delivery_id,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class DemandDailyStat(db.Model):
+    """按 (日期, 站点, 规格) 汇总的钢瓶需求量，由 forecast.refresh 每晚增量重算（见 app/forecast.py）"""
+    __tablename__ = 'demand_daily_stats'
+    
+    stat_date = db.Column(db.Date, primary_key=True)
+    station_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 配送员所属站点，未分配为 0
+    specs = db.Column(db.String(20), primary_key=True)
+    quantity = db.Column(db.Integer, default=0, nullable=False)     # 下单钢瓶数（不含已取消）
+    order_count = db.Column(db.Integer, default=0, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'date': self.stat_date.isoformat(),
+            'station_id': self.station_id,
+            'specs': self.specs,
+            'quantity': self.quantity,
+            'order_count': self.order_count
+        }
+
+class DemandForecast(db.Model):
+    """每个 (站点, 规格) 最近一次拟合选出的模型及未来若干天的预测需求"""
+    __tablename__ = 'demand_forecasts'
+    
+    station_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    specs = db.Column(db.String(20), primary_key=True)
+    model = db.Column(db.String(50), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)     # 预测的第一天
+    values = db.Column(db.Text, nullable=False)         # JSON 数组，自 start_date 起每天的预测钢瓶数
+    mae = db.Column(db.Float, default=0, nullable=False)  # 回测期每日平均绝对误差
+    history_days = db.Column(db.Integer, default=0, nullable=False)
+    fitted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,164 @@
+"""
+游标分页工具模块
+基于排序键（如 created_at, id）的 keyset 分页，响应大小与表规模无关
+"""
+import base64
+import json
+from datetime import date, datetime
+from flask import request, jsonify, current_app
+from sqlalchemy import and_, func, literal, literal_column, or_
+from app.streaming import stream_format, stream_query
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class CursorError(ValueError):
+    """分页游标无效"""
+
+
+def nullable_key(column, default):
+    """
+    可为空列的排序键：排序与游标条件都比较 coalesce(列, default)
+
+    直接比较 NULL 的结果为 NULL，游标会漏掉或停在该列为空的行；default 以字面量写入 SQL，
+    才能命中以同样表达式建立的索引
+    """
+    key = func.coalesce(column, literal_column(repr(default))).label(column.key)
+    key.null_default = default
+    return key
+
+
+def cursor_value(row, key):
+    """行在排序键上的取值，nullable_key 的空值按其默认值计"""
+    value = getattr(row, key.key)
+    return getattr(key, 'null_default', None) if value is None else value
+
+
+def encode_cursor(values, direction):
+    """将排序键的取值编码为不透明游标"""
+    payload = {
+        'd': direction,
+        'k': [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, keys):
+    """解析游标，返回 (排序键取值列表, 方向)"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        direction = payload['d']
+        values = payload['k']
+    except (ValueError, TypeError, KeyError):
+        raise CursorError(token)
+    if direction not in ('next', 'prev') or not isinstance(values, list) or len(values) != len(keys):
+        raise CursorError(token)
+
+    decoded = []
+    for column, value in zip(keys, values):
+        python_type = column.type.python_type
+        try:
+            if value is None:
+                decoded.append(None)
+            elif python_type is datetime:
+                decoded.append(datetime.fromisoformat(value))
+            elif python_type is date:
+                decoded.append(date.fromisoformat(value))
+            else:
+                decoded.append(python_type(value))
+        except (ValueError, TypeError):
+            raise CursorError(token)
+    return decoded, direction
+
+
+def _keyset_filter(keys, values, less):
+    """构造 (k1, k2, ...) < / > (v1, v2, ...) 的可移植展开式"""
+    clauses = []
+    for i, column in enumerate(keys):
+        # 布尔值不能直接用于 < / > 比较，按列类型绑定为参数
+        value = literal(values[i], column.type) if isinstance(values[i], bool) else values[i]
+        compare = column < value if less else column > value
+        clauses.append(and_(*[keys[j] == values[j] for j in range(i)], compare))
+    return or_(*clauses)
+
+
+def get_page_size():
+    """读取 limit 参数并限制在允许范围内"""
+    default = current_app.config.get('PAGE_SIZE_DEFAULT', DEFAULT_PAGE_SIZE)
+    maximum = current_app.config.get('PAGE_SIZE_MAX', MAX_PAGE_SIZE)
+    try:
+        limit = int(request.args.get('limit', default))
+    except (ValueError, TypeError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def is_paginated():
+    """请求是否启用了游标分页模式"""
+    return 'limit' in request.args or 'cursor' in request.args
+
+
+def paginate(query, keys, serialize=None, descending=True):
+    """
+    对列表查询输出响应，所有排序键按同一方向排列（默认降序）
+
+    未携带 limit/cursor 参数时保持原有行为，返回完整数组；
+    否则返回 {items, next_cursor, prev_cursor, has_more, limit}；
+    请求流式输出时（见 app.streaming）忽略分页参数，逐块输出全部结果
+    """
+    serialize = serialize or (lambda obj: obj.to_dict())
+    forward = [k.desc() if descending else k.asc() for k in keys]
+    backward = [k.asc() if descending else k.desc() for k in keys]
+
+    fmt = stream_format()
+    if fmt:
+        return stream_query(query.order_by(*forward), serialize, fmt)
+
+    if not is_paginated():
+        rows = query.order_by(*forward).all()
+        return jsonify([serialize(r) for r in rows])
+
+    limit = get_page_size()
+    token = request.args.get('cursor')
+    values, direction = None, 'next'
+    if token:
+        try:
+            values, direction = decode_cursor(token, keys)
+        except CursorError:
+            return jsonify({'error': '无效的分页游标'}), 400
+
+    if direction == 'next':
+        if values is not None:
+            query = query.filter(_keyset_filter(keys, values, less=descending))
+        rows = query.order_by(*forward).limit(limit + 1).all()
+    else:
+        query = query.filter(_keyset_filter(keys, values, less=not descending))
+        rows = query.order_by(*backward).limit(limit + 1).all()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    def cursor_of(row, cursor_direction):
+        return encode_cursor([cursor_value(row, k) for k in keys], cursor_direction)
+
+    if direction == 'next':
+        has_more = more
+        next_cursor = cursor_of(rows[-1], 'next') if rows and more else None
+        prev_cursor = cursor_of(rows[0], 'prev') if rows and values is not None else None
+    else:
+        rows.reverse()
+        has_more = bool(rows)
+        next_cursor = cursor_of(rows[-1], 'next') if rows else None
+        prev_cursor = cursor_of(rows[0], 'prev') if rows and more else None
+
+    return jsonify({
+        'items': [serialize(r) for r in rows],
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+        'has_more': has_more,
+        'limit': limit
+    })
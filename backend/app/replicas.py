@@ -0,0 +1,174 @@
+"""
+只读副本路由模块
+标记为只读的 GET 路由（@replica_read，或 REPLICA_BLUEPRINTS 中蓝图的全部 GET 路由）
+把查询发往只读副本，写入、flush 以及客户端刚写入后的读取仍走主库。
+
+副本来自 SQLALCHEMY_REPLICA_URIS（环境变量 DATABASE_REPLICA_URLS，逗号分隔），
+依次命名为 replica_0、replica_1 ...。路由器定期在主库写入心跳并从各副本读回，
+复制延迟超过 REPLICA_MAX_LAG 秒的副本暂时移出轮询；没有可用副本时回落到主库
+"""
+import itertools
+import os
+import threading
+import time
+from datetime import datetime
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, insert, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.dml import UpdateBase
+
+
+REPLICA_NAME_PREFIX = 'replica_'
+
+DEFAULT_MAX_LAG = 5                 # 秒，延迟超过该值的副本不参与轮询
+DEFAULT_LAG_CHECK_INTERVAL = 1      # 秒，两次延迟检测的最小间隔
+DEFAULT_READ_AFTER_WRITE = 5        # 秒，客户端写入后的读取走主库的时长
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def create_replica_engine(app, uri):
+    """按主库相同的规则创建副本引擎：SQLite 相对路径放在 instance 目录，其他数据库启用连接池"""
+    from app.database import engine_options
+
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:') \
+            and not os.path.isabs(url.database):
+        url = url.set(database=os.path.join(app.instance_path, url.database))
+    return create_engine(url, **engine_options(uri))
+
+
+def replica_read(f):
+    """标记路由的 GET 请求可以读取只读副本"""
+    f.replica_read = True
+    return f
+
+
+class RoutingSession(Session):
+    """请求被路由到副本时，只读查询使用副本引擎，写入与 flush 使用主库"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase):
+            engine = current_replica()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    """在延迟达标的副本间轮询，并按间隔检测各副本的复制延迟"""
+
+    def __init__(self, app, engines):
+        self.app = app
+        self.replicas = dict(engines)
+        self.names = list(self.replicas)
+        self.lags = {name: None for name in self.names}
+        self.healthy = []
+        self.last_beat = None
+        self.checked_at = 0.0
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def primary(self):
+        return self.app.extensions['sqlalchemy'].engines[None]
+
+    def choose(self):
+        """返回本次读取使用的副本引擎，没有可用副本时返回 None"""
+        interval = self.app.config.get('REPLICA_LAG_CHECK_INTERVAL', DEFAULT_LAG_CHECK_INTERVAL)
+        if time.monotonic() - self.checked_at >= interval and self._lock.acquire(blocking=False):
+            try:
+                self.check_lag()
+            finally:
+                self._lock.release()
+        healthy = self.healthy
+        if not healthy:
+            return None
+        return self.replicas[healthy[next(self._counter) % len(healthy)]]
+
+    def check_lag(self):
+        """读取各副本的心跳估算延迟，再在主库写入新的心跳，返回 {副本: 延迟秒数}"""
+        from app.models import ReplicaHeartbeat
+
+        table = ReplicaHeartbeat.__table__
+        max_lag = self.app.config.get('REPLICA_MAX_LAG', DEFAULT_MAX_LAG)
+        now = datetime.now()
+
+        for name in self.names:
+            try:
+                with self.replicas[name].connect() as conn:
+                    beat_at = conn.execute(select(table.c.beat_at).where(table.c.id == 1)).scalar()
+            except SQLAlchemyError:
+                beat_at = None
+            if beat_at is None:
+                self.lags[name] = None
+            elif self.last_beat is not None and beat_at >= self.last_beat:
+                self.lags[name] = 0.0
+            else:
+                self.lags[name] = max((now - beat_at).total_seconds(), 0.0)
+
+        # 心跳写入失败（如主库繁忙）不影响本次读取，下次检测时重试
+        try:
+            with self.primary().begin() as conn:
+                if not conn.execute(update(table).where(table.c.id == 1).values(beat_at=now)).rowcount:
+                    conn.execute(insert(table).values(id=1, beat_at=now))
+            self.last_beat = now
+        except SQLAlchemyError:
+            pass
+
+        self.healthy = [name for name in self.names if self.lags[name] is not None and self.lags[name] <= max_lag]
+        self.checked_at = time.monotonic()
+        return dict(self.lags)
+
+
+def current_replica():
+    """当前请求应使用的副本引擎；未路由到副本时返回 None"""
+    if not has_request_context() or not g.get('use_replica'):
+        return None
+    if 'replica_engine' not in g:
+        g.replica_engine = current_app.extensions['replica_router'].choose()
+    return g.replica_engine
+
+
+def init_replicas(app, pragmas=None):
+    """根据 SQLALCHEMY_REPLICA_URIS 创建副本引擎和路由器，并注册请求钩子"""
+    from app.database import apply_sqlite_pragmas
+
+    uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    if not uris:
+        return None
+    engines = {}
+    for i, uri in enumerate(uris):
+        engine = engines[f'{REPLICA_NAME_PREFIX}{i}'] = create_replica_engine(app, uri)
+        apply_sqlite_pragmas(engine, pragmas)
+    router = app.extensions['replica_router'] = ReplicaRouter(app, engines)
+
+    @app.before_request
+    def route_reads():
+        g.pop('use_replica', None)
+        g.pop('replica_engine', None)
+        if request.method not in ('GET', 'HEAD'):
+            return
+        view = app.view_functions.get(request.endpoint)
+        if not (getattr(view, 'replica_read', False)
+                or request.blueprint in app.config.get('REPLICA_BLUEPRINTS', ())):
+            return
+        # 写入后的一段时间内读主库，保证客户端能读到自己刚写入的数据
+        if session.get('primary_until', 0) > time.time():
+            return
+        g.use_replica = True
+
+    @app.after_request
+    def pin_primary_after_write(response):
+        if request.method in WRITE_METHODS and response.status_code < 400:
+            window = app.config.get('REPLICA_READ_AFTER_WRITE', DEFAULT_READ_AFTER_WRITE)
+            session['primary_until'] = time.time() + window
+        return response
+
+    @app.teardown_request
+    def clear_route(exc):
+        g.pop('use_replica', None)
+        g.pop('replica_engine', None)
+
+    return router
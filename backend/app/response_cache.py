@@ -0,0 +1,153 @@
+"""
+服务端响应缓存模块
+@cached(tags) 装饰的 GET 路由按 (路由, 查询参数, 角色) 缓存 200 响应体，
+默认使用进程内 LRU + TTL；配置 RESPONSE_CACHE_URL=redis://... 时改用 Redis 兼容的共享缓存。
+
+失效依赖数据库中的表版本：缓存键包含各标签（表名）在 table_versions 中的版本号（见 app/http_cache.py，
+与 ETag 使用同一组版本，@conditional 已读取时直接复用）。任何进程提交的写入都会在同一事务内累加版本，
+之后所有 worker 计算出新的键，旧条目不再命中，由 TTL / LRU 自然淘汰
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, make_response, request
+from app.http_cache import table_versions
+
+
+DEFAULT_TTL = 5
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class LocalCache:
+    """进程内 LRU 缓存，条目带过期时间"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """Redis 兼容的共享缓存，client 只需提供 get / set(ex=)"""
+
+    def __init__(self, client, prefix='gas:cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RESPONSE_CACHE_URL 指向 Redis，需要先安装 redis 包')
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+
+class ResponseCache:
+    """缓存后端加上按路由统计的命中/未命中次数"""
+
+    def __init__(self, backend, ttl=DEFAULT_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def count(self, route, outcome):
+        with self._lock:
+            counts = self.metrics.setdefault(route, {'hits': 0, 'misses': 0})
+            counts[outcome] += 1
+
+    def snapshot(self):
+        with self._lock:
+            routes = {route: dict(counts) for route, counts in self.metrics.items()}
+        hits = sum(c['hits'] for c in routes.values())
+        misses = sum(c['misses'] for c in routes.values())
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            'routes': routes
+        }
+
+
+def init_response_cache(app):
+    """按 RESPONSE_CACHE_URL 创建缓存；可预先在 app.extensions['response_cache'] 放入自定义实例"""
+    if 'response_cache' in app.extensions:
+        return app.extensions['response_cache']
+    url = app.config.get('RESPONSE_CACHE_URL')
+    if url:
+        backend = RedisCache.from_url(url)
+    else:
+        backend = LocalCache(app.config.get('RESPONSE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+    cache = app.extensions['response_cache'] = ResponseCache(
+        backend, app.config.get('RESPONSE_CACHE_TTL', DEFAULT_TTL)
+    )
+    return cache
+
+
+def cached(tags):
+    """缓存 GET 路由的 200 响应，tags 为响应所依赖的表名"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from app.auth import get_current_identity
+
+            cache = current_app.extensions.get('response_cache')
+            if cache is None or cache.ttl <= 0:
+                return f(*args, **kwargs)
+
+            identity = get_current_identity()
+            versions = g.get('table_versions', {})
+            if not set(tags) <= versions.keys():
+                versions = table_versions(tags)
+            parts = [request.endpoint, *sorted(f'{k}={v}' for k, v in request.args.items(multi=True)),
+                     identity.role if identity else '']
+            parts += [f'{tag}:{versions.get(tag, (0, None))[0]}' for tag in tags]
+            key = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+            body = cache.backend.get(key)
+            if body is not None:
+                cache.count(request.endpoint, 'hits')
+                response = make_response(body)
+                response.mimetype = 'application/json'
+                return response
+
+            cache.count(request.endpoint, 'misses')
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                cache.backend.set(key, response.get_data(), cache.ttl)
+            return response
+        return decorated_function
+    return decorator
+
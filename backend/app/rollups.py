@@ -0,0 +1,114 @@
+"""
+统计汇总表维护模块
+下单、分配、完成、取消订单时，在同一事务内累加 order_daily_stats 与 courier_stats，
+统计接口只需读取 O(天数) 或 O(配送员数) 行
+
+重建全部汇总: python -m app.rollups
+"""
+from datetime import date
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.jobs import job
+from app.database import day_of
+from app.models import Order, OrderDailyStat, CourierStat
+from app.stats import count_if
+
+
+def bump(model, key, **deltas):
+    """原子地累加计数器行，行不存在时插入"""
+    conditions = [getattr(model, name) == value for name, value in key.items()]
+    values = {name: getattr(model, name) + delta for name, delta in deltas.items()}
+    statement = update(model).where(*conditions).values(**values)
+    if db.session.execute(statement).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**key, **deltas))
+    except IntegrityError:
+        # 并发插入了同一行，改为累加
+        db.session.execute(statement)
+
+
+# ==================== 写路径钩子 ====================
+
+def record_order_created(order):
+    """下单：当日下单数 +1（需在 flush 之后调用以取得 created_at）"""
+    bump(OrderDailyStat, {'stat_date': order.created_at.date()}, order_count=1)
+
+
+def record_order_assigned(order):
+    """分配：配送员分配数、未完成数 +1"""
+    bump(CourierStat, {'delivery_id': order.delivery_id}, assigned_count=1, open_count=1)
+
+
+def record_order_completed(order):
+    """完成：当日完成数与收入累加，配送员完成数 +1、未完成数 -1"""
+    bump(
+        OrderDailyStat, {'stat_date': order.completed_at.date()},
+        completed_count=1, revenue=order.total_amount or 0
+    )
+    if order.delivery_id:
+        bump(CourierStat, {'delivery_id': order.delivery_id}, completed_count=1, open_count=-1)
+
+
+def record_order_cancelled(order):
+    """取消：已分配的订单释放配送员的未完成数"""
+    if order.delivery_id:
+        bump(CourierStat, {'delivery_id': order.delivery_id}, open_count=-1)
+
+
+# ==================== 重建 ====================
+
+@job('rollups.rebuild')
+def rebuild_rollups():
+    """根据订单表重新计算全部汇总行，返回 (天数, 配送员数)"""
+    OrderDailyStat.query.delete()
+    CourierStat.query.delete()
+
+    days = {}
+    created_day = day_of(Order.created_at)
+    for day, count in db.session.query(
+        created_day, func.count(Order.id)
+    ).filter(Order.created_at.isnot(None)).group_by(created_day):
+        days[str(day)] = {'order_count': count, 'completed_count': 0, 'revenue': 0}
+
+    completed_day = day_of(Order.completed_at)
+    for day, count, revenue in db.session.query(
+        completed_day, func.count(Order.id), func.sum(Order.total_amount)
+    ).filter(
+        Order.status == 'completed',
+        Order.completed_at.isnot(None)
+    ).group_by(completed_day):
+        row = days.setdefault(str(day), {'order_count': 0, 'completed_count': 0, 'revenue': 0})
+        row['completed_count'] = count
+        row['revenue'] = float(revenue or 0)
+
+    for day, row in days.items():
+        db.session.add(OrderDailyStat(stat_date=date.fromisoformat(day), **row))
+
+    couriers = db.session.query(
+        Order.delivery_id,
+        func.count(Order.id),
+        count_if(Order.status == 'completed'),
+        count_if(Order.status.in_(['assigned', 'delivering']))
+    ).filter(Order.delivery_id.isnot(None)).group_by(Order.delivery_id).all()
+    for delivery_id, assigned, completed, open_count in couriers:
+        db.session.add(CourierStat(
+            delivery_id=delivery_id,
+            assigned_count=assigned,
+            completed_count=completed or 0,
+            open_count=open_count or 0
+        ))
+
+    db.session.commit()
+    return len(days), len(couriers)
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        day_count, courier_count = rebuild_rollups()
+        print(f"✓ 汇总表重建完成: {day_count} 天, {courier_count} 名配送员")
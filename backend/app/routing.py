@@ -0,0 +1,167 @@
+"""
+配送路线规划模块
+为配送员手上的未完成订单（assigned / delivering）排出访问顺序并估算到达时间:
+
+1. 起点取配送员最近上报的位置（无位置时从最早分配的一单出发），没有坐标的订单排在最后且不估算时间
+2. 最近邻法生成初始路线，再用 2-opt 反转路段直到没有改进（开放路线，终点不回起点）
+3. 到达时间 = 当前时间 + 累计里程 / ROUTE_SPEED_KMH + 已完成站点数 × ROUTE_SERVICE_MINUTES
+
+两点间距离按坐标缓存（进程内 LRU），订单状态变化后重新规划时只需计算新增点的距离；
+订单进入 delivering 时自动重新规划并以 courier.route_updated 事件推送给该配送员
+"""
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from flask import current_app
+from app import db
+from app.models import Order, CourierLocation
+from app.geo import haversine_km
+from app.events import emit
+
+
+DEFAULT_SPEED_KMH = 20          # 城区电动三轮车平均车速
+DEFAULT_SERVICE_MINUTES = 5     # 每单上楼、换瓶、收款的停留时间
+DISTANCE_CACHE_SIZE = 100000    # 缓存的点对数量
+MAX_IMPROVE_SECONDS = 0.2       # 2-opt 的时间上限，站点很多时提前返回当前最优解
+COORDINATE_DIGITS = 6           # 坐标按约 0.1m 取整后作为缓存键
+
+OPEN_STATUSES = ('assigned', 'delivering')
+
+
+@lru_cache(maxsize=DISTANCE_CACHE_SIZE)
+def _cached_distance(a, b):
+    return haversine_km(a[0], a[1], b[0], b[1])
+
+
+def point_distance(a, b):
+    """两点距离（km），点对无序缓存"""
+    if a == b:
+        return 0.0
+    return _cached_distance(a, b) if a < b else _cached_distance(b, a)
+
+
+def distance_cache_info():
+    return _cached_distance.cache_info()
+
+
+def distance_matrix(points):
+    return [[point_distance(a, b) for b in points] for a in points]
+
+
+def path_length(path, matrix):
+    return sum(matrix[path[k]][path[k + 1]] for k in range(len(path) - 1))
+
+
+def nearest_neighbor(matrix):
+    """从 0 号点出发，每次前往最近的未访问点"""
+    unvisited = set(range(1, len(matrix)))
+    path = [0]
+    while unvisited:
+        row = matrix[path[-1]]
+        nearest = min(unvisited, key=lambda k: (row[k], k))
+        path.append(nearest)
+        unvisited.remove(nearest)
+    return path
+
+
+def two_opt(path, matrix, deadline=None):
+    """
+    反转 path[i..j] 缩短开放路线，起点固定、终点不回起点
+
+    改进量 = 原两条边 (i-1,i)、(j,j+1) 减去新两条边 (i-1,j)、(i,j+1)；j 为终点时没有 (j,j+1) 边
+    """
+    path = list(path)
+    n = len(path)
+    improved = True
+    while improved and not (deadline and time.monotonic() > deadline):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = path[i - 1], path[i]
+            row_a, row_b = matrix[a], matrix[b]
+            for j in range(i + 1, n):
+                c = path[j]
+                if j + 1 < n:
+                    d = path[j + 1]
+                    delta = row_a[b] + matrix[c][d] - row_a[c] - row_b[d]
+                else:
+                    delta = row_a[b] - row_a[c]
+                if delta > 1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    b = path[i]
+                    row_b = matrix[b]
+                    improved = True
+    return path
+
+
+def sequence_stops(start, stops, deadline=None):
+    """
+    给定起点和各站点坐标，返回 (访问顺序, 各段里程)
+
+    start 为 (纬度, 经度)，为 None 时从第一站出发；返回的顺序为 stops 的下标
+    """
+    if not stops:
+        return [], []
+    offset = 0 if start is None else 1
+    points = ([] if start is None else [start]) + list(stops)
+    matrix = distance_matrix(points)
+    path = two_opt(nearest_neighbor(matrix), matrix, deadline)
+    legs = [0.0 if start is None else matrix[0][path[offset]]]
+    legs += [matrix[path[k - 1]][path[k]] for k in range(offset + 1, len(path))]
+    return [k - offset for k in path[offset:]], legs
+
+
+def plan_route(delivery_id, now=None):
+    """规划配送员当前未完成订单的访问顺序与预计到达时间"""
+    config = current_app.config
+    speed = config.get('ROUTE_SPEED_KMH', DEFAULT_SPEED_KMH)
+    service = config.get('ROUTE_SERVICE_MINUTES', DEFAULT_SERVICE_MINUTES)
+    now = now or datetime.utcnow()
+
+    orders = Order.query.filter(
+        Order.delivery_id == delivery_id,
+        Order.status.in_(OPEN_STATUSES)
+    ).order_by(Order.assigned_at, Order.id).all()
+    routable = [o for o in orders if o.latitude is not None and o.longitude is not None]
+    unrouted = [o for o in orders if o.latitude is None or o.longitude is None]
+
+    location = db.session.get(CourierLocation, delivery_id)
+    start = None
+    if location is not None:
+        start = (round(location.latitude, COORDINATE_DIGITS), round(location.longitude, COORDINATE_DIGITS))
+    stops = [(round(o.latitude, COORDINATE_DIGITS), round(o.longitude, COORDINATE_DIGITS)) for o in routable]
+    sequence, legs = sequence_stops(start, stops, time.monotonic() + MAX_IMPROVE_SECONDS)
+
+    elapsed_minutes = 0.0
+    planned = []
+    for position, (index, leg) in enumerate(zip(sequence, legs), start=1):
+        order = routable[index]
+        elapsed_minutes += leg / speed * 60
+        planned.append({
+            'sequence': position,
+            'order_id': order.id,
+            'order_no': order.order_no,
+            'status': order.status,
+            'address': order.address,
+            'latitude': order.latitude,
+            'longitude': order.longitude,
+            'leg_km': round(leg, 3),
+            'eta': (now + timedelta(minutes=elapsed_minutes)).isoformat()
+        })
+        elapsed_minutes += service
+
+    return {
+        'delivery_id': delivery_id,
+        'start': {'latitude': start[0], 'longitude': start[1], 'updated_at': location.updated_at.isoformat()}
+                 if start else None,
+        'total_distance_km': round(sum(legs), 3),
+        'total_minutes': round(elapsed_minutes, 1),
+        'stops': planned,
+        'unrouted': [{'order_id': o.id, 'order_no': o.order_no, 'address': o.address} for o in unrouted]
+    }
+
+
+def publish_route(delivery_id):
+    """重新规划并推送给配送员本人（随当前事务提交）"""
+    route = plan_route(delivery_id)
+    emit('courier.route_updated', route, delivery_id=delivery_id)
+    return route
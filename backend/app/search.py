@@ -0,0 +1,117 @@
+"""
+订单全文检索模块
+对订单的配送地址和备注做子串检索（中文地址没有空格分词，按 3 字滑动窗口的 trigram 索引匹配）:
+- SQLite: FTS5 虚拟表 orders_fts（tokenize='trigram'，外部内容表指向 orders），
+  由 orders 上的触发器在插入、更新、删除时同步
+- PostgreSQL: pg_trgm 扩展的 GIN 表达式索引，随 orders 行自动维护
+- 其他数据库或索引不可用时回退到 LIKE 扫描
+
+检索词按空白拆分，各词之间为 AND；不足 3 个字符的词无法使用 trigram 索引，对该词回退到 LIKE。
+ensure_search_index 在 create_app() 启动时于 upgrade_schema 之后调用
+"""
+from sqlalchemy import and_, literal_column, or_, text
+from sqlalchemy.exc import SQLAlchemyError
+from app.models import Order
+
+
+FTS_TABLE = 'orders_fts'
+MIN_TRIGRAM_LENGTH = 3
+PG_INDEX = 'ix_orders_search_trgm'
+# 与 PostgreSQL 表达式索引完全一致，查询才能命中索引
+PG_SEARCH_EXPRESSION = "(coalesce(orders.address, '') || ' ' || coalesce(orders.remark, ''))"
+
+SQLITE_TRIGGERS = {
+    'orders_fts_insert': f"""
+        CREATE TRIGGER orders_fts_insert AFTER INSERT ON orders BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, address, remark) VALUES (new.id, new.address, new.remark);
+        END""",
+    'orders_fts_delete': f"""
+        CREATE TRIGGER orders_fts_delete AFTER DELETE ON orders BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, address, remark)
+            VALUES ('delete', old.id, old.address, old.remark);
+        END""",
+    'orders_fts_update': f"""
+        CREATE TRIGGER orders_fts_update AFTER UPDATE OF address, remark ON orders BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, address, remark)
+            VALUES ('delete', old.id, old.address, old.remark);
+            INSERT INTO {FTS_TABLE}(rowid, address, remark) VALUES (new.id, new.address, new.remark);
+        END""",
+}
+
+
+def _ensure_sqlite(connection):
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"address, remark, content='orders', content_rowid='id', tokenize='trigram')"
+    ))
+    existing = set(connection.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'orders'"
+    )).scalars())
+    missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+    if not missing:
+        return False
+    for name in missing:
+        connection.execute(text(SQLITE_TRIGGERS[name]))
+    # 触发器随 orders 表一起删除；缺失说明索引可能与表内容不一致，整体重建
+    connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    return True
+
+
+def _ensure_postgresql(connection):
+    connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    connection.execute(text(
+        f'CREATE INDEX IF NOT EXISTS {PG_INDEX} ON orders USING gin ({PG_SEARCH_EXPRESSION} gin_trgm_ops)'
+    ))
+    return False
+
+
+def ensure_search_index(engine):
+    """
+    创建或修复全文索引，返回所用的检索方式 fts5 / trgm / like
+
+    数据库不支持（如 SQLite 未编译 FTS5、PostgreSQL 无权安装扩展）时返回 like
+    """
+    setup = {'sqlite': (_ensure_sqlite, 'fts5'), 'postgresql': (_ensure_postgresql, 'trgm')}.get(engine.dialect.name)
+    if setup is None:
+        return 'like'
+    ensure, mode = setup
+    try:
+        with engine.begin() as connection:
+            ensure(connection)
+    except SQLAlchemyError as e:
+        print(f"全文索引不可用，订单检索回退到 LIKE: {e}")
+        return 'like'
+    return mode
+
+
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _like(term):
+    pattern = _like_pattern(term)
+    return or_(Order.address.like(pattern, escape='\\'), Order.remark.like(pattern, escape='\\'))
+
+
+def search_filter(keywords, mode):
+    """返回匹配全部检索词的订单过滤条件；没有有效检索词时返回 None"""
+    terms = keywords.split()
+    if not terms:
+        return None
+    indexed = [t for t in terms if len(t) >= MIN_TRIGRAM_LENGTH]
+    clauses = [_like(t) for t in terms if len(t) < MIN_TRIGRAM_LENGTH]
+
+    if mode == 'fts5' and indexed:
+        # 每个词作为短语加引号，避免被解析为 FTS5 查询语法
+        match = ' AND '.join('"' + t.replace('"', '""') + '"' for t in indexed)
+        clauses.append(Order.id.in_(
+            text(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match').bindparams(match=match)
+            .columns(rowid=Order.id.type)
+        ))
+    elif mode == 'trgm':
+        expression = literal_column(PG_SEARCH_EXPRESSION)
+        clauses.extend(expression.ilike(_like_pattern(t), escape='\\') for t in indexed)
+    else:
+        clauses.extend(_like(t) for t in indexed)
+    return and_(*clauses)
@@ -0,0 +1,38 @@
+"""
+并发服务模式
+gunicorn.conf.py 按 WORKER_CLASS 选择 worker：
+- gevent（默认）: 协程 worker，每个 worker 同时处理最多 WORKER_CONNECTIONS 个请求，等待网络与数据库时让出；
+  调度大屏的事件推送长连接只占用一个协程
+- sync: 每个 worker 同一时刻只处理一个请求，慢上传、统计查询或事件推送长连接会占住整个 worker
+
+gevent 模式下的会话与共享状态：
+- Flask 的应用/请求上下文保存在 contextvars 中，每个协程各自独立；Flask-SQLAlchemy 按应用上下文
+  划分会话，因此每个请求仍使用自己的会话，请求结束时由 teardown 回收
+- 身份缓存、响应缓存、副本路由和事件推送使用的锁、条件变量，以及 SQLAlchemy 连接池，
+  在 monkey patch 之后都是协程级原语；应用必须在 patch 之后导入（gunicorn.conf.py 中 preload_app=False）
+- psycopg2 是 C 扩展，需注册 psycogreen 等待回调才会在等待数据库时让出；PyMySQL 为纯 Python，patch 后即可让出
+- sqlite3 调用不会让出：WAL 模式下读写互不阻塞，但等待写锁（busy_timeout）期间整个 worker 暂停
+"""
+
+
+def cooperative():
+    """当前进程是否已被 gevent monkey patch"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def patch_database_drivers():
+    """让 C 扩展数据库驱动在等待数据库时让出协程，返回已处理的驱动列表"""
+    try:
+        import psycopg2  # noqa: F401
+    except ImportError:
+        return []
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        raise RuntimeError('gevent 模式使用 PostgreSQL 需要先安装 psycogreen 包')
+    patch_psycopg()
+    return ['psycopg2']
@@ -0,0 +1,181 @@
+"""
+统计聚合模块
+仪表盘统计对每张表只做一次条件聚合；"今日"按半开区间 [当日00:00, 次日00:00) 过滤，
+不对列套用函数，可以命中 created_at/completed_at 上的索引。
+开启 STATS_ROLLUPS 后，订单统计改为读取 app.rollups 维护的汇总表，
+耗时只与天数、配送员数有关，与订单表规模无关
+"""
+from datetime import datetime, time, timedelta
+from flask import current_app
+from sqlalchemy import and_, case, func
+from app import db
+from app.database import day_of
+from app.models import User, Cylinder, Order, OrderDailyStat, CourierStat
+
+
+def use_rollups():
+    """统计接口是否读取汇总表"""
+    return current_app.config.get('STATS_ROLLUPS', False)
+
+
+def day_range(day):
+    """返回某一天的半开区间 [start, end)"""
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def count_if(condition):
+    """条件计数，空表时返回 NULL，由调用方转换为 0"""
+    return func.sum(case((condition, 1), else_=0))
+
+
+def sum_if(condition, column):
+    """条件求和"""
+    return func.sum(case((condition, column), else_=0))
+
+
+# ==================== 订单统计 ====================
+
+def order_summary(today):
+    """订单表单次条件聚合"""
+    start, end = day_range(today)
+    completed_today = and_(
+        Order.status == 'completed',
+        Order.completed_at >= start,
+        Order.completed_at < end
+    )
+    row = db.session.query(
+        func.count(Order.id),
+        count_if(Order.status == 'pending'),
+        count_if(Order.status == 'completed'),
+        count_if(and_(Order.created_at >= start, Order.created_at < end)),
+        sum_if(completed_today, Order.total_amount)
+    ).one()
+    return {
+        'total_orders': row[0] or 0,
+        'pending_orders': row[1] or 0,
+        'completed_orders': row[2] or 0,
+        'today_orders': row[3] or 0,
+        'today_revenue': float(row[4] or 0)
+    }
+
+
+def order_summary_from_rollup(today):
+    """从按日汇总表读取历史累计，仅待处理订单数实时查询（命中 status 索引）"""
+    totals = db.session.query(
+        func.sum(OrderDailyStat.order_count),
+        func.sum(OrderDailyStat.completed_count)
+    ).one()
+    today_row = db.session.get(OrderDailyStat, today)
+    pending_orders = Order.query.filter_by(status='pending').count()
+
+    return {
+        'total_orders': totals[0] or 0,
+        'pending_orders': pending_orders,
+        'completed_orders': totals[1] or 0,
+        'today_orders': today_row.order_count if today_row else 0,
+        'today_revenue': float(today_row.revenue) if today_row else 0.0
+    }
+
+
+def order_trend(days):
+    """最近 days 天每日下单数，缺失日期补 0"""
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=days-1)
+
+    if use_rollups():
+        rows = OrderDailyStat.query.filter(
+            OrderDailyStat.stat_date >= start_date,
+            OrderDailyStat.stat_date <= end_date
+        ).all()
+        date_counts = {str(r.stat_date): r.order_count for r in rows}
+    else:
+        created_day = day_of(Order.created_at)
+        rows = db.session.query(
+            created_day.label('date'),
+            func.count(Order.id).label('count')
+        ).filter(
+            Order.created_at >= day_range(start_date)[0],
+            Order.created_at < day_range(end_date)[1]
+        ).group_by(created_day).all()
+        date_counts = {str(r.date): r.count for r in rows}
+
+    trend = []
+    for i in range(days):
+        date = start_date + timedelta(days=i)
+        trend.append({
+            'date': str(date),
+            'count': date_counts.get(str(date), 0)
+        })
+    return trend
+
+
+def delivery_ranking(limit=10):
+    """按完成订单数排名的配送员"""
+    if use_rollups():
+        results = db.session.query(
+            User.id,
+            User.username,
+            User.real_name,
+            CourierStat.completed_count.label('order_count')
+        ).join(
+            CourierStat, CourierStat.delivery_id == User.id
+        ).filter(
+            CourierStat.completed_count > 0
+        ).order_by(CourierStat.completed_count.desc()).limit(limit).all()
+    else:
+        results = db.session.query(
+            User.id,
+            User.username,
+            User.real_name,
+            func.count(Order.id).label('order_count')
+        ).join(
+            Order, Order.delivery_id == User.id
+        ).filter(
+            Order.status == 'completed'
+        ).group_by(User.id).order_by(func.count(Order.id).desc()).limit(limit).all()
+
+    return [{
+        'id': r.id,
+        'username': r.username,
+        'real_name': r.real_name,
+        'order_count': r.order_count
+    } for r in results]
+
+
+# ==================== 仪表盘 ====================
+
+def cylinder_summary():
+    """钢瓶表单次条件聚合"""
+    row = db.session.query(
+        func.count(Cylinder.id),
+        count_if(Cylinder.status == 'in_stock')
+    ).one()
+    return {
+        'total_cylinders': row[0] or 0,
+        'in_stock': row[1] or 0
+    }
+
+
+def user_summary():
+    """用户表单次条件聚合"""
+    row = db.session.query(
+        count_if(User.role == 'user'),
+        count_if(User.role == 'delivery')
+    ).filter(User.role.in_(['user', 'delivery'])).one()
+    return {
+        'total_users': row[0] or 0,
+        'total_delivery': row[1] or 0
+    }
+
+
+def dashboard_stats():
+    """汇总仪表盘所需的全部指标"""
+    today = datetime.now().date()
+    if use_rollups():
+        result = order_summary_from_rollup(today)
+    else:
+        result = order_summary(today)
+    result.update(cylinder_summary())
+    result.update(user_summary())
+    return result
@@ -0,0 +1,60 @@
+"""
+流式响应工具模块
+列表接口携带 ?stream=1（JSON 数组）、?stream=ndjson 或 Accept: application/x-ndjson 时，
+按块从数据库读取（yield_per）并逐块编码输出，峰值内存与结果集大小无关
+"""
+from flask import Response, current_app, request, stream_with_context
+
+
+STREAM_CHUNK_SIZE = 500
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def stream_format():
+    """返回请求的流式格式 'ndjson' / 'json'，未请求流式输出时返回 None"""
+    stream = request.args.get('stream')
+    if stream == 'ndjson' or request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return 'ndjson'
+    if stream in ('1', 'true', 'json'):
+        return 'json'
+    return None
+
+
+def chunked(pieces, size=STREAM_CHUNK_SIZE):
+    """把逐行产生的字符串片段合并为每 size 行一块输出"""
+    batch = []
+    for piece in pieces:
+        batch.append(piece)
+        if len(batch) >= size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def iter_ndjson(rows, serialize):
+    dumps = current_app.json.dumps
+    for row in rows:
+        yield dumps(serialize(row)) + '\n'
+
+
+def iter_json_array(rows, serialize):
+    dumps = current_app.json.dumps
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + dumps(serialize(row))
+        separator = ','
+    yield ']\n'
+
+
+def stream_query(query, serialize, fmt):
+    """以流式响应输出查询结果"""
+    chunk_size = current_app.config.get('STREAM_CHUNK_SIZE', STREAM_CHUNK_SIZE)
+    rows = query.yield_per(chunk_size)
+    if fmt == 'ndjson':
+        body, mimetype = iter_ndjson(rows, serialize), NDJSON_MIMETYPE
+    else:
+        body, mimetype = iter_json_array(rows, serialize), 'application/json'
+    return Response(stream_with_context(chunked(body, chunk_size)), mimetype=mimetype)
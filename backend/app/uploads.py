@@ -0,0 +1,236 @@
+"""
+照片上传模块
+上传内容按块写入临时文件，同时计算 SHA-256 并检查大小上限（MAX_UPLOAD_SIZE），
+文件类型按内容头部识别，不使用客户端提供的扩展名。
+
+文件按内容寻址存放在 UPLOAD_FOLDER 下，相同内容只保存一份:
+    photos/<哈希前2位>/<sha256>.<ext>   原图
+    thumbs/<哈希前2位>/<sha256>.jpg     缩略图（长边不超过 THUMBNAIL_SIZE）
+缩略图由后台任务队列生成（见 app/jobs.py），尚未生成时 /uploads 返回原图（不缓存）。
+
+GET /uploads/<路径> 支持 Range 与条件请求；内容寻址的文件内容永不变化，使用 immutable 长期缓存。
+配置 UPLOADS_ACCEL_REDIRECT（如 /_uploads/）后只返回 X-Accel-Redirect 头，由 nginx 发送文件内容
+
+请求体上限 MAX_CONTENT_LENGTH 默认为 MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD，由 werkzeug 在读取请求体时检查，
+没有 Content-Length 的分块请求也会在超出时以 413 中止，不会先把整个请求体解析落盘；
+钢瓶批量导入等需要更大请求体的路由见 BODY_LIMIT_ENDPOINTS
+"""
+import glob
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from flask import Blueprint, Request, abort, current_app, send_file
+from werkzeug.security import safe_join
+from app.jobs import enqueue, job
+
+uploads_bp = Blueprint('uploads', __name__)
+
+
+class LimitedRequest(Request):
+    """按 BODY_LIMIT_ENDPOINTS 为个别路由放宽请求体上限，其余路由使用 MAX_CONTENT_LENGTH"""
+
+    @property
+    def max_content_length(self):
+        key = BODY_LIMIT_ENDPOINTS.get(self.endpoint)
+        if key and current_app:
+            return current_app.config.get(key)
+        return super().max_content_length
+
+
+DEFAULT_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+DEFAULT_THUMBNAIL_SIZE = 320
+CHUNK_SIZE = 64 * 1024
+# multipart 请求体中表单字段、分隔符等额外内容的余量
+MULTIPART_OVERHEAD = 64 * 1024
+
+# 请求体上限不同于 MAX_CONTENT_LENGTH 的路由 {端点: 配置项}
+BODY_LIMIT_ENDPOINTS = {
+    'api.bulk_import_cylinders': 'MAX_IMPORT_SIZE',
+}
+
+PHOTO_DIR = 'photos'
+THUMB_DIR = 'thumbs'
+URL_PREFIX = '/uploads/'
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# 旧格式文件名不含内容哈希，可能被同名覆盖，只短期缓存
+LEGACY_CACHE_CONTROL = 'public, max-age=3600'
+CONTENT_ADDRESSED = re.compile(r'^(photos|thumbs)/[0-9a-f]{2}/[0-9a-f]{64}\.(jpg|png|gif|webp)$')
+
+# 文件头 -> 扩展名
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+
+
+class UploadError(Exception):
+    """上传内容不符合要求，status 为应返回的 HTTP 状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def detect_extension(head):
+    """按文件头识别图片类型，无法识别时返回 None"""
+    for signature, ext in SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def photo_path(digest, ext):
+    return f'{PHOTO_DIR}/{digest[:2]}/{digest}.{ext}'
+
+
+def thumbnail_path(digest):
+    return f'{THUMB_DIR}/{digest[:2]}/{digest}.jpg'
+
+
+def thumbnail_url(url):
+    """原图地址对应的缩略图地址；非内容寻址的旧文件没有缩略图，返回原地址"""
+    prefix = f'{URL_PREFIX}{PHOTO_DIR}/'
+    if not url or not url.startswith(prefix):
+        return url
+    digest = url.rsplit('/', 1)[-1].split('.', 1)[0]
+    return URL_PREFIX + thumbnail_path(digest)
+
+
+def save_upload(stream, upload_folder, max_size):
+    """
+    把上传流按块写入内容寻址存储
+
+    返回 (相对路径, sha256, 字节数, 是否已存在)；超过大小上限或不是图片时抛出 UploadError
+    """
+    tmp_dir = os.path.join(upload_folder, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    sha256 = hashlib.sha256()
+    size = 0
+    ext = None
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if ext is None:
+                    ext = detect_extension(chunk)
+                    if ext is None:
+                        raise UploadError('只支持 JPEG、PNG、GIF、WebP 图片', 415)
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadError(f'文件大小超过上限 {max_size // (1024 * 1024)}MB', 413)
+                sha256.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UploadError('上传文件为空')
+
+        digest = sha256.hexdigest()
+        relative = photo_path(digest, ext)
+        target = os.path.join(upload_folder, relative)
+        if os.path.exists(target):
+            os.remove(tmp_path)
+            return relative, digest, size, True
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+        return relative, digest, size, False
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def make_thumbnail(source, target, size):
+    """生成长边不超过 size 的 JPEG 缩略图，先写临时文件再原子替换"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f'{target}.{os.getpid()}.tmp'
+        image.save(tmp, 'JPEG', quality=80, optimize=True)
+        os.replace(tmp, target)
+
+
+@job('uploads.thumbnail')
+def generate_thumbnail(photo, digest):
+    """后台任务：为 photos/ 下的原图生成缩略图，已存在时跳过"""
+    config = current_app.config
+    target = os.path.join(config['UPLOAD_FOLDER'], thumbnail_path(digest))
+    if not os.path.exists(target):
+        make_thumbnail(os.path.join(config['UPLOAD_FOLDER'], photo), target,
+                       config.get('THUMBNAIL_SIZE', DEFAULT_THUMBNAIL_SIZE))
+
+
+def store_photo(stream):
+    """保存上传的照片并在当前事务内加入缩略图任务，返回接口响应内容"""
+    config = current_app.config
+    upload_folder = config['UPLOAD_FOLDER']
+    relative, digest, size, duplicate = save_upload(
+        stream, upload_folder, config.get('MAX_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE)
+    )
+    thumb = thumbnail_path(digest)
+    if not os.path.exists(os.path.join(upload_folder, thumb)):
+        enqueue('uploads.thumbnail', photo=relative, digest=digest)
+    return {
+        'filename': relative.rsplit('/', 1)[-1],
+        'url': URL_PREFIX + relative,
+        'thumbnail_url': URL_PREFIX + thumb,
+        'sha256': digest,
+        'size': size,
+        'duplicate': duplicate
+    }
+
+
+def original_for_thumbnail(upload_folder, filename):
+    """缩略图尚未生成时对应的原图相对路径，没有时返回 None"""
+    if not filename.startswith(f'{THUMB_DIR}/') or not CONTENT_ADDRESSED.match(filename):
+        return None
+    digest = filename.rsplit('/', 1)[-1].split('.', 1)[0]
+    matches = glob.glob(os.path.join(upload_folder, PHOTO_DIR, digest[:2], f'{digest}.*'))
+    if not matches:
+        return None
+    return os.path.relpath(matches[0], upload_folder).replace(os.sep, '/')
+
+
+@uploads_bp.route('/uploads/<path:filename>', methods=['GET'])
+def serve_upload(filename):
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    if filename.startswith('tmp/'):
+        abort(404)
+    path = safe_join(upload_folder, filename)
+    if path is None:
+        abort(404)
+
+    cache_control = IMMUTABLE_CACHE_CONTROL if CONTENT_ADDRESSED.match(filename) else LEGACY_CACHE_CONTROL
+    if not os.path.isfile(path):
+        filename = original_for_thumbnail(upload_folder, filename)
+        if filename is None:
+            abort(404)
+        path = os.path.join(upload_folder, filename)
+        # 缩略图生成后同一地址会返回不同内容，不能长期缓存
+        cache_control = 'no-cache'
+
+    accel = current_app.config.get('UPLOADS_ACCEL_REDIRECT')
+    if accel:
+        # nginx 负责读取文件、Range 与条件请求，保留此处设置的 Content-Type 和 Cache-Control
+        response = current_app.response_class()
+        response.headers['X-Accel-Redirect'] = accel.rstrip('/') + '/' + filename
+        response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    else:
+        # conditional=True 处理 Range / If-None-Match；gunicorn 通过 wsgi.file_wrapper 用 sendfile 发送
+        response = send_file(path, conditional=True, etag=True)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+批量派单压测
+在临时 SQLite 库中生成一个站点的待处理订单和在岗配送员（坐标随机分布在城区范围内），
+分别测量求解耗时和完整的一次批量派单（读取 + 求解 + 单事务写入）耗时，
+并与"每单直接派给最近配送员"的做法对比总里程和最大负载
+
+用法: python benchmark_dispatch.py [--orders 1000] [--couriers 50] [--rounds 5]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+# 添加当前目录到 Python 路径
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+from app import create_app, db
+from app.models import User, Order, Cylinder, CourierLocation
+from app.geo import encode_geohash
+from app.inventory import reconcile_inventory
+from app.dispatch import (
+    DispatchOrder, DispatchCourier, SPECS_KG, plan_dispatch, distance_matrix, dispatch_orders
+)
+
+# 城区范围（北京四环附近）
+CENTER = (39.9042, 116.4074)
+SPREAD = 0.12
+STATION_ID = 1
+
+
+def random_point(rng):
+    return CENTER[0] + rng.uniform(-SPREAD, SPREAD), CENTER[1] + rng.uniform(-SPREAD, SPREAD)
+
+
+def synthetic(orders, couriers, seed):
+    rng = random.Random(seed)
+    order_rows = [DispatchOrder(i, *random_point(rng), rng.choice(list(SPECS_KG)), rng.choice((1, 1, 1, 2)))
+                  for i in range(orders)]
+    courier_rows = [DispatchCourier(i, *random_point(rng), 0, 0) for i in range(couriers)]
+    return order_rows, courier_rows
+
+
+def nearest_baseline(orders, couriers):
+    """对照组：每单派给最近的配送员，不考虑负载与载重"""
+    matrix = distance_matrix(orders, couriers)
+    picks = [min(range(len(row)), key=row.__getitem__) for row in matrix]
+    return sum(row[j] for row, j in zip(matrix, picks)), Counter(picks)
+
+
+def bench_solver(args):
+    orders, couriers = synthetic(args.orders, args.couriers, args.seed)
+    stock = {specs: args.orders * 2 for specs in SPECS_KG}
+    capacity = -(-args.orders // args.couriers) + 2
+    timings = []
+    for _ in range(args.rounds):
+        started = time.perf_counter()
+        assignments, unassigned = plan_dispatch(orders, couriers, stock, capacity=capacity, max_kg=capacity * 100)
+        timings.append(time.perf_counter() - started)
+
+    loads = Counter(delivery_id for _, delivery_id, _ in assignments)
+    baseline_distance, baseline_loads = nearest_baseline(orders, couriers)
+    print(f"求解: {args.orders} 单 × {args.couriers} 人，每人上限 {capacity} 单")
+    print(f"  耗时 最快 {min(timings) * 1000:.1f}ms / 平均 {sum(timings) / len(timings) * 1000:.1f}ms")
+    print(f"  批量派单: 分配 {len(assignments)}，未分配 {len(unassigned)}，"
+          f"总里程 {sum(d for _, _, d in assignments):.0f}km，负载 {min(loads.values())}~{max(loads.values())}")
+    print(f"  最近派单: 总里程 {baseline_distance:.0f}km，负载 {min(baseline_loads.values(), default=0)}"
+          f"~{max(baseline_loads.values())}")
+
+
+def bench_end_to_end(args):
+    directory = tempfile.mkdtemp()
+    uri = f"sqlite:///{os.path.join(directory, 'dispatch.db')}"
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'DISPATCH_COURIER_CAPACITY': -(-args.orders // args.couriers) + 2,
+                      'DISPATCH_COURIER_MAX_KG': 10000})
+    rng = random.Random(args.seed)
+    with app.app_context():
+        user = User(username='bench_user', role='user')
+        user.set_password('123456')
+        db.session.add(user)
+        couriers = []
+        for i in range(args.couriers):
+            courier = User(username=f'bench_courier_{i}', role='delivery', station_id=STATION_ID, password_hash='-')
+            db.session.add(courier)
+            couriers.append(courier)
+        db.session.flush()
+        now = datetime.utcnow()
+        for courier in couriers:
+            lat, lng = random_point(rng)
+            db.session.add(CourierLocation(delivery_id=courier.id, latitude=lat, longitude=lng,
+                                           geohash=encode_geohash(lat, lng), updated_at=now))
+        for specs in SPECS_KG:
+            db.session.bulk_insert_mappings(Cylinder, [
+                {'serial_code': f'BENCH-{specs}-{i}', 'specs': specs, 'status': 'in_stock', 'station_id': STATION_ID}
+                for i in range(args.orders * 2)
+            ])
+        db.session.bulk_insert_mappings(Order, [
+            {'order_no': f'BENCH{i:06d}', 'user_id': user.id, 'specs': rng.choice(list(SPECS_KG)), 'quantity': 1,
+             'address': '压测地址', 'latitude': lat, 'longitude': lng, 'status': 'pending'}
+            for i, (lat, lng) in enumerate(random_point(rng) for _ in range(args.orders))
+        ])
+        db.session.commit()
+        reconcile_inventory()
+
+        started = time.perf_counter()
+        result = dispatch_orders(STATION_ID)
+        elapsed = time.perf_counter() - started
+        assigned = Order.query.filter_by(status='assigned').count()
+        print(f"完整派单（读取 + 求解 + 单事务写入）: {elapsed * 1000:.0f}ms，"
+              f"分配 {len(result['assigned'])}（库中 assigned {assigned}），未分配 {len(result['unassigned'])}")
+        db.session.remove()
+        db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量派单压测')
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--couriers', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=5, help='求解重复次数')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    bench_solver(args)
+    bench_end_to_end(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+gunicorn worker 模式压测
+在同一台机器、同一份数据上依次以 sync 和 gevent worker 启动 gunicorn，
+先建立若干事件推送长连接（模拟调度大屏），再由多个客户端并发请求列表与统计接口，
+对比每秒请求数和延迟分位数（p50 / p99）
+
+用法: python benchmark_server.py [--seconds 10] [--clients 20] [--streams 2] [--workers 2]
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# 添加当前目录到 Python 路径
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+from app import create_app, db
+from app.models import User, Cylinder, Order
+
+# 压测请求轮流访问的接口
+ENDPOINTS = ['/api/orders?limit=20', '/api/stats/dashboard', '/api/cylinders/stats', '/api/cylinders?limit=20']
+
+
+def seed(uri, rows):
+    """写入压测数据：管理员、下单用户，以及 rows 个钢瓶和订单"""
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri})
+    with app.app_context():
+        admin = User(username='bench_admin', role='admin')
+        admin.set_password('123456')
+        user = User(username='bench_user', role='user')
+        user.set_password('123456')
+        db.session.add_all([admin, user])
+        db.session.flush()
+        db.session.add_all([Cylinder(serial_code=f'BENCH{i:06d}', specs='15kg') for i in range(rows)])
+        db.session.add_all([
+            Order(order_no=f'BENCH{i:06d}', user_id=user.id, specs='15kg', address='压测地址')
+            for i in range(rows)
+        ])
+        db.session.commit()
+        db.engine.dispose()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def login(base_url, timeout):
+    """登录并返回携带会话 Cookie 的 opener"""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    request = urllib.request.Request(
+        base_url + '/api/auth/login',
+        data=json.dumps({'username': 'bench_admin', 'password': '123456'}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}
+    )
+    opener.open(request, timeout=timeout).read()
+    return opener
+
+
+def start_server(mode, uri, args):
+    """启动 gunicorn 并等待健康检查通过，返回 (进程, 地址)"""
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=uri, WORKER_CLASS=mode, WEB_CONCURRENCY=str(args.workers),
+               BIND=f'127.0.0.1:{port}')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'],
+        cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/api/health', timeout=1).read()
+            return process, base_url
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} 模式的 gunicorn 启动超时')
+
+
+def hold_stream(base_url, stop, timeout):
+    """保持一个事件推送长连接，直到压测结束"""
+    try:
+        response = login(base_url, timeout).open(base_url + '/api/events/stream', timeout=timeout)
+        while not stop.is_set() and response.readline():
+            pass
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        pass
+
+
+def client(base_url, deadline, timeout, latencies, errors, index):
+    """循环请求 ENDPOINTS，记录每次请求的耗时"""
+    try:
+        opener = login(base_url, timeout)
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        errors.append(index)
+        return
+    i = index
+    while time.monotonic() < deadline:
+        began = time.monotonic()
+        try:
+            opener.open(base_url + ENDPOINTS[i % len(ENDPOINTS)], timeout=timeout).read()
+            latencies.append(time.monotonic() - began)
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            errors.append(i)
+        i += 1
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(mode, uri, args):
+    """以指定 worker 模式运行一轮压测，返回汇总结果"""
+    process, base_url = start_server(mode, uri, args)
+    stop = threading.Event()
+    try:
+        streams = [threading.Thread(target=hold_stream, args=(base_url, stop, args.seconds + args.timeout), daemon=True)
+                   for _ in range(args.streams)]
+        for t in streams:
+            t.start()
+        # 等待长连接建立
+        time.sleep(1)
+
+        latencies, errors = [], []
+        deadline = time.monotonic() + args.seconds
+        clients = [threading.Thread(target=client, args=(base_url, deadline, args.timeout, latencies, errors, i))
+                   for i in range(args.clients)]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+    finally:
+        stop.set()
+        process.terminate()
+        process.wait()
+
+    return {
+        'rps': len(latencies) / args.seconds,
+        'p50': percentile(latencies, 0.50),
+        'p99': percentile(latencies, 0.99),
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gunicorn sync / gevent worker 压测')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=20, help='并发请求的客户端数')
+    parser.add_argument('--streams', type=int, default=2, help='压测期间保持的事件推送长连接数')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--timeout', type=float, default=5, help='单个请求的超时秒数，超时计为失败')
+    parser.add_argument('--modes', default='sync,gevent')
+    args = parser.parse_args()
+
+    print(f"worker {args.workers}，客户端 {args.clients}，长连接 {args.streams}，每轮 {args.seconds}s")
+    print(f"{'模式':<10}{'请求/秒':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'失败':>8}")
+    for mode in args.modes.split(','):
+        with tempfile.TemporaryDirectory() as tmp:
+            uri = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+            seed(uri, args.rows)
+            result = run(mode, uri, args)
+        print(f"{mode:<10}{result['rps']:>10.0f}{result['p50'] * 1000:>10.1f}"
+              f"{result['p99'] * 1000:>10.1f}{result['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
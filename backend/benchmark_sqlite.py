@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+SQLite 并发基准测试
+在写入持续进行时测量读吞吐，对比 SQLite 参数组（default: 回滚日志模式，production: WAL 等）。
+读写各自运行在独立进程中，与 gunicorn 多 worker 部署一致
+
+用法: python benchmark_sqlite.py [--seconds 5] [--readers 4] [--writers 1] [--rows 2000]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from app.models import User, Order
+
+
+def make_app(path, profile):
+    return create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'SQLITE_PROFILE': profile})
+
+
+def seed(app, rows):
+    """写入基准数据：一个下单用户和 rows 个订单"""
+    with app.app_context():
+        user = User(username='bench', role='user')
+        user.set_password('123456')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all([
+            Order(order_no=f'BENCH{i:06d}', user_id=user.id, specs='15kg', address='基准地址')
+            for i in range(rows)
+        ])
+        db.session.commit()
+        return user.id
+
+
+def reader(path, profile, start, seconds):
+    """循环执行订单列表查询（与 /orders 接口相同的排序与分页），返回 (次数, 失败数, 最大耗时)"""
+    app = make_app(path, profile)
+    reads, errors, slowest = 0, 0, 0.0
+    with app.app_context():
+        start.wait()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            began = time.perf_counter()
+            try:
+                Order.query.filter_by(status='pending').order_by(
+                    Order.created_at.desc(), Order.id.desc()
+                ).limit(20).all()
+                reads += 1
+            except OperationalError:
+                errors += 1
+            finally:
+                db.session.remove()
+            slowest = max(slowest, time.perf_counter() - began)
+    return 'read', reads, errors, slowest
+
+
+def writer(path, profile, start, seconds, user_id, worker):
+    """循环下单并提交，每次提交都会获取写锁，返回 (次数, 失败数, 最大耗时)"""
+    app = make_app(path, profile)
+    writes, errors, slowest = 0, 0, 0.0
+    with app.app_context():
+        start.wait()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            began = time.perf_counter()
+            try:
+                db.session.add(Order(
+                    order_no=f'W{worker}-{writes + errors}', user_id=user_id,
+                    specs='15kg', address='基准地址'
+                ))
+                db.session.commit()
+                writes += 1
+            except OperationalError:
+                db.session.rollback()
+                errors += 1
+            finally:
+                db.session.remove()
+            slowest = max(slowest, time.perf_counter() - began)
+    return 'write', writes, errors, slowest
+
+
+def run(profile, args):
+    """在独立的临时数据库上运行一轮基准，返回汇总结果"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        app = make_app(path, profile)
+        user_id = seed(app, args.rows)
+        with app.app_context():
+            db.engine.dispose()
+
+        context = multiprocessing.get_context('spawn')
+        with context.Manager() as manager:
+            start = manager.Event()
+            with context.Pool(args.readers + args.writers) as pool:
+                jobs = [pool.apply_async(reader, (path, profile, start, args.seconds)) for _ in range(args.readers)]
+                jobs += [
+                    pool.apply_async(writer, (path, profile, start, args.seconds, user_id, w))
+                    for w in range(args.writers)
+                ]
+                # 等待各进程完成应用初始化后同时开始
+                time.sleep(args.warmup)
+                start.set()
+                results = [job.get() for job in jobs]
+
+    summary = {kind: {'count': 0, 'errors': 0, 'slowest': 0.0} for kind in ('read', 'write')}
+    for kind, count, errors, slowest in results:
+        summary[kind]['count'] += count
+        summary[kind]['errors'] += errors
+        summary[kind]['slowest'] = max(summary[kind]['slowest'], slowest)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite 参数组并发读写基准')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=1)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--warmup', type=float, default=3, help='等待工作进程初始化的秒数')
+    args = parser.parse_args()
+
+    print(f"读进程 {args.readers}，写进程 {args.writers}，每轮 {args.seconds}s，预置订单 {args.rows}")
+    print(f"{'参数组':<12}{'读/秒':>10}{'写/秒':>10}{'读失败':>8}{'写失败':>8}{'最慢读(ms)':>12}")
+    for profile in ('default', 'production'):
+        result = run(profile, args)
+        reads, writes = result['read'], result['write']
+        print(f"{profile:<12}{reads['count'] / args.seconds:>10.0f}{writes['count'] / args.seconds:>10.0f}"
+              f"{reads['errors']:>8}{writes['errors']:>8}{reads['slowest'] * 1000:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
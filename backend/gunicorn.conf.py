@@ -0,0 +1,18 @@
+"""
+gunicorn 配置，参数来自环境变量（括号内为默认值）
+WORKER_CLASS (gevent): gevent 或 sync，见 app/serving.py
+WEB_CONCURRENCY (2): worker 进程数
+WORKER_CONNECTIONS (100): gevent 模式下每个 worker 同时处理的最大请求数
+WORKER_TIMEOUT (30): worker 无响应多少秒后被重启；sync 模式下事件推送连接的时长按此值缩短（见 app/events.py）
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5010')
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = os.environ.get('WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', '100'))
+timeout = int(os.environ.get('WORKER_TIMEOUT', '30'))
+
+# 应用在 worker 完成 monkey patch 之后导入，模块中的锁、条件变量和数据库驱动才是协程友好的（见 app/serving.py）
+preload_app = False
+
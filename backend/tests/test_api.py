@@ -6,22 +6,76 @@ import unittest
 import json
 import sys
 import os
+import io
+import csv
+import hashlib
+import importlib.util
+import multiprocessing
+import random
+import re
+import shutil
+import tempfile
+from sqlalchemy import create_engine, event, func, inspect, select, text
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from datetime import datetime, timedelta
 
 # 添加父目录到路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app import create_app, db
-from app.models import User, Cylinder, Order, SafetyRecord, Announcement, Rating
+from app.models import User, Cylinder, Order, SafetyRecord, Announcement, Rating, OrderDailyStat, CourierStat, OrderCylinder, InventoryCounter, ReplicaHeartbeat, Job, CourierLocation, Event, DemandDailyStat, DemandForecast
+from app.database import database_uri, engine_options, day_of, sqlite_pragmas, apply_sqlite_pragmas
+from app.migrations import create_missing_indexes, add_missing_columns, upgrade_schema, index_names
+from app.rollups import rebuild_rollups
+from app.response_cache import LocalCache, RedisCache, ResponseCache
+from app.serving import cooperative
+from app.uploads import MULTIPART_OVERHEAD
+from app.events import default_stream_timeout, prune_events
+from app.search import search_filter, ensure_search_index
+from app.pagination import nullable_key
+from app import geo
+from app.geo import encode_geohash, neighbor_cells, haversine_km
+from app.dispatch import DispatchOrder, DispatchCourier, plan_dispatch, apply_assignments
+from app.forecast import seasonal_naive, fit_series, refresh_forecasts, schedule_next_refresh
+from app.routing import sequence_stops, nearest_neighbor, two_opt, distance_matrix, path_length, distance_cache_info
+from app.jobs import job, enqueue, run_pending, requeue_stale, queue_stats
+from app.inventory import reserve_cylinders, available_stock, reconcile_inventory, InsufficientStockError
+
+# 默认使用系统临时目录下独立的 SQLite 测试库（不写入源码目录）；设置 TEST_DATABASE_URL 可改为在 PostgreSQL/MySQL 上运行
+# 路径固定而非随机，并发出库测试以 spawn 方式启动的子进程重新导入本模块后仍指向同一个库
+TEST_SQLITE_PATH = os.path.join(tempfile.gettempdir(), 'gas_system_test.db')
+TEST_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', f'sqlite:///{TEST_SQLITE_PATH}')
+TEST_CONFIG = {'TESTING': True, 'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URI}
+
+
+def reserve_worker(args):
+    """并发出库测试的子进程：循环创建订单并认领钢瓶"""
+    worker, user_id, count = args
+    app = create_app(TEST_CONFIG)
+    reserved = []
+    with app.app_context():
+        for i in range(count):
+            order = Order(order_no=f'RACE{worker}-{i}', user_id=user_id, specs='15kg', quantity=2)
+            db.session.add(order)
+            db.session.flush()
+            try:
+                reserve_cylinders(order)
+                db.session.commit()
+                reserved.append(order.id)
+            except InsufficientStockError:
+                db.session.rollback()
+        db.session.remove()
+    return reserved
 
 
 class APITestCase(unittest.TestCase):
     """API测试基类"""
     
+    config = TEST_CONFIG
+    
     def setUp(self):
         """测试前准备"""
-        self.app = create_app()
-        self.app.config['TESTING'] = True
-        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+        self.app = create_app(self.config)
         self.client = self.app.test_client()
         self.app_context = self.app.app_context()
         self.app_context.push()
@@ -314,5 +368,1891 @@ class UserAPITest(APITestCase):
         self.assertIn('手机号', json_data['error'])
 
 
+class PaginationAPITest(APITestCase):
+    """游标分页测试"""
+    
+    def setUp(self):
+        super().setUp()
+        base = datetime(2024, 1, 1, 8, 0, 0)
+        for i in range(5):
+            db.session.add(Cylinder(
+                serial_code=f'PAGE{i}',
+                specs='15kg',
+                status='in_stock',
+                created_at=base + timedelta(minutes=i)
+            ))
+        db.session.commit()
+    
+    def test_without_limit_returns_full_list(self):
+        """测试未携带分页参数时返回完整数组"""
+        response = self.client.get('/api/cylinders')
+        json_data = json.loads(response.data)
+        self.assertIsInstance(json_data, list)
+        self.assertEqual(len(json_data), 5)
+    
+    def test_walk_forward_and_back(self):
+        """测试按游标前后翻页"""
+        response = self.client.get('/api/cylinders?limit=2')
+        page1 = json.loads(response.data)
+        self.assertEqual([c['serial_code'] for c in page1['items']], ['PAGE4', 'PAGE3'])
+        self.assertTrue(page1['has_more'])
+        self.assertIsNone(page1['prev_cursor'])
+        
+        response = self.client.get(f'/api/cylinders?limit=2&cursor={page1["next_cursor"]}')
+        page2 = json.loads(response.data)
+        self.assertEqual([c['serial_code'] for c in page2['items']], ['PAGE2', 'PAGE1'])
+        
+        response = self.client.get(f'/api/cylinders?limit=2&cursor={page2["next_cursor"]}')
+        page3 = json.loads(response.data)
+        self.assertEqual([c['serial_code'] for c in page3['items']], ['PAGE0'])
+        self.assertFalse(page3['has_more'])
+        self.assertIsNone(page3['next_cursor'])
+        
+        response = self.client.get(f'/api/cylinders?limit=2&cursor={page2["prev_cursor"]}')
+        back = json.loads(response.data)
+        self.assertEqual([c['serial_code'] for c in back['items']], ['PAGE4', 'PAGE3'])
+        self.assertIsNone(back['prev_cursor'])
+    
+    def test_limit_is_capped(self):
+        """测试 limit 超出上限时被截断"""
+        self.app.config['PAGE_SIZE_MAX'] = 3
+        response = self.client.get('/api/cylinders?limit=1000')
+        json_data = json.loads(response.data)
+        self.assertEqual(json_data['limit'], 3)
+        self.assertEqual(len(json_data['items']), 3)
+    
+    def test_invalid_cursor(self):
+        """测试无效游标返回400"""
+        response = self.client.get('/api/cylinders?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+        json_data = json.loads(response.data)
+        self.assertIn('游标', json_data['error'])
+    
+    def test_announcements_with_null_top_flag(self):
+        """测试置顶标记为空的公告按非置顶排序，逐页翻完不漏行"""
+        base = datetime(2024, 1, 1, 8, 0, 0)
+        for i in range(5):
+            db.session.add(Announcement(title=f'公告{i}', content='内容', author_id=self.admin.id,
+                                        created_at=base + timedelta(minutes=i)))
+        db.session.flush()
+        for i in (1, 3):
+            Announcement.query.filter_by(title=f'公告{i}').update({'is_top': None}, synchronize_session=False)
+        for i in (0, 4):
+            Announcement.query.filter_by(title=f'公告{i}').update({'is_top': True}, synchronize_session=False)
+        db.session.commit()
+        
+        titles, cursor = [], ''
+        while True:
+            page = json.loads(self.client.get(f'/api/announcements?limit=2{cursor}').data)
+            titles += [a['title'] for a in page['items']]
+            if not page['next_cursor']:
+                break
+            cursor = f'&cursor={page["next_cursor"]}'
+        self.assertEqual(titles, ['公告4', '公告0', '公告3', '公告2', '公告1'])
+
+
+class QueryCountTest(APITestCase):
+    """列表接口查询次数测试（防止 N+1）"""
+    
+    def count_queries(self, url):
+        """统计一次请求执行的SQL语句数"""
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        db.session.expunge_all()
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(response.status_code, 200)
+        return len(statements)
+    
+    def add_orders(self, count, offset=0):
+        delivery_id = db.session.merge(self.delivery).id
+        for i in range(count):
+            customer = User(username=f'customer{offset + i}', role='user')
+            customer.set_password('123456')
+            db.session.add(customer)
+            db.session.flush()
+            order = Order(
+                order_no=f'NPLUS{offset + i}',
+                user_id=customer.id,
+                delivery_id=delivery_id,
+                specs='15kg',
+                address='测试地址'
+            )
+            db.session.add(order)
+            db.session.flush()
+            db.session.add(SafetyRecord(order_id=order.id, inspector_id=delivery_id))
+            db.session.add(Announcement(title=f'公告{offset + i}', content='内容', author_id=customer.id))
+        db.session.commit()
+    
+    def test_list_queries_do_not_grow_with_rows(self):
+        """测试列表查询次数不随行数增长"""
+        urls = ['/api/orders', '/api/safety/records', '/api/announcements']
+        self.add_orders(3)
+        small = {url: self.count_queries(url) for url in urls}
+        self.add_orders(12, offset=3)
+        large = {url: self.count_queries(url) for url in urls}
+        
+        for url in urls:
+            self.assertEqual(small[url], large[url], url)
+            self.assertLessEqual(large[url], 5, url)
+
+
+@unittest.skipUnless(TEST_DATABASE_URI.startswith('sqlite'), '执行计划断言基于 SQLite 的 EXPLAIN QUERY PLAN')
+class IndexUsageTest(APITestCase):
+    """索引使用测试：热点查询的执行计划不应出现全表扫描"""
+    
+    FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$')
+    
+    def query_plan(self, query):
+        statement = query.statement if hasattr(query, 'statement') else query
+        sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        rows = db.session.execute(text('EXPLAIN QUERY PLAN ' + sql)).fetchall()
+        return [row[-1] for row in rows]
+    
+    def assert_uses_index(self, query):
+        plan = self.query_plan(query)
+        full_scans = [detail for detail in plan if self.FULL_SCAN.match(detail)]
+        self.assertEqual(full_scans, [], plan)
+        self.assertTrue(any('INDEX' in d or 'PRIMARY KEY' in d for d in plan), plan)
+    
+    def test_hot_queries_use_indexes(self):
+        """测试 api.py 中的热点查询均命中索引"""
+        now = datetime(2024, 1, 1)
+        recent = [Order.created_at.desc(), Order.id.desc()]
+        queries = [
+            Order.query.order_by(*recent).limit(21),
+            Order.query.filter_by(user_id=1).order_by(*recent).limit(21),
+            Order.query.filter_by(delivery_id=1).order_by(*recent).limit(21),
+            Order.query.filter_by(status='pending').order_by(*recent).limit(21),
+            Order.query.filter(Order.created_at >= now, Order.created_at < now + timedelta(days=1)),
+            Order.query.filter_by(contact_phone='13900139000').order_by(*recent).limit(21),
+            Order.query.filter(Order.order_no >= 'ORD2024', Order.order_no < 'ORD2024\uffff'),
+            Order.query.order_by(nullable_key(Order.total_amount, 0).desc(), Order.id.desc()).limit(21),
+            Order.query.filter(nullable_key(Order.total_amount, 0) < 100).order_by(
+                nullable_key(Order.total_amount, 0).desc(), Order.id.desc()).limit(21),
+            db.session.query(func.sum(Order.total_amount)).filter(
+                Order.status == 'completed',
+                Order.completed_at >= now,
+                Order.completed_at < now + timedelta(days=1)
+            ),
+            db.session.query(User.id, func.count(Order.id)).join(
+                Order, Order.delivery_id == User.id
+            ).filter(Order.status == 'completed').group_by(User.id),
+            Cylinder.query.filter_by(specs='15kg', status='in_stock'),
+            Cylinder.query.filter_by(status='in_stock').order_by(Cylinder.created_at.desc()),
+            db.session.query(Cylinder.status, func.count(Cylinder.id)).group_by(Cylinder.status),
+            Cylinder.query.filter(Cylinder.expiry_date <= now.date(), Cylinder.expiry_date >= now.date()),
+            SafetyRecord.query.filter_by(inspector_id=1).order_by(SafetyRecord.created_at.desc()),
+            SafetyRecord.query.filter_by(hazard_level='high').order_by(SafetyRecord.created_at.desc()),
+            Rating.query.filter_by(order_id=1),
+            Announcement.query.order_by(
+                nullable_key(Announcement.is_top, False).desc(), Announcement.created_at.desc(), Announcement.id.desc()
+            ).limit(21),
+            User.query.filter_by(role='delivery'),
+        ]
+        for query in queries:
+            self.assert_uses_index(query)
+    
+    def test_upgrade_creates_missing_indexes(self):
+        """测试旧数据库升级时补建缺失索引"""
+        db.session.execute(text('DROP INDEX ix_orders_status_created_at'))
+        db.session.commit()
+        
+        created = create_missing_indexes(db.engine)
+        self.assertEqual(created, ['ix_orders_status_created_at'])
+        self.assertEqual(create_missing_indexes(db.engine), [])
+    
+    def test_manual_upgrade_reports_changes(self):
+        """测试关闭自动升级后手动执行升级，返回实际补建的索引（python -m app.migrations 的做法）"""
+        db.session.execute(text('DROP INDEX ix_orders_status_created_at'))
+        db.session.commit()
+        
+        app = create_app(dict(self.config, SCHEMA_AUTO_UPGRADE=False))
+        with app.app_context():
+            self.assertNotIn('ix_orders_status_created_at', index_names(db.engine, inspect(db.engine), 'orders'))
+            self.assertEqual(upgrade_schema(), ['创建索引 ix_orders_status_created_at'])
+            self.assertEqual(upgrade_schema(), [])
+            db.session.remove()
+
+
+class DashboardStatsTest(APITestCase):
+    """仪表盘统计测试"""
+    
+    def setUp(self):
+        super().setUp()
+        now = datetime.now()
+        yesterday = now - timedelta(days=1)
+        rows = [
+            ('DASH1', 'pending', now, None, 120),
+            ('DASH2', 'completed', now, now, 120),
+            ('DASH3', 'completed', yesterday, yesterday, 350),
+            ('DASH4', 'completed', yesterday, now, 50),
+            ('DASH5', 'cancelled', now - timedelta(days=3), None, 50),
+        ]
+        for order_no, status, created_at, completed_at, amount in rows:
+            db.session.add(Order(
+                order_no=order_no, user_id=self.user.id, status=status, specs='15kg',
+                total_amount=amount, created_at=created_at, completed_at=completed_at
+            ))
+        db.session.add(Cylinder(serial_code='DASHC1', specs='15kg', status='in_stock'))
+        db.session.add(Cylinder(serial_code='DASHC2', specs='15kg', status='in_use'))
+        db.session.commit()
+        self.expected = {
+            'total_orders': 5,
+            'pending_orders': 1,
+            'completed_orders': 3,
+            'total_cylinders': 2,
+            'in_stock': 1,
+            'total_users': 1,
+            'total_delivery': 1,
+            'today_orders': 2,
+            'today_revenue': 170.0
+        }
+    
+    def test_dashboard_stats(self):
+        """测试仪表盘统计结果"""
+        response = self.client.get('/api/stats/dashboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), self.expected)
+    
+    def test_dashboard_stats_from_rollups(self):
+        """测试读取汇总表时结果一致"""
+        rebuild_rollups()
+        self.assertEqual(OrderDailyStat.query.count(), 3)
+        self.app.config['STATS_ROLLUPS'] = True
+        response = self.client.get('/api/stats/dashboard')
+        self.assertEqual(json.loads(response.data), self.expected)
+
+
+class RollupTest(APITestCase):
+    """统计汇总表测试"""
+    
+    def put(self, url, data):
+        return self.client.put(url, data=json.dumps(data), content_type='application/json')
+    
+    def stats_snapshot(self):
+        return {
+            url: json.loads(self.client.get(url).data)
+            for url in ['/api/stats/dashboard', '/api/stats/orders/trend', '/api/stats/delivery/ranking']
+        }
+    
+    def assert_rollups_match_raw(self):
+        self.app.config['STATS_ROLLUPS'] = False
+        raw = self.stats_snapshot()
+        self.app.config['STATS_ROLLUPS'] = True
+        self.assertEqual(self.stats_snapshot(), raw)
+        return raw
+    
+    def test_write_routes_maintain_rollups(self):
+        """测试下单、分配、完成、取消时同步更新汇总表"""
+        for i in range(3):
+            db.session.add(Cylinder(serial_code=f'ROLL{i}', specs='15kg', status='in_stock'))
+        db.session.commit()
+        delivery_id = self.delivery.id
+        
+        self.logout()
+        self.login('testuser', '123456')
+        order_ids = []
+        for _ in range(2):
+            response = self.client.post('/api/orders',
+                data=json.dumps({'specs': '15kg', 'quantity': 1, 'address': '测试地址'}),
+                content_type='application/json')
+            order_ids.append(json.loads(response.data)['id'])
+        
+        self.logout()
+        self.login('admin', '123456')
+        for order_id in order_ids:
+            self.put(f'/api/orders/{order_id}/assign', {'delivery_id': delivery_id})
+        self.put(f'/api/orders/{order_ids[0]}/status', {'status': 'delivering'})
+        self.put(f'/api/orders/{order_ids[0]}/status', {'status': 'completed'})
+        self.put(f'/api/orders/{order_ids[1]}/status', {'status': 'cancelled'})
+        
+        stats = db.session.get(CourierStat, delivery_id)
+        self.assertEqual((stats.assigned_count, stats.completed_count, stats.open_count), (2, 1, 0))
+        raw = self.assert_rollups_match_raw()
+        self.assertEqual(raw['/api/stats/dashboard']['today_revenue'], 120.0)
+        self.assertEqual(raw['/api/stats/delivery/ranking'][0]['order_count'], 1)
+    
+    def test_rebuild_rollups_from_existing_orders(self):
+        """测试从已有订单回填汇总表"""
+        now = datetime.now()
+        for i in range(4):
+            created_at = now - timedelta(days=i)
+            db.session.add(Order(
+                order_no=f'BACK{i}', user_id=self.user.id, delivery_id=self.delivery.id,
+                status='completed' if i % 2 else 'assigned', specs='15kg', total_amount=120,
+                created_at=created_at, completed_at=created_at if i % 2 else None
+            ))
+        db.session.commit()
+        
+        self.assertEqual(rebuild_rollups(), (4, 1))
+        self.assert_rollups_match_raw()
+
+
+class ReservationTest(APITestCase):
+    """钢瓶出库测试"""
+    
+    def setUp(self):
+        super().setUp()
+        for i in range(20):
+            db.session.add(Cylinder(serial_code=f'RES{i:02d}', specs='15kg', status='in_stock'))
+        db.session.commit()
+    
+    def test_complete_order_records_cylinders(self):
+        """测试完成订单时记录出库钢瓶"""
+        order = Order(order_no='RESORDER', user_id=self.user.id, specs='15kg', quantity=3, status='delivering')
+        db.session.add(order)
+        db.session.commit()
+        
+        response = self.client.put(f'/api/orders/{order.id}/status',
+            data=json.dumps({'status': 'completed'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        
+        response = self.client.get(f'/api/orders/{order.id}/cylinders')
+        serials = [c['serial_code'] for c in json.loads(response.data)]
+        self.assertEqual(len(serials), 3)
+        self.assertEqual(Cylinder.query.filter(Cylinder.serial_code.in_(serials), Cylinder.status == 'in_use').count(), 3)
+    
+    def test_complete_order_insufficient_stock(self):
+        """测试库存不足时不能完成订单"""
+        order = Order(order_no='RESBIG', user_id=self.user.id, specs='15kg', quantity=21, status='delivering')
+        db.session.add(order)
+        db.session.commit()
+        order_id = order.id
+        
+        response = self.client.put(f'/api/orders/{order_id}/status',
+            data=json.dumps({'status': 'completed'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('库存不足', json.loads(response.data)['error'])
+        self.assertEqual(db.session.get(Order, order_id).status, 'delivering')
+        self.assertEqual(Cylinder.query.filter_by(status='in_stock').count(), 20)
+    
+    def test_concurrent_reservations_never_share_cylinders(self):
+        """测试多进程并发出库时钢瓶不会被重复认领"""
+        user_id = self.user.id
+        db.session.remove()
+        
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(4) as pool:
+            results = pool.map(reserve_worker, [(w, user_id, 8) for w in range(4)])
+        
+        reserved = [order_id for ids in results for order_id in ids]
+        allocations = OrderCylinder.query.all()
+        self.assertEqual(len(reserved), 10)
+        self.assertEqual(len(allocations), 20)
+        self.assertEqual(len({a.cylinder_id for a in allocations}), 20)
+        self.assertEqual({a.order_id for a in allocations}, set(reserved))
+        self.assertEqual(Cylinder.query.filter_by(status='in_use').count(), 20)
+        self.assertEqual(reconcile_inventory(), [])
+
+
+class InventoryCounterTest(APITestCase):
+    """库存计数表测试"""
+    
+    def put(self, url, data):
+        return self.client.put(url, data=json.dumps(data), content_type='application/json')
+    
+    def test_transitions_keep_counters_in_sync(self):
+        """测试钢瓶增删改与出库均同步更新计数"""
+        response = self.client.post('/api/cylinders',
+            data=json.dumps({'specs': '15kg', 'station_id': 1}),
+            content_type='application/json')
+        created_id = json.loads(response.data)['id']
+        for i in range(3):
+            db.session.add(Cylinder(serial_code=f'INV{i}', specs='5kg', status='in_stock'))
+        db.session.commit()
+        
+        self.put(f'/api/cylinders/{created_id}/status', {'status': 'delivering'})
+        self.put(f'/api/cylinders/{created_id}', {'specs': '50kg'})
+        empty = Cylinder.query.filter_by(serial_code='INV0').first()
+        self.client.delete(f'/api/cylinders/{empty.id}')
+        order = Order(order_no='INVORDER', user_id=self.user.id, specs='5kg', quantity=1, status='delivering')
+        db.session.add(order)
+        db.session.commit()
+        self.put(f'/api/orders/{order.id}/status', {'status': 'completed'})
+        
+        self.assertEqual(available_stock('5kg'), 1)
+        self.assertEqual(available_stock('50kg'), 0)
+        self.assertEqual(reconcile_inventory(), [])
+        
+        response = self.client.get('/api/cylinders/stats')
+        json_data = json.loads(response.data)
+        self.assertEqual(json_data['in_stock'], 1)
+        self.assertEqual(json_data['delivering'], 1)
+        self.assertEqual(json_data['in_use'], 1)
+        self.assertEqual(json_data['total'], 3)
+        
+        response = self.client.get('/api/cylinders/stats?station_id=1')
+        self.assertEqual(json.loads(response.data)['total'], 1)
+    
+    def test_reconcile_fixes_drift(self):
+        """测试对账修正计数漂移"""
+        for i in range(2):
+            db.session.add(Cylinder(serial_code=f'DRIFT{i}', specs='15kg', status='in_stock'))
+        db.session.commit()
+        counter = db.session.get(InventoryCounter, (0, '15kg', 'in_stock'))
+        counter.count = 7
+        db.session.add(InventoryCounter(station_id=0, specs='5kg', status='empty', count=3))
+        db.session.commit()
+        
+        response = self.client.post('/api/cylinders/stats/reconcile')
+        drifts = json.loads(response.data)['drifts']
+        self.assertEqual(len(drifts), 2)
+        self.assertEqual(available_stock('15kg'), 2)
+        self.assertIsNone(db.session.get(InventoryCounter, (0, '5kg', 'empty')))
+        self.assertEqual(reconcile_inventory(), [])
+
+
+class BulkCylinderTest(APITestCase):
+    """钢瓶批量导入导出测试"""
+    
+    def test_import_csv_with_error_report(self):
+        """测试CSV导入：有效行批量插入，无效行逐行报告"""
+        db.session.add(Cylinder(serial_code='BULK-EXIST', specs='15kg'))
+        db.session.commit()
+        content = (
+            'serial_code,specs,status,manufacturer,manufacture_date,expiry_date,station_id\n'
+            'BULK-1,15kg,,厂家A,2024-01-01,2030-01-01,1\n'
+            'BULK-2,20kg,,厂家A,,,1\n'
+            'BULK-3,5kg,in_stock,厂家B,2024-01-01,2023-01-01,\n'
+            'BULK-1,15kg,,,,,\n'
+            'BULK-EXIST,15kg,,,,,\n'
+            'BULK-4,50kg,empty,,,,2\n'
+        )
+        response = self.client.post('/api/cylinders/bulk',
+            data={'file': (io.BytesIO(content.encode('utf-8')), 'cylinders.csv')},
+            content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        report = json.loads(response.data)
+        self.assertEqual(report['inserted'], 2)
+        self.assertEqual([e['line'] for e in report['errors']], [3, 4, 5, 6])
+        self.assertIn('规格', report['errors'][0]['error'])
+        self.assertIn('重复', report['errors'][2]['error'])
+        self.assertIn('已存在', report['errors'][3]['error'])
+        self.assertEqual(Cylinder.query.filter_by(serial_code='BULK-1').first().station_id, 1)
+        self.assertEqual(reconcile_inventory(), [])
+    
+    def test_import_ndjson_in_chunks(self):
+        """测试NDJSON请求体导入，跨多个块插入"""
+        lines = [json.dumps({'serial_code': f'ND{i:04d}', 'specs': '5kg'}) for i in range(1200)]
+        lines.insert(10, 'not json')
+        response = self.client.post('/api/cylinders/bulk',
+            data='\n'.join(lines),
+            content_type='application/x-ndjson')
+        report = json.loads(response.data)
+        self.assertEqual(report['inserted'], 1200)
+        self.assertEqual(report['errors'], [{'line': 11, 'serial_code': None, 'error': '无法解析的行'}])
+        self.assertEqual(available_stock('5kg'), 1200)
+    
+    def test_import_unsupported_format(self):
+        """测试不支持的上传格式"""
+        response = self.client.post('/api/cylinders/bulk', data='x', content_type='text/plain')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_export_streams_csv_and_ndjson(self):
+        """测试流式导出"""
+        for i in range(3):
+            db.session.add(Cylinder(serial_code=f'EXP{i}', specs='15kg', status='in_stock' if i else 'empty'))
+        db.session.commit()
+        
+        response = self.client.get('/api/cylinders/export?format=csv')
+        self.assertTrue(response.is_streamed)
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True).lstrip('\ufeff'))))
+        self.assertEqual([r['serial_code'] for r in rows], ['EXP0', 'EXP1', 'EXP2'])
+        
+        response = self.client.get('/api/cylinders/export?format=ndjson&status=in_stock')
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([r['serial_code'] for r in records], ['EXP1', 'EXP2'])
+
+
+class StreamingListTest(APITestCase):
+    """列表流式输出测试"""
+    
+    def setUp(self):
+        super().setUp()
+        self.app.config['STREAM_CHUNK_SIZE'] = 10
+        base = datetime(2024, 1, 1)
+        for i in range(25):
+            db.session.add(Order(
+                order_no=f'STREAM{i:02d}', user_id=self.user.id, delivery_id=self.delivery.id,
+                specs='15kg', address='测试地址', created_at=base + timedelta(minutes=i)
+            ))
+        db.session.commit()
+    
+    def test_stream_json_array_matches_full_list(self):
+        """测试 stream=1 输出与完整列表一致，且分块输出"""
+        expected = json.loads(self.client.get('/api/orders').data)
+        response = self.client.get('/api/orders?stream=1')
+        self.assertTrue(response.is_streamed)
+        chunks = list(response.response)
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(json.loads(b''.join(chunks)), expected)
+    
+    def test_stream_ndjson_via_accept_header(self):
+        """测试通过 Accept 头请求 NDJSON"""
+        response = self.client.get('/api/orders', headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[0]['order_no'], 'STREAM24')
+        self.assertEqual(rows[0]['delivery_name'], 'delivery1')
+
+
+class AuthIdentityCacheTest(APITestCase):
+    """鉴权身份缓存测试"""
+    
+    def user_queries(self, method, url, **kwargs):
+        """统计一次请求中查询用户表的SQL语句数"""
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if re.search(r'FROM users\s+WHERE users\.id', statement):
+                statements.append(statement)
+        
+        db.session.expunge_all()
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.open(url, method=method, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return response, len(statements)
+    
+    def test_single_user_lookup_per_request(self):
+        """测试同时使用 role_required 和 get_current_user 的接口只查询一次用户"""
+        response, count = self.user_queries('GET', '/api/users')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(count, 1)
+    
+    def test_process_cache_skips_lookup(self):
+        """测试开启进程缓存后重复请求不再查询用户表"""
+        self.app.config['AUTH_CACHE_TTL'] = 60
+        self.user_queries('GET', '/api/orders')
+        response, count = self.user_queries('GET', '/api/orders')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(count, 0)
+    
+    def test_update_user_invalidates_cache(self):
+        """测试修改角色后缓存失效，新角色立即生效"""
+        self.app.config['AUTH_CACHE_TTL'] = 60
+        operator = User(username='operator', role='admin')
+        operator.set_password('123456')
+        db.session.add(operator)
+        db.session.commit()
+        operator_id = operator.id
+        
+        self.logout()
+        self.login('operator', '123456')
+        self.assertEqual(self.client.get('/api/users').status_code, 200)
+        
+        self.logout()
+        self.login('admin', '123456')
+        response = self.client.put(f'/api/users/{operator_id}',
+            data=json.dumps({'role': 'user'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        
+        self.logout()
+        self.login('operator', '123456')
+        self.assertEqual(self.client.get('/api/users').status_code, 403)
+
+
+class DatabaseConfigTest(unittest.TestCase):
+    """数据库配置与方言兼容测试"""
+    
+    def test_database_uri_from_environment(self):
+        """测试连接串来自环境变量并兼容 postgres:// 写法"""
+        self.assertEqual(database_uri({}), 'sqlite:///gas_system.db')
+        self.assertEqual(database_uri({'DATABASE_URL': 'postgres://u:p@db/gas'}), 'postgresql://u:p@db/gas')
+    
+    def test_engine_options_pool_only_for_server_databases(self):
+        """测试仅 PostgreSQL/MySQL 启用连接池参数"""
+        self.assertEqual(engine_options('sqlite:///gas_system.db'), {})
+        options = engine_options('postgresql://u:p@db/gas', {'DB_POOL_SIZE': '4'})
+        self.assertEqual(options['pool_size'], 4)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertIn('pool_recycle', engine_options('mysql+pymysql://u:p@db/gas'))
+    
+    def test_day_of_is_portable(self):
+        """测试按日期分组的表达式在各数据库上的编译结果"""
+        expr = day_of(Order.created_at)
+        self.assertEqual(str(expr.compile(dialect=sqlite.dialect())), 'date(orders.created_at)')
+        self.assertEqual(str(expr.compile(dialect=postgresql.dialect())), 'CAST(orders.created_at AS DATE)')
+        self.assertEqual(str(expr.compile(dialect=mysql.dialect())), 'CAST(orders.created_at AS DATE)')
+    
+    def test_sqlite_profile_applied_on_connect(self):
+        """测试 production 参数组在每个新连接上生效，default 保持 SQLite 默认值"""
+        with tempfile.TemporaryDirectory() as tmp:
+            # synchronous: 1=NORMAL, 2=FULL
+            for profile, journal_mode, synchronous in (('production', 'wal', 1), ('default', 'delete', 2)):
+                engine = create_engine(f'sqlite:///{os.path.join(tmp, profile)}.db')
+                apply_sqlite_pragmas(engine, sqlite_pragmas(profile))
+                with engine.connect() as conn:
+                    self.assertEqual(conn.exec_driver_sql('PRAGMA journal_mode').scalar(), journal_mode)
+                    self.assertEqual(conn.exec_driver_sql('PRAGMA synchronous').scalar(), synchronous)
+                engine.dispose()
+    
+    def test_sqlite_pragma_overrides(self):
+        """测试 SQLITE_PRAGMAS 覆盖单项设置，未知参数组报错"""
+        self.assertEqual(sqlite_pragmas('production', {'busy_timeout': 10000})['busy_timeout'], 10000)
+        with self.assertRaises(ValueError):
+            sqlite_pragmas('fastest')
+
+
+class ReplicaRoutingTest(APITestCase):
+    """只读副本路由测试"""
+    
+    replica_path = os.path.join(tempfile.gettempdir(), 'gas_system_test_replica.db')
+    config = {
+        **TEST_CONFIG,
+        'SQLALCHEMY_REPLICA_URIS': [f'sqlite:///{replica_path}'],
+        'REPLICA_LAG_CHECK_INTERVAL': 0,
+        'REPLICA_READ_AFTER_WRITE': 0
+    }
+    
+    def setUp(self):
+        super().setUp()
+        self.router = self.app.extensions['replica_router']
+        self.replica = self.router.replicas['replica_0']
+        db.metadata.create_all(self.replica)
+        # 只存在于副本上的钢瓶，用来判断读请求落在哪个库
+        with self.replica.begin() as conn:
+            conn.execute(Cylinder.__table__.insert().values(
+                id=1000, serial_code='REPLICA-ONLY', specs='15kg', status='in_stock', created_at=datetime.now()
+            ))
+    
+    def tearDown(self):
+        db.session.remove()
+        db.metadata.drop_all(self.replica)
+        self.replica.dispose()
+        super().tearDown()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.replica_path + suffix):
+                os.remove(self.replica_path + suffix)
+    
+    def replicate_heartbeat(self, beat_at=None):
+        """模拟复制：把主库心跳（或指定时间）写到副本"""
+        table = ReplicaHeartbeat.__table__
+        if beat_at is None:
+            with db.engine.connect() as conn:
+                beat_at = conn.execute(select(table.c.beat_at)).scalar()
+        with self.replica.begin() as conn:
+            conn.execute(table.delete())
+            conn.execute(table.insert().values(id=1, beat_at=beat_at))
+    
+    def serials(self, url='/api/cylinders'):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return {c['serial_code'] for c in json.loads(response.data)}
+    
+    def test_reads_use_caught_up_replica(self):
+        """测试标记为只读的路由读取延迟达标的副本"""
+        self.router.check_lag()
+        self.replicate_heartbeat()
+        self.assertEqual(self.serials(), {'REPLICA-ONLY'})
+        self.assertEqual(self.router.lags['replica_0'], 0.0)
+    
+    def test_unmarked_routes_use_primary(self):
+        """测试未标记的路由和写请求使用主库"""
+        self.router.check_lag()
+        self.replicate_heartbeat()
+        response = self.client.get('/api/users')
+        self.assertEqual(len(json.loads(response.data)), 3)
+        response = self.client.post('/api/cylinders',
+            data=json.dumps({'specs': '15kg', 'serial_code': 'PRIMARY1'}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Cylinder.query.filter_by(serial_code='PRIMARY1').count(), 1)
+    
+    def test_stale_replica_leaves_rotation(self):
+        """测试延迟超限的副本被移出轮询，读取回落到主库"""
+        self.router.check_lag()
+        self.replicate_heartbeat(datetime.now() - timedelta(minutes=5))
+        self.assertEqual(self.serials(), set())
+        self.assertGreater(self.router.lags['replica_0'], self.app.config.get('REPLICA_MAX_LAG', 5))
+        self.assertEqual(self.router.healthy, [])
+    
+    def test_read_after_write_uses_primary(self):
+        """测试客户端写入后的读取走主库，能读到刚写入的数据"""
+        self.app.config['REPLICA_READ_AFTER_WRITE'] = 60
+        self.router.check_lag()
+        self.replicate_heartbeat()
+        self.client.post('/api/cylinders',
+            data=json.dumps({'specs': '15kg', 'serial_code': 'FRESH1'}),
+            content_type='application/json')
+        self.assertEqual(self.serials(), {'FRESH1'})
+
+
+class ConditionalGetTest(APITestCase):
+    """条件 GET（ETag / Last-Modified）测试"""
+    
+    def get_with_queries(self, url, headers=None):
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.get(url, headers=headers or {})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return response, statements
+    
+    def test_unchanged_data_returns_304_without_queries(self):
+        """测试数据未变化时返回 304，只读取版本表"""
+        for url in ['/api/stats/dashboard', '/api/cylinders/stats', '/api/announcements']:
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200, url)
+            self.assertTrue(first.headers.get('ETag'), url)
+            self.assertIn('private', first.headers['Cache-Control'])
+            
+            response, statements = self.get_with_queries(url, {'If-None-Match': first.headers['ETag']})
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.headers['ETag'], first.headers['ETag'])
+            self.assertEqual(len(statements), 1, statements)
+            self.assertIn('table_versions', statements[0])
+    
+    def test_writes_change_etag(self):
+        """测试 ORM 写入和批量导入都会使 ETag 失效"""
+        etag = self.client.get('/api/cylinders/stats').headers['ETag']
+        self.client.post('/api/cylinders',
+            data=json.dumps({'specs': '15kg'}),
+            content_type='application/json')
+        response = self.client.get('/api/cylinders/stats', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['in_stock'], 1)
+        
+        etag = response.headers['ETag']
+        self.client.post('/api/cylinders/bulk?format=csv',
+            data='serial_code,specs\nETAG1,15kg\n', content_type='text/csv')
+        response = self.client.get('/api/cylinders/stats', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['in_stock'], 2)
+    
+    def test_query_args_are_part_of_etag(self):
+        """测试不同查询参数得到不同的 ETag"""
+        etag = self.client.get('/api/cylinders/stats').headers['ETag']
+        response = self.client.get('/api/cylinders/stats?station_id=1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+    
+    def test_if_modified_since(self):
+        """测试 If-Modified-Since 条件请求"""
+        first = self.client.get('/api/announcements')
+        last_modified = first.headers['Last-Modified']
+        response = self.client.get('/api/announcements', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/api/stats/dashboard').headers['Cache-Control'], 'private, max-age=10')
+
+
+class DictRedis:
+    """测试用的 Redis 替身，只实现 RedisCache 用到的命令"""
+    
+    def __init__(self):
+        self.data = {}
+    
+    def get(self, key):
+        return self.data.get(key)
+    
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+    
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+    
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+
+class ResponseCacheTest(APITestCase):
+    """统计接口服务端缓存测试"""
+    
+    def stats_queries(self, url):
+        """统计一次请求中查询业务表的SQL语句数"""
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM cylinders' in statement or 'FROM inventory_counters' in statement:
+                statements.append(statement)
+        
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data), len(statements)
+    
+    def test_hit_skips_queries_and_writes_invalidate(self):
+        """测试命中缓存不再查询，写入钢瓶后缓存失效"""
+        first, queries = self.stats_queries('/api/cylinders/stats')
+        self.assertGreater(queries, 0)
+        second, queries = self.stats_queries('/api/cylinders/stats')
+        self.assertEqual(queries, 0)
+        self.assertEqual(first, second)
+        
+        self.client.post('/api/cylinders',
+            data=json.dumps({'specs': '15kg'}),
+            content_type='application/json')
+        third, queries = self.stats_queries('/api/cylinders/stats')
+        self.assertGreater(queries, 0)
+        self.assertEqual(third['in_stock'], first['in_stock'] + 1)
+    
+    def test_role_scope_and_arguments_are_part_of_key(self):
+        """测试不同角色、不同参数使用不同的缓存条目"""
+        self.client.get('/api/cylinders/stats')
+        self.client.get('/api/cylinders/stats?station_id=1')
+        self.logout()
+        self.login('testuser', '123456')
+        self.client.get('/api/cylinders/stats')
+        cache = self.app.extensions['response_cache']
+        self.assertEqual(cache.metrics['api.get_cylinder_stats'], {'hits': 0, 'misses': 3})
+        self.client.get('/api/cylinders/stats')
+        self.assertEqual(cache.metrics['api.get_cylinder_stats'], {'hits': 1, 'misses': 3})
+    
+    def test_metrics_endpoint(self):
+        """测试命中率统计接口"""
+        self.client.get('/api/stats/dashboard')
+        self.client.get('/api/stats/dashboard')
+        metrics = json.loads(self.client.get('/api/stats/cache').data)
+        self.assertEqual(metrics['backend'], 'LocalCache')
+        self.assertEqual(metrics['routes']['api.get_dashboard_stats'], {'hits': 1, 'misses': 1})
+        self.assertEqual(metrics['hit_rate'], 0.5)
+    
+    def test_local_cache_lru_eviction(self):
+        """测试进程内缓存按 LRU 淘汰并按 TTL 过期"""
+        cache = LocalCache(max_entries=2)
+        cache.set('a', b'1', 60)
+        cache.set('b', b'2', 60)
+        cache.get('a')
+        cache.set('c', b'3', 60)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'1')
+        cache.set('d', b'4', 0)
+        self.assertIsNone(cache.get('d'))
+    
+    def test_redis_backend(self):
+        """测试 Redis 兼容后端与提交后失效"""
+        redis_client = DictRedis()
+        self.app.extensions['response_cache'] = ResponseCache(RedisCache(redis_client), ttl=60)
+        first = json.loads(self.client.get('/api/stats/dashboard').data)
+        self.client.get('/api/stats/dashboard')
+        
+        self.client.post('/api/cylinders',
+            data=json.dumps({'specs': '15kg'}),
+            content_type='application/json')
+        metrics = self.app.extensions['response_cache'].snapshot()
+        self.assertEqual((metrics['hits'], metrics['misses']), (1, 1))
+        self.assertEqual(json.loads(self.client.get('/api/stats/dashboard').data)['total_cylinders'],
+                         first['total_cylinders'] + 1)
+
+    
+    def test_write_from_other_instance_invalidates(self):
+        """测试另一个应用实例（worker）提交的写入同样使缓存失效，且响应体与 ETag 一致"""
+        other = create_app(self.config)
+        other_client = other.test_client()
+        with other.app_context():
+            other_client.post('/api/auth/login',
+                data=json.dumps({'username': 'admin', 'password': '123456'}),
+                content_type='application/json')
+            first = other_client.get('/api/cylinders/stats')
+            other_client.get('/api/cylinders/stats')
+            self.assertEqual(other.extensions['response_cache'].metrics['api.get_cylinder_stats'],
+                             {'hits': 1, 'misses': 1})
+        
+        self.client.post('/api/cylinders',
+            data=json.dumps({'specs': '15kg'}),
+            content_type='application/json')
+        
+        with other.app_context():
+            second = other_client.get('/api/cylinders/stats')
+            self.assertNotEqual(second.headers['ETag'], first.headers['ETag'])
+            self.assertEqual(json.loads(second.data)['total'], json.loads(first.data)['total'] + 1)
+            response = other_client.get('/api/cylinders/stats',
+                                        headers={'If-None-Match': second.headers['ETag']})
+            self.assertEqual(response.status_code, 304)
+            db.session.remove()
+
+class EventStreamTest(APITestCase):
+    """实时事件推送（SSE）测试"""
+    
+    config = dict(TEST_CONFIG, EVENT_STREAM_TIMEOUT=0.3, EVENT_POLL_INTERVAL=0.05, EVENT_HEARTBEAT_INTERVAL=0.1)
+    
+    def read_stream(self, query='', headers=None):
+        """读取一次推送连接（到达最长时间后结束），返回 (事件列表, 心跳数)"""
+        response = self.client.get(f'/api/events/stream{query}', headers=headers or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events, heartbeats = [], 0
+        for frame in response.get_data(as_text=True).split('\n\n'):
+            if frame.startswith(': heartbeat'):
+                heartbeats += 1
+            elif frame.startswith('id: '):
+                fields = dict(line.split(': ', 1) for line in frame.split('\n'))
+                events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+        return events, heartbeats
+    
+    def run_order(self):
+        """下单、分配、配送、完成，产生完整的一组事件"""
+        delivery_id = self.delivery.id
+        self.client.post('/api/cylinders',
+            data=json.dumps({'specs': '15kg'}),
+            content_type='application/json')
+        self.logout()
+        self.login('testuser', '123456')
+        order = json.loads(self.client.post('/api/orders',
+            data=json.dumps({'specs': '15kg', 'address': '测试地址'}),
+            content_type='application/json').data)
+        self.logout()
+        self.login('admin', '123456')
+        self.client.put(f'/api/orders/{order["id"]}/assign',
+            data=json.dumps({'delivery_id': delivery_id}),
+            content_type='application/json')
+        for status in ('delivering', 'completed'):
+            self.client.put(f'/api/orders/{order["id"]}/status',
+                data=json.dumps({'status': status}),
+                content_type='application/json')
+        return order['id']
+    
+    def test_events_filtered_by_role(self):
+        """测试管理员看到全部事件，用户、配送员只看到与自己相关的订单事件"""
+        order_id = self.run_order()
+        events, _ = self.read_stream('?last_event_id=0')
+        self.assertEqual([e[1] for e in events], [
+            'order.created', 'order.assigned', 'order.status_changed', 'courier.route_updated',
+            'cylinder.status_changed', 'order.status_changed'
+        ])
+        self.assertEqual(events[4][2]['cylinder']['status'], 'in_use')
+        self.assertEqual(events[4][2]['order_id'], order_id)
+        self.assertEqual(events[5][2]['previous_status'], 'delivering')
+        self.assertEqual(events[5][2]['order']['status'], 'completed')
+        
+        self.logout()
+        self.login('testuser', '123456')
+        events, _ = self.read_stream('?last_event_id=0')
+        self.assertEqual(len(events), 4)
+        self.assertTrue(all(e[1].startswith('order.') for e in events))
+        
+        self.logout()
+        self.login('delivery1', '123456')
+        events, _ = self.read_stream('?last_event_id=0')
+        self.assertEqual([e[1] for e in events], [
+            'order.assigned', 'order.status_changed', 'courier.route_updated', 'order.status_changed'
+        ])
+    
+    def test_resume_from_last_event_id(self):
+        """测试带 Last-Event-ID 重连时只推送之后的事件"""
+        self.run_order()
+        events, _ = self.read_stream('?last_event_id=0')
+        resumed, _ = self.read_stream(headers={'Last-Event-ID': str(events[1][0])})
+        self.assertEqual(resumed, events[2:])
+        
+        response = self.client.get('/api/events/stream', headers={'Last-Event-ID': 'abc'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_new_connection_sends_heartbeats_only(self):
+        """测试不带 Last-Event-ID 的连接从最新事件之后开始，空闲时发送心跳"""
+        self.run_order()
+        events, heartbeats = self.read_stream()
+        self.assertEqual(events, [])
+        self.assertGreater(heartbeats, 0)
+        
+        self.logout()
+        response = self.client.get('/api/events/stream')
+        self.assertEqual(response.status_code, 401)
+    
+    def test_connection_announces_resume_point(self):
+        """测试连接开始时下发当前事件 id，空闲连接到期重连也能从断点续传"""
+        self.run_order()
+        events, _ = self.read_stream('?last_event_id=0')
+        response = self.client.get('/api/events/stream')
+        first = response.get_data(as_text=True).split('\n\n')[0]
+        self.assertEqual(first, f'retry: 2000\nid: {events[-1][0]}')
+    
+    def test_sync_worker_stream_shorter_than_worker_timeout(self):
+        """测试 sync worker 下单次连接默认在 gunicorn WORKER_TIMEOUT 之前结束"""
+        self.assertEqual(default_stream_timeout({}), 20)
+        self.assertEqual(default_stream_timeout({'WORKER_TIMEOUT': '120'}), 110)
+        self.assertEqual(default_stream_timeout({'WORKER_TIMEOUT': '5'}), 2.5)
+        self.assertEqual(default_stream_timeout({'WORKER_TIMEOUT': '0'}), 300)
+        self.assertLess(create_app(TEST_CONFIG).config['EVENT_STREAM_TIMEOUT'], 30)
+
+
+class CooperativeWorkerTest(APITestCase):
+    """gevent worker 模式下的会话隔离测试"""
+    
+    @unittest.skipUnless(importlib.util.find_spec('gevent'), '未安装 gevent')
+    def test_greenlets_use_separate_sessions(self):
+        """测试并发协程各自的请求使用独立的数据库会话"""
+        import gevent
+        
+        def handle(username):
+            with self.app.app_context(), self.app.test_request_context():
+                session = db.session()
+                user = User.query.filter_by(username=username).one()
+                gevent.sleep(0)
+                # 切换到其他协程后，当前会话与已加载的对象不受影响
+                self.assertIs(db.session(), session)
+                self.assertIn(user, session)
+                return id(session)
+        
+        jobs = [gevent.spawn(handle, name) for name in ('admin', 'testuser', 'delivery1')]
+        gevent.joinall(jobs, raise_error=True)
+        self.assertEqual(len({job.value for job in jobs}), 3)
+    
+    def test_not_cooperative_without_monkey_patch(self):
+        """测试未 patch 的进程（如测试、开发服务器）按同步模式运行"""
+        self.assertFalse(cooperative())
+
+
+@unittest.skipUnless(importlib.util.find_spec('PIL'), '未安装 Pillow')
+class PhotoUploadTest(APITestCase):
+    """安检照片上传测试"""
+    
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+        self.config = dict(TEST_CONFIG, UPLOAD_FOLDER=self.upload_dir, MAX_UPLOAD_SIZE=200 * 1024)
+        super().setUp()
+    
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+    
+    def image_bytes(self, size=(800, 600), fmt='PNG', color='red'):
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGB', size, color).save(buffer, fmt)
+        return buffer.getvalue()
+    
+    def upload(self, content, filename='photo.exe'):
+        return self.client.post('/api/safety/upload',
+            data={'file': (io.BytesIO(content), filename)},
+            content_type='multipart/form-data')
+    
+    def test_content_addressed_storage_and_thumbnail(self):
+        """测试按内容哈希存储、识别真实类型并在后台生成缩略图"""
+        from PIL import Image
+        content = self.image_bytes()
+        response = self.upload(content)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(data['sha256'], digest)
+        self.assertEqual(data['url'], f'/uploads/photos/{digest[:2]}/{digest}.png')
+        self.assertFalse(data['duplicate'])
+        self.assertTrue(os.path.exists(os.path.join(self.upload_dir, data['url'][len('/uploads/'):])))
+        
+        run_pending()
+        with Image.open(os.path.join(self.upload_dir, data['thumbnail_url'][len('/uploads/'):])) as thumb:
+            self.assertEqual(thumb.format, 'JPEG')
+            self.assertEqual(max(thumb.size), 320)
+        
+        again = json.loads(self.upload(content, 'other.jpg').data)
+        self.assertTrue(again['duplicate'])
+        self.assertEqual(again['url'], data['url'])
+    
+    def test_raw_body_upload(self):
+        """测试请求体直接为图片时的流式上传"""
+        content = self.image_bytes(fmt='JPEG')
+        response = self.client.post('/api/safety/upload', data=content, content_type='image/jpeg')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data)['url'].endswith('.jpg'))
+    
+    def test_rejects_oversized_and_non_image(self):
+        """测试超过大小上限返回 413，非图片返回 415，且不残留临时文件"""
+        self.assertEqual(self.upload(b'MZ' + b'\0' * 100, 'photo.jpg').status_code, 415)
+        # 声明长度未超出余量时由写入过程截断，明显超出时直接拒绝
+        for extra in (230 * 1024, 300 * 1024):
+            noise = b'\x89PNG\r\n\x1a\n' + os.urandom(extra)
+            self.assertEqual(self.upload(noise).status_code, 413)
+            response = self.client.post('/api/safety/upload', data=noise, content_type='image/png')
+            self.assertEqual(response.status_code, 413)
+        self.assertEqual(os.listdir(os.path.join(self.upload_dir, 'tmp')), [])
+    
+    # gunicorn 等服务器收到分块请求时设置，表示 wsgi.input 在请求体结束处返回 EOF
+    CHUNKED = {'wsgi.input_terminated': True}
+    
+    def test_rejects_oversized_chunked_body_while_reading(self):
+        """测试无 Content-Length 的分块上传超过上限时，读取过程中即返回 413，不读完整个请求体"""
+        boundary = 'chunkedboundary'
+        image = b'\x89PNG\r\n\x1a\n' + os.urandom(2 * 1024 * 1024)
+        multipart = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="a.png"\r\n'
+                     f'Content-Type: image/png\r\n\r\n').encode() + image + f'\r\n--{boundary}--\r\n'.encode()
+        
+        class CountingStream(io.BytesIO):
+            consumed = 0
+            
+            def read(self, size=-1):
+                chunk = super().read(size)
+                CountingStream.consumed += len(chunk)
+                return chunk
+        
+        for content_type, body in ((f'multipart/form-data; boundary={boundary}', multipart), ('image/png', image)):
+            CountingStream.consumed = 0
+            response = self.client.post('/api/safety/upload', input_stream=CountingStream(body), headers={
+                'Content-Type': content_type,
+                'Transfer-Encoding': 'chunked'
+            }, environ_overrides=self.CHUNKED)
+            self.assertEqual(response.status_code, 413)
+            self.assertIn('error', json.loads(response.data))
+            self.assertLess(CountingStream.consumed, len(body) // 2)
+        self.assertEqual(self.app.config['MAX_CONTENT_LENGTH'], 200 * 1024 + MULTIPART_OVERHEAD)
+        
+        # 批量导入使用单独的上限 MAX_IMPORT_SIZE
+        csv_body = 'serial_code,specs\n' + ''.join(f'CHUNKED-{i:06d},15kg\n' for i in range(20000))
+        self.assertGreater(len(csv_body), self.app.config['MAX_CONTENT_LENGTH'])
+        response = self.client.post('/api/cylinders/bulk', input_stream=io.BytesIO(csv_body.encode()), headers={
+            'Content-Type': 'text/csv',
+            'Transfer-Encoding': 'chunked'
+        }, environ_overrides=self.CHUNKED)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['inserted'], 20000)
+    
+    def test_records_list_thumbnails(self):
+        """测试安检记录返回与照片一一对应的缩略图地址"""
+        url = json.loads(self.upload(self.image_bytes()).data)['url']
+        response = self.client.post('/api/safety/records',
+            data=json.dumps({'photos': [url, '/uploads/legacy.jpg']}),
+            content_type='application/json')
+        record = json.loads(response.data)
+        self.assertEqual(record['photo_thumbnails'], [url.replace('/photos/', '/thumbs/').replace('.png', '.jpg'),
+                                                      '/uploads/legacy.jpg'])
+    
+    def test_serve_with_range_and_immutable_cache(self):
+        """测试 /uploads 支持 Range、条件请求，内容寻址文件长期缓存"""
+        content = self.image_bytes()
+        url = json.loads(self.upload(content).data)['url']
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, content)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        
+        partial = self.client.get(url, headers={'Range': 'bytes=0-7'})
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial.data, content[:8])
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code, 304)
+        
+        with open(os.path.join(self.upload_dir, 'legacy.jpg'), 'wb') as f:
+            f.write(b'legacy')
+        self.assertEqual(self.client.get('/uploads/legacy.jpg').headers['Cache-Control'], 'public, max-age=3600')
+        for path in ('/uploads/../app/__init__.py', '/uploads/tmp/x', '/uploads/missing.jpg'):
+            self.assertEqual(self.client.get(path).status_code, 404, path)
+    
+    def test_missing_thumbnail_falls_back_to_original(self):
+        """测试缩略图未生成时返回原图且不缓存"""
+        content = self.image_bytes()
+        data = json.loads(self.upload(content).data)
+        run_pending()
+        os.remove(os.path.join(self.upload_dir, data['thumbnail_url'][len('/uploads/'):]))
+        response = self.client.get(data['thumbnail_url'])
+        self.assertEqual(response.data, content)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+    
+    def test_accel_redirect(self):
+        """测试配置 UPLOADS_ACCEL_REDIRECT 后交由 nginx 发送文件"""
+        self.app.config['UPLOADS_ACCEL_REDIRECT'] = '/_uploads/'
+        url = json.loads(self.upload(self.image_bytes()).data)['url']
+        response = self.client.get(url)
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/_uploads/' + url[len('/uploads/'):])
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+
+FLAKY_CALLS = []
+
+
+@job('tests.flaky')
+def flaky_job(fail_times):
+    """测试用任务：前 fail_times 次调用失败"""
+    FLAKY_CALLS.append(fail_times)
+    if len(FLAKY_CALLS) <= fail_times:
+        raise RuntimeError('模拟失败')
+
+
+class JobQueueTest(APITestCase):
+    """后台任务队列测试"""
+    
+    def setUp(self):
+        super().setUp()
+        FLAKY_CALLS.clear()
+    
+    def test_background_reconcile(self):
+        """测试接口加入任务后立即返回，由 worker 执行"""
+        response = self.client.post('/api/cylinders/stats/reconcile?background=1')
+        self.assertEqual(response.status_code, 202)
+        job_id = json.loads(response.data)['job_id']
+        stats = json.loads(self.client.get('/api/jobs/stats').data)
+        self.assertEqual(stats['pending'], 1)
+        self.assertEqual(stats['pending_by_name'], {'inventory.reconcile': 1})
+        
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(db.session.get(Job, job_id).status, 'done')
+        self.assertEqual(queue_stats()['done'], 1)
+        self.assertEqual(run_pending(), (0, 0))
+        
+        # 执行后自动排定下一次定时对账，重复执行不会重复排定
+        scheduled = Job.query.filter_by(name='inventory.reconcile', status='pending').one()
+        self.assertGreater(scheduled.run_at, datetime.utcnow() + timedelta(minutes=59))
+        reconcile_inventory()
+        self.assertEqual(Job.query.filter_by(name='inventory.reconcile', status='pending').count(), 1)
+    
+    def test_prune_events_reschedules_itself(self):
+        """测试过期事件清理任务删除旧事件并排定下一次清理"""
+        db.session.add(Event(type='order.created', payload='{}', created_at=datetime.utcnow() - timedelta(hours=48)))
+        db.session.add(Event(type='order.created', payload='{}'))
+        enqueue('events.prune')
+        db.session.commit()
+        
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(Event.query.count(), 1)
+        scheduled = Job.query.filter_by(name='events.prune', status='pending').one()
+        self.assertGreater(scheduled.run_at, datetime.utcnow() + timedelta(minutes=59))
+        prune_events()
+        self.assertEqual(Job.query.filter_by(name='events.prune', status='pending').count(), 1)
+    
+    def test_retry_with_backoff_then_fail(self):
+        """测试失败后按退避时间重试，超过次数标记为 failed"""
+        self.app.config['JOB_RETRY_BASE'] = 30
+        item = enqueue('tests.flaky', max_attempts=2, fail_times=5)
+        db.session.commit()
+        
+        self.assertEqual(run_pending(), (0, 1))
+        item = db.session.get(Job, item.id)
+        self.assertEqual((item.status, item.attempts), ('pending', 1))
+        self.assertGreater(item.run_at, datetime.utcnow() + timedelta(seconds=25))
+        # 未到重试时间不会被领取
+        self.assertEqual(run_pending(), (0, 0))
+        
+        item.run_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        self.assertEqual(run_pending(), (0, 1))
+        item = db.session.get(Job, item.id)
+        self.assertEqual(item.status, 'failed')
+        self.assertIn('模拟失败', item.last_error)
+        
+        failed = json.loads(self.client.get('/api/jobs?status=failed').data)
+        self.assertEqual([j['id'] for j in failed], [item.id])
+        self.assertEqual(failed[0]['payload'], {'fail_times': 5})
+    
+    def test_retry_succeeds(self):
+        """测试重试成功后任务完成"""
+        self.app.config['JOB_RETRY_BASE'] = 0
+        item = enqueue('tests.flaky', fail_times=1)
+        db.session.commit()
+        self.assertEqual(run_pending(), (1, 1))
+        self.assertEqual(db.session.get(Job, item.id).status, 'done')
+        self.assertEqual(len(FLAKY_CALLS), 2)
+    
+    def test_requeue_stale_running_jobs(self):
+        """测试超时未结束的任务重新回到队列"""
+        item = enqueue('tests.flaky', fail_times=0)
+        item.status = 'running'
+        item.locked_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(run_pending(), (1, 0))
+    
+    def test_job_writes_do_not_invalidate_caches(self):
+        """测试任务表的写入不改变统计接口的 ETag"""
+        etag = self.client.get('/api/stats/dashboard').headers['ETag']
+        enqueue('tests.flaky', fail_times=0)
+        db.session.commit()
+        run_pending()
+        response = self.client.get('/api/stats/dashboard', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+
+class OrderSearchTest(APITestCase):
+    """订单筛选、排序与全文检索测试"""
+    
+    def setUp(self):
+        super().setUp()
+        base = datetime(2024, 3, 1, 9, 0, 0)
+        rows = [
+            ('ORD20240301A', '北京市朝阳区建国路88号', '放门口', '13911112222', '15kg', 120),
+            ('ORD20240302B', '上海市浦东新区世纪大道100号', None, '13933334444', '5kg', 50),
+            ('ORD20240303C', '北京市海淀区中关村大街1号', '下午送 朝阳区客户介绍', '13911112222', '50kg', 350),
+            ('ORD20240401D', '广州市天河区体育西路', '电话 100% 确认', '13955556666', '15kg', 240),
+        ]
+        for i, (order_no, address, remark, phone, specs, amount) in enumerate(rows):
+            db.session.add(Order(
+                order_no=order_no, user_id=self.user.id, address=address, remark=remark,
+                contact_phone=phone, specs=specs, total_amount=amount,
+                delivery_id=self.delivery.id if i % 2 else None,
+                created_at=base + timedelta(days=i if i < 3 else 31)
+            ))
+        db.session.commit()
+    
+    def order_nos(self, query):
+        response = self.client.get('/api/orders' + query)
+        self.assertEqual(response.status_code, 200, response.data)
+        data = json.loads(response.data)
+        items = data['items'] if isinstance(data, dict) else data
+        return [o['order_no'] for o in items]
+    
+    def test_filters(self):
+        """测试日期范围、订单号前缀、电话、规格和配送员筛选"""
+        self.assertEqual(self.order_nos('?start_date=2024-03-02&end_date=2024-03-03'),
+                         ['ORD20240303C', 'ORD20240302B'])
+        self.assertEqual(self.order_nos('?order_no=ORD202403'), ['ORD20240303C', 'ORD20240302B', 'ORD20240301A'])
+        self.assertEqual(self.order_nos('?contact_phone=13911112222&specs=15kg'), ['ORD20240301A'])
+        self.assertEqual(self.order_nos(f'?delivery_id={self.delivery.id}'), ['ORD20240401D', 'ORD20240302B'])
+        self.assertEqual(self.client.get('/api/orders?start_date=2024/03/01').status_code, 400)
+    
+    def test_sort_keys_with_cursor(self):
+        """测试白名单排序键与升序游标翻页"""
+        self.assertEqual(self.order_nos('?sort=-total_amount'),
+                         ['ORD20240303C', 'ORD20240401D', 'ORD20240301A', 'ORD20240302B'])
+        page = json.loads(self.client.get('/api/orders?sort=total_amount&limit=3').data)
+        self.assertEqual([o['order_no'] for o in page['items']], ['ORD20240302B', 'ORD20240301A', 'ORD20240401D'])
+        self.assertEqual(self.order_nos(f'?sort=total_amount&limit=3&cursor={page["next_cursor"]}'), ['ORD20240303C'])
+        self.assertEqual(self.client.get('/api/orders?sort=password').status_code, 400)
+    
+    def test_null_amount_pages(self):
+        """测试金额为空的订单按 0 排序，逐页翻完不会漏掉或停在空值行"""
+        for i in range(3):
+            db.session.add(Order(order_no=f'ORDNULL{i}', user_id=self.user.id, specs='15kg', address='测试地址'))
+        db.session.flush()
+        Order.query.filter(Order.order_no.like('ORDNULL%')).update({'total_amount': None}, synchronize_session=False)
+        db.session.commit()
+        
+        for sort in ('total_amount', '-total_amount'):
+            seen, cursor = [], ''
+            while True:
+                page = json.loads(self.client.get(f'/api/orders?sort={sort}&limit=2{cursor}').data)
+                seen += [o['order_no'] for o in page['items']]
+                if not page['next_cursor']:
+                    break
+                cursor = f'&cursor={page["next_cursor"]}'
+            self.assertEqual(len(seen), 7, sort)
+            self.assertEqual(self.order_nos(f'?sort={sort}'), seen)
+        self.assertEqual(seen[-3:], ['ORDNULL2', 'ORDNULL1', 'ORDNULL0'])
+    
+    def test_full_text_search(self):
+        """测试地址、备注检索：多词 AND、短词回退 LIKE、特殊字符转义"""
+        self.assertEqual(self.order_nos('?q=朝阳区'), ['ORD20240303C', 'ORD20240301A'])
+        self.assertEqual(self.order_nos('?q=北京市 中关村'), ['ORD20240303C'])
+        self.assertEqual(self.order_nos('?q=浦东'), ['ORD20240302B'])
+        self.assertEqual(self.order_nos('?q=100%25'), ['ORD20240401D'])
+        self.assertEqual(self.order_nos('?q="OR'), [])
+        
+        # 修改、删除后索引同步
+        order = Order.query.filter_by(order_no='ORD20240302B').one()
+        order.address = '深圳市南山区科技园'
+        db.session.delete(Order.query.filter_by(order_no='ORD20240301A').one())
+        db.session.commit()
+        self.assertEqual(self.order_nos('?q=浦东新区'), [])
+        self.assertEqual(self.order_nos('?q=南山区'), ['ORD20240302B'])
+        self.assertEqual(self.order_nos('?q=朝阳区'), ['ORD20240303C'])
+    
+    def test_search_respects_role(self):
+        """测试检索结果仍按角色过滤"""
+        self.logout()
+        self.login('delivery1', '123456')
+        self.assertEqual(self.order_nos('?q=市'), ['ORD20240401D', 'ORD20240302B'])
+    
+    @unittest.skipUnless(TEST_DATABASE_URI.startswith('sqlite'), '仅适用于 SQLite')
+    def test_fts_index_used_and_rebuilt(self):
+        """测试 SQLite 使用 FTS5 索引，orders 表重建后索引随之重建"""
+        self.assertEqual(self.app.extensions['order_search'], 'fts5')
+        condition = search_filter('朝阳区', 'fts5')
+        sql = str(Order.query.filter(condition).statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        plan = ' '.join(row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql)))
+        self.assertIn('VIRTUAL TABLE INDEX', plan)
+        
+        db.session.execute(text('DROP TRIGGER orders_fts_insert'))
+        db.session.execute(text("INSERT INTO orders_fts(orders_fts) VALUES ('delete-all')"))
+        db.session.commit()
+        self.assertEqual(ensure_search_index(db.engine), 'fts5')
+        self.assertEqual(self.order_nos('?q=朝阳区'), ['ORD20240303C', 'ORD20240301A'])
+
+
+class GeoDispatchTest(APITestCase):
+    """就近配送员推荐测试"""
+    
+    ORIGIN = (39.9042, 116.4074)
+    
+    def setUp(self):
+        super().setUp()
+        self.couriers = {}
+        for name in ('near', 'middle', 'far', 'stale', 'remote'):
+            courier = User(username=f'courier_{name}', role='delivery', phone='13700137001')
+            courier.set_password('123456')
+            db.session.add(courier)
+            self.couriers[name] = courier
+        db.session.commit()
+        
+        lat, lng = self.ORIGIN
+        self.locate('near', lat + 0.0045, lng)       # 约 0.5km
+        self.locate('middle', lat, lng + 0.0176)     # 约 1.5km
+        self.locate('far', lat - 0.027, lng)         # 约 3km
+        self.locate('stale', lat + 0.0009, lng)      # 约 0.1km，位置已过期
+        self.locate('remote', 31.2304, 121.4737)     # 上海
+        db.session.get(CourierLocation, self.couriers['stale'].id).updated_at = datetime.utcnow() - timedelta(hours=2)
+        # 最近的配送员手上有 2 单未完成
+        db.session.add(CourierStat(delivery_id=self.couriers['near'].id, assigned_count=2, open_count=2))
+        self.order = Order(order_no='ORDGEO001', user_id=self.user.id, specs='15kg', address='北京市东城区',
+                           latitude=lat, longitude=lng)
+        db.session.add(self.order)
+        db.session.commit()
+    
+    def locate(self, name, latitude, longitude):
+        self.logout()
+        self.login(self.couriers[name].username, '123456')
+        response = self.client.put('/api/couriers/location',
+            data=json.dumps({'latitude': latitude, 'longitude': longitude}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.logout()
+        self.login('admin', '123456')
+    
+    def suggest(self, query=''):
+        response = self.client.get(f'/api/orders/{self.order.id}/suggest-couriers{query}')
+        self.assertEqual(response.status_code, 200, response.data)
+        return json.loads(response.data)['couriers']
+    
+    def test_geohash(self):
+        """测试 geohash 编码与相邻网格"""
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(encode_geohash(39.9042, 116.4074, 6), 'wx4g0b')
+        cells = neighbor_cells(39.9042, 116.4074, 6)
+        self.assertEqual(len(cells), 9)
+        self.assertIn('wx4g0b', cells)
+        self.assertAlmostEqual(haversine_km(39.9042, 116.4074, 31.2304, 121.4737), 1067, delta=5)
+    
+    def test_suggest_by_distance_and_load(self):
+        """测试按距离加负载排序，排除过期位置和远处的配送员"""
+        couriers = self.suggest()
+        self.assertEqual([c['username'] for c in couriers], ['courier_middle', 'courier_far', 'courier_near'])
+        self.assertAlmostEqual(couriers[0]['distance_km'], 1.5, delta=0.05)
+        self.assertEqual(couriers[2]['open_count'], 2)
+        self.assertAlmostEqual(couriers[2]['score'], couriers[2]['distance_km'] + 4, delta=0.001)
+        self.assertEqual([c['username'] for c in self.suggest('?k=1')], ['courier_middle'])
+        
+        self.app.config['DISPATCH_LOAD_PENALTY_KM'] = 0
+        self.assertEqual(self.suggest('?k=2')[0]['username'], 'courier_near')
+    
+    def test_validation_and_permissions(self):
+        """测试坐标校验、k 范围和角色限制"""
+        self.assertEqual(self.client.get(f'/api/orders/{self.order.id}/suggest-couriers?k=0').status_code, 400)
+        self.order.latitude = self.order.longitude = None
+        db.session.commit()
+        self.assertEqual(self.client.get(f'/api/orders/{self.order.id}/suggest-couriers').status_code, 400)
+        self.assertEqual(self.client.put('/api/couriers/location',
+            data=json.dumps({'latitude': 39.9, 'longitude': 116.4}),
+            content_type='application/json').status_code, 403)
+        
+        self.logout()
+        self.login('delivery1', '123456')
+        for body in ({'latitude': 91, 'longitude': 0}, {'latitude': 39.9}, {'latitude': '39.9', 'longitude': '116.4'}):
+            response = self.client.put('/api/couriers/location', data=json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        
+        self.logout()
+        self.login('testuser', '123456')
+        self.assertEqual(self.client.get(f'/api/orders/{self.order.id}/suggest-couriers').status_code, 403)
+    
+    def test_create_order_with_coordinates(self):
+        """测试下单时保存配送地址坐标，坐标须成对提供"""
+        db.session.add(Cylinder(serial_code='GEO-1', specs='15kg', status='in_stock'))
+        db.session.commit()
+        reconcile_inventory()
+        self.logout()
+        self.login('testuser', '123456')
+        body = {'specs': '15kg', 'address': '北京市东城区', 'latitude': 39.9042, 'longitude': 116.4074}
+        response = self.client.post('/api/orders', data=json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(json.loads(response.data)['latitude'], 39.9042)
+        
+        del body['longitude']
+        response = self.client.post('/api/orders', data=json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+    
+    @unittest.skipUnless(TEST_DATABASE_URI.startswith('sqlite'), '仅适用于 SQLite')
+    def test_geohash_index_used(self):
+        """测试附近网格查询从 geohash 索引开始，只按主键关联用户和负载"""
+        compiled = geo._CANDIDATES.compile(dialect=db.engine.dialect)
+        params = {'cutoff': datetime.utcnow()}
+        for i, cell in enumerate(neighbor_cells(*self.ORIGIN, 6)):
+            params[f'low{i}'], params[f'high{i}'] = cell, cell + '~'
+        params = compiled.construct_params(params)
+        rows = db.session.connection().exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + str(compiled), tuple(params[name] for name in compiled.positiontup)
+        ).all()
+        plan = [row[-1] for row in rows]
+        first_search = next(step for step in plan if step.startswith('SEARCH'))
+        self.assertIn('ix_courier_locations_geohash', first_search, plan)
+        self.assertFalse(any('SCAN' in step for step in plan), plan)
+        self.assertFalse(any('ix_users_role' in step for step in plan), plan)
+    
+    def test_role_change_clears_location(self):
+        """测试配送员改为其他角色或被删除后不再被推荐"""
+        near = self.couriers['near']
+        response = self.client.put(f'/api/users/{near.id}', data=json.dumps({'role': 'station'}),
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('courier_near', [c['username'] for c in self.suggest()])
+        
+        middle = self.couriers['middle']
+        self.assertEqual(self.client.delete(f'/api/users/{middle.id}').status_code, 200)
+        self.assertEqual([c['username'] for c in self.suggest()], ['courier_far'])
+    
+    def test_add_missing_columns(self):
+        """测试旧库的 orders 表自动补加坐标列"""
+        directory = tempfile.mkdtemp()
+        try:
+            engine = create_engine(f'sqlite:///{os.path.join(directory, "old.db")}')
+            with engine.begin() as connection:
+                connection.execute(text('CREATE TABLE orders (id INTEGER PRIMARY KEY, order_no VARCHAR(50) NOT NULL)'))
+            added = add_missing_columns(engine)
+            self.assertIn('orders.latitude', added)
+            self.assertIn('orders.longitude', added)
+            self.assertEqual(add_missing_columns(engine), [])
+            engine.dispose()
+        finally:
+            shutil.rmtree(directory)
+
+
+class BatchDispatchTest(APITestCase):
+    """批量自动派单测试"""
+    
+    def test_plan_balances_load_and_respects_constraints(self):
+        """测试求解器的负载均衡与容量、载重、库存、距离约束"""
+        couriers = [DispatchCourier(1, 39.90, 116.40, 0, 0), DispatchCourier(2, 39.95, 116.40, 0, 0)]
+        orders = [DispatchOrder(i, 39.90, 116.40 + i * 0.001, '15kg', 1) for i in range(4)]
+        assignments, unassigned = plan_dispatch(orders, couriers, {'15kg': 10}, penalty=2, capacity=3)
+        loads = {}
+        for _, delivery_id, _ in assignments:
+            loads[delivery_id] = loads.get(delivery_id, 0) + 1
+        # 4 单都在 1 号附近：1 号接 3 单后满员，第 4 单给约 5.6km 外的 2 号
+        self.assertEqual(loads, {1: 3, 2: 1})
+        self.assertEqual(unassigned, {})
+        
+        # 负载折算距离足够大时两人平分
+        assignments, _ = plan_dispatch(orders, couriers, {'15kg': 10}, penalty=10, capacity=3)
+        self.assertEqual(sorted(d for _, d, _ in assignments), [1, 1, 2, 2])
+        
+        orders += [
+            DispatchOrder(10, None, None, '15kg', 1),
+            DispatchOrder(11, 39.90, 116.40, '50kg', 10),
+            DispatchOrder(12, 31.23, 121.47, '15kg', 1),
+            DispatchOrder(13, 39.90, 116.40, '5kg', 1),
+        ]
+        assignments, unassigned = plan_dispatch(orders, couriers, {'15kg': 3}, capacity=8, max_kg=400)
+        self.assertEqual(len(assignments), 3)
+        self.assertEqual(unassigned, {
+            3: 'out_of_stock', 10: 'no_coordinates', 11: 'over_weight',
+            12: 'no_courier_in_range', 13: 'out_of_stock'
+        })
+        
+        # 已有未完成订单占用容量
+        busy = [DispatchCourier(1, 39.90, 116.40, 8, 0)]
+        _, unassigned = plan_dispatch(orders[:1], busy, {'15kg': 1}, capacity=8)
+        self.assertEqual(unassigned, {0: 'couriers_full'})
+    
+    def seed(self):
+        now = datetime.utcnow()
+        self.delivery.station_id = 1
+        other = User(username='delivery_other', role='delivery', phone='13700137002', station_id=2)
+        other.set_password('123456')
+        station = User(username='station1', role='station', phone='13600136000', station_id=1)
+        station.set_password('123456')
+        db.session.add_all([other, station])
+        db.session.flush()
+        for courier in (self.delivery, other):
+            db.session.add(CourierLocation(delivery_id=courier.id, latitude=39.90, longitude=116.40,
+                                           geohash=encode_geohash(39.90, 116.40), updated_at=now))
+        for i in range(3):
+            db.session.add(Cylinder(serial_code=f'DISPATCH-{i}', specs='15kg', status='in_stock', station_id=1))
+        for i in range(4):
+            db.session.add(Order(order_no=f'ORDDISPATCH{i}', user_id=self.user.id, station_id=1, specs='15kg',
+                                 quantity=1, address='北京市', latitude=39.90 + i * 0.001, longitude=116.40))
+        # 其他站点的订单不参与本站派单
+        self.foreign = Order(order_no='ORDDISPATCH-S2', user_id=self.user.id, station_id=2, specs='15kg',
+                             quantity=1, address='北京市', latitude=39.90, longitude=116.40)
+        db.session.add(self.foreign)
+        db.session.commit()
+        reconcile_inventory()
+        self.other = other
+    
+    def dispatch(self, body=None):
+        response = self.client.post('/api/orders/dispatch', data=json.dumps(body or {}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return json.loads(response.data)
+    
+    def test_dispatch_station(self):
+        """测试站点只调度本站配送员，试算不写入，正式派单更新订单、汇总和事件"""
+        self.seed()
+        self.logout()
+        self.login('station1', '123456')
+        
+        plan = self.dispatch({'dry_run': True, 'station_id': 2})
+        self.assertEqual(plan['station_id'], 1)
+        self.assertEqual(len(plan['assigned']), 3)
+        self.assertEqual(len(plan['unassigned']), 1)
+        self.assertEqual(plan['unassigned'][0]['reason'], 'out_of_stock')
+        self.assertNotIn(self.foreign.id, [a['order_id'] for a in plan['assigned']])
+        self.assertEqual(Order.query.filter_by(status='pending').count(), 5)
+        
+        result = self.dispatch()
+        self.assertEqual(result['couriers'], {str(self.delivery.id): 3})
+        self.assertEqual(Order.query.filter_by(status='assigned', delivery_id=self.delivery.id).count(), 3)
+        self.assertEqual(db.session.get(CourierStat, self.delivery.id).open_count, 3)
+        self.assertEqual(Event.query.filter_by(type='order.assigned').count(), 3)
+        
+        # 库存已被 3 个未完成订单占满，再次派单不再分配
+        result = self.dispatch()
+        self.assertEqual(result['assigned'], [])
+        self.assertEqual(result['unassigned'], [{'order_id': result['unassigned'][0]['order_id'],
+                                                 'reason': 'out_of_stock'}])
+        self.assertEqual(db.session.get(Order, self.foreign.id).status, 'pending')
+    
+    def test_reserve_only_from_order_station(self):
+        """测试订单完成时只从供货站点出库"""
+        self.seed()
+        with self.assertRaises(InsufficientStockError):
+            reserve_cylinders(self.foreign)
+        db.session.rollback()
+        
+        db.session.add(Cylinder(serial_code='DISPATCH-S2', specs='15kg', status='in_stock', station_id=2))
+        db.session.commit()
+        cylinders = reserve_cylinders(db.session.get(Order, self.foreign.id))
+        db.session.commit()
+        self.assertEqual([c.serial_code for c in cylinders], ['DISPATCH-S2'])
+        self.assertEqual(available_stock('15kg', 1), 3)
+        self.assertEqual(available_stock('15kg', 2), 0)
+        
+        # 下单时按供货站点检查库存
+        response = self.client.post('/api/orders', data=json.dumps({'specs': '15kg', 'address': '北京市', 'station_id': 2}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/orders', data=json.dumps({'specs': '15kg', 'address': '北京市', 'station_id': 1}),
+                                    content_type='application/json')
+        self.assertEqual(json.loads(response.data)['station_id'], 1)
+    
+    def test_dispatch_skips_orders_handled_meanwhile(self):
+        """测试求解后被人工分配的订单不会被覆盖"""
+        self.seed()
+        orders = Order.query.order_by(Order.id).all()
+        orders[0].status = 'cancelled'
+        db.session.commit()
+        applied = apply_assignments({o.id: o for o in orders},
+                                    [(o.id, self.delivery.id, 1.0) for o in orders[:2]])
+        db.session.commit()
+        self.assertEqual([order.id for order, _ in applied], [orders[1].id])
+        self.assertEqual(db.session.get(Order, orders[0].id).status, 'cancelled')
+        self.assertEqual(db.session.get(CourierStat, self.delivery.id).open_count, 1)
+    
+    def test_dispatch_validation(self):
+        """测试权限与参数校验"""
+        response = self.client.post('/api/orders/dispatch', data=json.dumps({'limit': 0}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.logout()
+        self.login('delivery1', '123456')
+        self.assertEqual(self.client.post('/api/orders/dispatch').status_code, 403)
+
+
+class RouteSequencingTest(APITestCase):
+    """配送路线规划测试"""
+    
+    def test_sequence_stops(self):
+        """测试开放路线的最近邻 + 2-opt 求解"""
+        start = (39.90, 116.40)
+        stops = [(39.90, 116.40 + k * 0.01) for k in (3, 1, 4, 2)]
+        sequence, legs = sequence_stops(start, stops)
+        self.assertEqual(sequence, [1, 3, 0, 2])
+        self.assertAlmostEqual(sum(legs), haversine_km(39.90, 116.40, 39.90, 116.44), places=6)
+        self.assertEqual(sequence_stops(None, stops)[0][0], 0)
+        self.assertEqual(sequence_stops(start, []), ([], []))
+        
+        # 2-opt 不会比最近邻更长
+        rng = random.Random(7)
+        points = [start] + [(39.9 + rng.uniform(-0.05, 0.05), 116.4 + rng.uniform(-0.05, 0.05)) for _ in range(30)]
+        matrix = distance_matrix(points)
+        greedy = nearest_neighbor(matrix)
+        improved = two_opt(greedy, matrix)
+        self.assertEqual(improved[0], 0)
+        self.assertEqual(sorted(improved), list(range(31)))
+        self.assertLess(path_length(improved, matrix), path_length(greedy, matrix))
+    
+    def seed(self):
+        db.session.add(CourierLocation(delivery_id=self.delivery.id, latitude=39.90, longitude=116.40,
+                                       geohash=encode_geohash(39.90, 116.40), updated_at=datetime.utcnow()))
+        self.orders = []
+        for i, offset in enumerate((0.03, 0.01, None, 0.02)):
+            order = Order(order_no=f'ORDROUTE{i}', user_id=self.user.id, specs='15kg', address=f'地址{i}',
+                          delivery_id=self.delivery.id, status='assigned', assigned_at=datetime.utcnow(),
+                          latitude=None if offset is None else 39.90,
+                          longitude=None if offset is None else 116.40 + offset)
+            db.session.add(order)
+            self.orders.append(order)
+        db.session.commit()
+    
+    def test_courier_route(self):
+        """测试路线顺序、到达时间、无坐标订单和访问权限"""
+        self.seed()
+        self.app.config.update(ROUTE_SPEED_KMH=30, ROUTE_SERVICE_MINUTES=5)
+        response = self.client.get(f'/api/couriers/{self.delivery.id}/route')
+        self.assertEqual(response.status_code, 200, response.data)
+        route = json.loads(response.data)
+        self.assertEqual([stop['order_no'] for stop in route['stops']], ['ORDROUTE1', 'ORDROUTE3', 'ORDROUTE0'])
+        self.assertEqual([u['order_no'] for u in route['unrouted']], ['ORDROUTE2'])
+        etas = [datetime.fromisoformat(stop['eta']) for stop in route['stops']]
+        self.assertTrue(etas[0] < etas[1] < etas[2])
+        # 每段约 0.85km，30km/h 约 1.7 分钟，加 5 分钟停留
+        self.assertAlmostEqual((etas[1] - etas[0]).total_seconds() / 60, 5 + route['stops'][1]['leg_km'] * 2, places=3)
+        self.assertAlmostEqual(route['total_minutes'], route['total_distance_km'] * 2 + 15, places=1)
+        
+        hits = distance_cache_info().hits
+        self.client.get(f'/api/couriers/{self.delivery.id}/route')
+        self.assertGreater(distance_cache_info().hits, hits)
+        
+        self.assertEqual(self.client.get(f'/api/couriers/{self.user.id}/route').status_code, 404)
+        self.logout()
+        self.login('testuser', '123456')
+        self.assertEqual(self.client.get(f'/api/couriers/{self.delivery.id}/route').status_code, 403)
+        self.logout()
+        self.login('delivery1', '123456')
+        self.assertEqual(self.client.get(f'/api/couriers/{self.delivery.id}/route').status_code, 200)
+    
+    def test_route_published_when_delivering(self):
+        """测试订单进入配送中时重新规划并推送路线"""
+        self.seed()
+        response = self.client.put(f'/api/orders/{self.orders[1].id}/status', data=json.dumps({'status': 'delivering'}),
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.data)
+        event = Event.query.filter_by(type='courier.route_updated').one()
+        self.assertEqual(event.delivery_id, self.delivery.id)
+        route = json.loads(event.payload)
+        self.assertEqual(route['stops'][0]['order_no'], 'ORDROUTE1')
+        self.assertEqual(route['stops'][0]['status'], 'delivering')
+
+
+class DemandForecastTest(APITestCase):
+    """需求预测与补货建议测试"""
+    
+    # 与每晚任务一致，汇总截至昨天
+    THROUGH = datetime.utcnow().date() - timedelta(days=1)
+    
+    def test_models(self):
+        """测试季节性朴素法与回测选模型"""
+        week = [2, 2, 2, 2, 2, 4, 4]
+        self.assertEqual(seasonal_naive(week * 3, 9), week + week[:2])
+        self.assertEqual(seasonal_naive([1, 3], 2), [3, 3])
+        
+        model, values, mae = fit_series(week * 5, 7)
+        self.assertEqual(mae, 0)
+        self.assertEqual(values, week)
+        
+        # 无周期的平稳序列选指数平滑，预测接近均值
+        noisy = [4, 6, 6, 4, 5, 6, 5, 6, 6, 4, 6, 4, 5, 5, 6, 4, 4, 6, 5, 6, 6, 5, 5, 6, 4, 4, 6, 4]
+        model, values, mae = fit_series(noisy, 3)
+        self.assertTrue(model.startswith('ses'), model)
+        self.assertTrue(all(4.5 < v < 5.5 for v in values))
+        
+        model, values, _ = fit_series([3, 1], 2)
+        self.assertEqual((model, values), ('seasonal_naive', [1.0, 1.0]))
+    
+    @staticmethod
+    def daily(day):
+        """种子数据的日需求：周末 4 瓶，工作日 2 瓶"""
+        return 4 if day.weekday() >= 5 else 2
+    
+    def seed(self):
+        self.delivery.station_id = 1
+        station = User(username='station1', role='station', phone='13600136000', station_id=1)
+        station.set_password('123456')
+        db.session.add(station)
+        start = self.THROUGH - timedelta(days=34)
+        for k in range(35):
+            day = start + timedelta(days=k)
+            for i in range(self.daily(day)):
+                db.session.add(Order(order_no=f'ORDFC{k:02d}{i}', user_id=self.user.id, specs='15kg', quantity=1,
+                                     delivery_id=self.delivery.id, status='completed',
+                                     created_at=datetime.combine(day, datetime.min.time()) + timedelta(hours=9 + i)))
+        day = datetime.combine(self.THROUGH, datetime.min.time())
+        db.session.add(Order(order_no='ORDFCCANCEL', user_id=self.user.id, specs='15kg', quantity=5,
+                             delivery_id=self.delivery.id, status='cancelled', created_at=day))
+        db.session.add(Order(order_no='ORDFCPENDING', user_id=self.user.id, specs='5kg', quantity=2,
+                             status='pending', created_at=day))
+        for i in range(3):
+            db.session.add(Cylinder(serial_code=f'FC-{i}', specs='15kg', status='in_stock', station_id=1))
+        db.session.commit()
+        reconcile_inventory()
+    
+    def test_refresh_and_restock(self):
+        """测试日需求汇总、预测与补货建议"""
+        self.seed()
+        self.assertEqual(refresh_forecasts(through=self.THROUGH.isoformat()), 2)
+        last_day = db.session.get(DemandDailyStat, (self.THROUGH, 1, '15kg'))
+        self.assertEqual((last_day.quantity, last_day.order_count), (self.daily(self.THROUGH),) * 2)
+        self.assertEqual(db.session.get(DemandDailyStat, (self.THROUGH, 0, '5kg')).quantity, 2)
+        forecast = db.session.get(DemandForecast, (1, '15kg'))
+        self.assertEqual(forecast.start_date, self.THROUGH + timedelta(days=1))
+        self.assertEqual(json.loads(forecast.values)[:7],
+                         [self.daily(forecast.start_date + timedelta(days=k)) for k in range(7)])
+        
+        self.app.config.update(FORECAST_LEAD_DAYS=3)
+        response = self.client.get('/api/stats/forecast')
+        self.assertEqual(response.status_code, 200, response.data)
+        items = {(i['station_id'], i['specs']): i for i in json.loads(response.data)['items']}
+        item = items[(1, '15kg')]
+        # 需求按周严格重复，回测误差为 0，安全库存为 0
+        expected = sum(self.daily(self.THROUGH + timedelta(days=k)) for k in (1, 2, 3))
+        self.assertEqual(item['in_stock'], 3)
+        self.assertEqual(item['lead_demand'], expected)
+        self.assertEqual(item['safety_stock'], 0)
+        self.assertEqual(item['suggested_restock'], expected - 3)
+        self.assertFalse(item['stale'])
+        
+        # 站点只能看到本站；规格参数校验
+        self.logout()
+        self.login('station1', '123456')
+        data = json.loads(self.client.get('/api/stats/forecast?station_id=0').data)
+        self.assertEqual(data['station_id'], 1)
+        self.assertEqual([(i['station_id'], i['specs']) for i in data['items']], [(1, '15kg')])
+        self.assertEqual(self.client.get('/api/stats/forecast?specs=20kg').status_code, 400)
+        self.logout()
+        self.login('testuser', '123456')
+        self.assertEqual(self.client.get('/api/stats/forecast').status_code, 403)
+    
+    def test_incremental_refresh(self):
+        """测试每晚只重算最近几天，并只排定一次下一次刷新"""
+        self.seed()
+        refresh_forecasts(through=self.THROUGH.isoformat())
+        old_day = self.THROUGH - timedelta(days=20)
+        recent_day = self.THROUGH - timedelta(days=2)
+        for order_no, day in (('ORDFCOLD', old_day), ('ORDFCRECENT', recent_day)):
+            db.session.add(Order(order_no=order_no, user_id=self.user.id, specs='15kg', quantity=10,
+                                 delivery_id=self.delivery.id, status='completed',
+                                 created_at=datetime.combine(day, datetime.min.time())))
+        db.session.commit()
+        
+        refresh_forecasts(through=(self.THROUGH + timedelta(days=1)).isoformat())
+        self.assertEqual(db.session.get(DemandDailyStat, (recent_day, 1, '15kg')).quantity, self.daily(recent_day) + 10)
+        self.assertEqual(db.session.get(DemandDailyStat, (old_day, 1, '15kg')).quantity, self.daily(old_day))
+        refresh_forecasts(full=True, through=(self.THROUGH + timedelta(days=1)).isoformat())
+        self.assertEqual(db.session.get(DemandDailyStat, (old_day, 1, '15kg')).quantity, self.daily(old_day) + 10)
+        
+        schedule_next_refresh()
+        db.session.commit()
+        pending = Job.query.filter_by(name='forecast.refresh', status='pending').all()
+        self.assertEqual(len(pending), 1)
+        self.assertGreater(pending[0].run_at, datetime.utcnow())
+
+
 if __name__ == '__main__':
     unittest.main()
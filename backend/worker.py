@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+后台任务 worker，执行接口加入 jobs 表的任务（见 app/jobs.py）
+
+用法:
+    python worker.py                     持续运行，队列为空时按 --poll 秒轮询
+    python worker.py --once              执行当前全部到期任务后退出
+    python worker.py --stats             查看队列深度
+    python worker.py --enqueue events.prune   加入一个维护任务（inventory.reconcile、rollups.rebuild、forecast.refresh 等）
+"""
+import argparse
+import json
+import signal
+
+from app import create_app, db
+from app.jobs import HANDLERS, enqueue, queue_stats, requeue_stale, run_pending, run_worker
+from app.events import schedule_prune
+from app.forecast import schedule_next_refresh
+from app.inventory import schedule_reconcile
+
+app = create_app()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='后台任务 worker')
+    parser.add_argument('--once', action='store_true', help='执行当前到期任务后退出')
+    parser.add_argument('--poll', type=float, default=None, help='队列为空时的轮询间隔（秒）')
+    parser.add_argument('--stats', action='store_true', help='输出队列统计后退出')
+    parser.add_argument('--enqueue', metavar='NAME', choices=sorted(HANDLERS), help='加入一个无参数任务后退出')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.stats:
+            print(json.dumps(queue_stats(), ensure_ascii=False, indent=2))
+            return
+        if args.enqueue:
+            item = enqueue(args.enqueue)
+            db.session.commit()
+            print(f"✓ 已加入任务 {item.id}: {args.enqueue}")
+            return
+        if args.once:
+            requeue_stale()
+            done, failed = run_pending()
+            print(f"✓ 执行完成: 成功 {done}，失败 {failed}")
+            return
+
+        # 收到 SIGTERM / SIGINT 后执行完当前任务再退出
+        stopping = []
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stopping.append(True))
+        # 周期任务（每晚的需求预测刷新、定时库存对账、过期事件清理）执行后会自行排定下一次，这里保证首次启动时已排上
+        schedule_next_refresh()
+        schedule_reconcile()
+        schedule_prune()
+        db.session.commit()
+        print(f"worker 已启动，任务: {', '.join(sorted(HANDLERS))}")
+        run_worker(args.poll, stop=lambda: bool(stopping))
+
+
+if __name__ == '__main__':
+    main()